@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+
+from flask import g, request, Response
+
+import metrics
+
+# Concurrency budget per route class: (max in flight, seconds to wait for a slot,
+# Retry-After seconds on a 503). Checkout has its own slots that reports and the
+# rest of the app can never take; keep the three limits summed at or below the
+# server's worker threads so checkout's share is always really free.
+ROUTE_CLASSES = {
+    'checkout': (int(os.getenv('ADMISSION_CHECKOUT_LIMIT', 8)), 10.0, 1),
+    'default': (int(os.getenv('ADMISSION_DEFAULT_LIMIT', 6)), 2.0, 3),
+    'reports': (int(os.getenv('ADMISSION_REPORTS_LIMIT', 2)), 0.5, 15),
+}
+
+# Endpoint -> route class; anything not listed is 'default'
+ENDPOINT_CLASSES = {
+    'new_sale_form': 'checkout',
+    'sync_holds_api': 'checkout',
+    'release_holds_api': 'checkout',
+    'create_sale_action': 'checkout',
+
+    'dashboard': 'reports',
+    'sales_history': 'reports',
+    'sales_export': 'reports',
+    'sales_report_api': 'reports',
+    'prices_at_api': 'reports',
+    'customer_export': 'reports',
+    'customer_segments': 'reports',
+    'customer_segments_recompute': 'reports',
+    'inventory_report': 'reports',
+    'z_report': 'reports',
+    'z_report_close': 'reports',
+    'category_list': 'reports',
+    'category_products': 'reports',
+    'product_reprice': 'reports',
+}
+
+# Never limited: static files, the long-lived event stream, login, and the
+# admission stats endpoint (so overload stays observable)
+EXEMPT_ENDPOINTS = {'static', 'event_stream', 'auth.login', 'auth.logout', 'admission_stats', 'metrics_endpoint'}
+
+
+class RouteClass:
+    """A counting semaphore with a bounded wait, plus counters for the stats page"""
+    def __init__(self, name, limit, queue_timeout, retry_after):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self):
+        started = time.monotonic()
+        ok = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.wait_seconds += time.monotonic() - started
+            if ok:
+                self.admitted += 1
+                self.in_flight += 1
+            else:
+                self.shed += 1
+        return ok
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'avg_wait_ms': round(1000 * self.wait_seconds / max(self.admitted + self.shed, 1), 1),
+            }
+
+
+route_classes = {name: RouteClass(name, *config) for name, config in ROUTE_CLASSES.items()}
+
+
+def _admit():
+    if request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    route_class = route_classes[ENDPOINT_CLASSES.get(request.endpoint, 'default')]
+    if not route_class.acquire():
+        # Fail fast: the client retries later instead of tying up a worker in a queue
+        return Response(
+            "The system is busy, please retry shortly.\n",
+            status=503,
+            mimetype='text/plain',
+            headers={'Retry-After': str(route_class.retry_after)},
+        )
+    g.admission_slot = route_class
+    return None
+
+
+def _release(exc=None):
+    # Runs after the response is fully sent, so streamed exports hold their slot to the end
+    route_class = g.pop('admission_slot', None)
+    if route_class is not None:
+        route_class.release()
+
+
+def init_admission(app):
+    """Apply the limits to every request of app"""
+    app.before_request(_admit)
+    app.teardown_request(_release)
+
+
+def get_admission_stats():
+    """{route class: {'limit', 'in_flight', 'admitted', 'shed', 'avg_wait_ms'}} since startup"""
+    return {name: rc.stats() for name, rc in route_classes.items()}
+
+
+def _collect():
+    stats = get_admission_stats()
+    return [
+        (f'admission_{field}', kind, help_text,
+         [((('route_class', name),), s[field]) for name, s in stats.items()])
+        for field, kind, help_text in (
+            ('admitted', 'counter', 'Requests given a slot, by route class.'),
+            ('shed', 'counter', 'Requests turned away with 503, by route class.'),
+            ('in_flight', 'gauge', 'Requests holding a slot now, by route class.'),
+            ('limit', 'gauge', 'Slots per route class.'),
+        )
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from db_connect import get_connection
+from locations import COMPANY_STOCK, COMPANY_STOCK_JOIN
+from tracing import traced
+
+# Cumulative revenue share cut-offs for ABC classes
+ABC_CUTOFFS = (0.80, 0.95)
+
+
+def _load_product_columns(window_days, batch_size=20000):
+    """
+    Pull one row per active product with its sales over the window, straight
+    into column arrays. Sales come from the daily product rollups, so this
+    never touches SaleItem directly.
+    """
+    since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=window_days)
+
+    conn = get_connection()
+    if not conn:
+        return None
+
+    ids, names, skus, stock, units, revenue = [], [], [], [], [], []
+    try:
+        with conn.cursor(name='inventory_analysis') as cursor:
+            cursor.execute(f"""
+                SELECT p.product_id, p.product_name, p.sku, {COMPANY_STOCK},
+                       COALESCE(r.units, 0), (COALESCE(r.revenue, 0) * 100)::bigint
+                FROM Product p
+                {COMPANY_STOCK_JOIN}
+                LEFT JOIN (
+                    SELECT dimension_id, SUM(units) AS units, SUM(revenue) AS revenue
+                    FROM SalesRollup
+                    WHERE grain = 'day' AND dimension = 'product' AND bucket_start >= %s
+                    GROUP BY dimension_id
+                ) r ON r.dimension_id = p.product_id
+                WHERE p.is_active = TRUE
+            """, (since,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    ids.append(row[0])
+                    names.append(row[1])
+                    skus.append(row[2])
+                    stock.append(row[3])
+                    units.append(row[4])
+                    revenue.append(row[5])
+    finally:
+        conn.rollback()
+        conn.close()
+
+    return {
+        'product_id': np.array(ids, dtype=np.int64),
+        'name': np.array(names, dtype=object),
+        'sku': np.array(skus, dtype=object),
+        'stock': np.array(stock, dtype=np.float64),
+        'units': np.array(units, dtype=np.float64),
+        'revenue': np.array(revenue, dtype=np.int64),  # cents
+    }
+
+
+def classify_abc(revenue):
+    """
+    'A'/'B'/'C' per element: products are ranked by revenue and classed by
+    the cumulative revenue share of everything ranked above them.
+    """
+    classes = np.full(len(revenue), 'C', dtype='<U1')
+    total = revenue.sum()
+    if total <= 0:
+        return classes
+
+    order = np.argsort(-revenue, kind='stable')
+    share_before = (np.cumsum(revenue[order]) - revenue[order]) / total
+    ranked = np.where(share_before < ABC_CUTOFFS[0], 'A',
+                      np.where(share_before < ABC_CUTOFFS[1], 'B', 'C'))
+    classes[order] = ranked
+    # Products that sold nothing are always C
+    classes[revenue <= 0] = 'C'
+    return classes
+
+
+@traced
+def get_inventory_analysis(window_days=90, top_n=20):
+    """
+    Top sellers, ABC classes, sell-through and days of cover for every active
+    product, computed column-wise over the whole catalog.
+
+    Returns:
+        dict with
+          'window_days', 'product_count',
+          'classes': {class: (product_count, revenue_cents, revenue_share)},
+          'top_sellers': [(product_id, name, sku, units, revenue_cents, abc, sell_through, days_of_cover)],
+          'slow_movers': same shape, most days of cover first (unsold stock first of all)
+    """
+    cols = _load_product_columns(window_days)
+    if cols is None:
+        return {}
+
+    units = cols['units']
+    revenue = cols['revenue']
+    stock = cols['stock']
+    n = len(units)
+
+    abc = classify_abc(revenue)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sell_through = np.where(units + stock > 0, units / (units + stock), 0.0)
+        daily_units = units / window_days
+        days_of_cover = np.where(daily_units > 0, stock / daily_units, np.inf)
+
+    def rows_for(indices):
+        return [
+            (int(cols['product_id'][i]), cols['name'][i], cols['sku'][i], int(units[i]),
+             int(revenue[i]), abc[i], float(sell_through[i]),
+             None if np.isinf(days_of_cover[i]) else float(days_of_cover[i]))
+            for i in indices
+        ]
+
+    k = min(top_n, n)
+    if k:
+        top = np.argpartition(-revenue, k - 1)[:k]
+        top = top[np.argsort(-revenue[top], kind='stable')]
+        # Only products holding stock can be "slow"
+        stocked = np.flatnonzero(stock > 0)
+        ks = min(top_n, len(stocked))
+        slow = stocked[np.argsort(-days_of_cover[stocked], kind='stable')[:ks]]
+    else:
+        top = slow = np.array([], dtype=np.int64)
+
+    total_revenue = revenue.sum()
+    classes = {}
+    for label in ('A', 'B', 'C'):
+        mask = abc == label
+        class_revenue = int(revenue[mask].sum())
+        classes[label] = (int(mask.sum()), class_revenue,
+                          class_revenue / total_revenue if total_revenue > 0 else 0.0)
+
+    return {
+        'window_days': window_days,
+        'product_count': n,
+        'classes': classes,
+        'top_sellers': rows_for(top),
+        'slow_movers': rows_for(slow),
+    }
@@ -1,10 +1,15 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, stream_with_context, stream_template, jsonify, session, g, abort
 from flask_login import LoginManager, login_required, current_user
 import os
+import csv
+import time
+import uuid
+import io
 from dotenv import load_dotenv
 from stats import get_dashboard_stats
-from sale import create_sale, get_sale_history, get_sale_with_items
-from crud_customer import get_all_customers, add_customer, get_customer, update_customer, delete_customer
+from sale import create_sale, get_sale_history, get_items_for_sales, iter_sale_history
+from crud_customer import get_customers_page, iter_customers, add_customer, get_customer, update_customer, delete_customer
+from datetime import date, datetime, timedelta
 from decimal import Decimal, InvalidOperation
 from crud_product import (
     list_products,
@@ -12,6 +17,7 @@ from crud_product import (
     create_product,
     delete_product,
     get_all_products,
+    iter_products,
     get_product,
     update_product,
     update_stock,
@@ -21,8 +27,30 @@ from crud_category import (
     get_category,
     create_category,
     update_category,
+    move_category,
     delete_category,
+    get_subtree_products,
+    iter_subtree_products,
+    get_category_rollups,
 )
+from customer_dedupe import import_customers, find_customer_matches, find_duplicate_candidates, find_shared_phones, merge_customers
+from rollup import get_yoy_series, GRAINS, DIMENSIONS
+from sale_export import export_sales, parse_date_range, EXPORT_FORMATS
+from events import hub, ensure_listener, sse_stream
+from analytics import get_inventory_analysis
+from customer_stats import get_segment_report, get_segment_customers, recompute_customer_stats
+from zreport import build_report, get_report, close_day
+from money import cents_from_units, format_money
+from pricing import bulk_reprice, get_prices_at, get_price_history, REPRICE_MODES, ROUNDING_RULES
+from promotions import PROMOTION_KINDS, list_promotions, create_promotion, deactivate_promotion
+from locations import LOCATION_KINDS, list_locations, create_location, transfer_stock
+from reservations import sync_holds, release_holds
+from idempotency import checkout_results
+from admission import init_admission, get_admission_stats
+import metrics
+from profiler import init_profiler
+from tracing import init_tracing
+from memprofile import init_memory_profile, memory_report, take_baseline, diff_baseline, stop_tracing
 from auth import auth_bp, load_user_from_db, role_required
 
 load_dotenv()
@@ -30,6 +58,11 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "fallback-secret-key-for-development")
 
+# Largest list a page renders in one piece; longer lists are streamed from a
+# server-side cursor so a worker's memory doesn't grow with the table
+LIST_ROW_CAP = int(os.getenv("LIST_ROW_CAP", "500"))
+SALES_HISTORY_LIMIT = int(os.getenv("SALES_HISTORY_LIMIT", "50"))
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -45,6 +78,78 @@ def load_user(operator_id):
 # Register auth blueprint
 app.register_blueprint(auth_bp)
 
+# Request count and latency per route for /metrics; the timer starts before admission
+# so time spent waiting for a slot is included
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.endpoint or 'unknown'
+        metrics.inc('http_requests_total', (('route', route), ('status', str(response.status_code))))
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, (('route', route),))
+    return response
+
+# Request/render/SQL spans to TRACE_FILE, trace ids in logs; a no-op when unset.
+# Installed before admission so shed requests are traced too.
+init_tracing(app)
+
+# Per-route-class concurrency limits; see admission.py for the budgets
+init_admission(app)
+
+# Opt-in stack sampling of selected requests (PROFILE_* in .env); a no-op when unset
+init_profiler(app)
+
+# Per-request peak allocation while tracemalloc runs (see /admin/memory)
+init_memory_profile(app)
+
+def render_rows(template, rows, iter_rows, name='rows', **context):
+    """
+    rows was fetched with a LIST_ROW_CAP + 1 limit. Up to the cap the page is
+    rendered as usual (rows passed as name); past it, the page is streamed
+    from iter_rows() instead.
+    """
+    if len(rows) <= LIST_ROW_CAP:
+        return render_template(template, **{name: rows}, **context)
+    return Response(stream_template(template, **{name: iter_rows()}, **context))
+
+# Money is integer cents in Python; templates format it with {{ value|money }}
+app.add_template_filter(format_money, 'money')
+# Stored Z-report payloads keep their amounts as unit strings ('123.45')
+app.add_template_filter(lambda units: format_money(cents_from_units(units)), 'money_units')
+
+def active_locations():
+    """list_locations() fetched once per request (there is no pool; each call is a new connection)"""
+    if 'active_locations' not in g:
+        g.active_locations = list_locations()
+    return g.active_locations
+
+def current_location_id():
+    """The store this browser session works at (chosen in the navbar); defaults to the first store"""
+    locations = [loc[0] for loc in active_locations()]
+    location_id = session.get('location_id')
+    if location_id not in locations:
+        location_id = locations[0] if locations else None
+        session['location_id'] = location_id
+    return location_id
+
+@app.context_processor
+def inject_locations():
+    if not current_user.is_authenticated:
+        return {}
+    return {'locations': active_locations(), 'current_location': current_location_id()}
+
+@app.route('/location/select', methods=['POST'])
+@login_required
+def location_select():
+    location_id = request.form.get('location_id', type=int)
+    if location_id in [loc[0] for loc in active_locations()]:
+        session['location_id'] = location_id
+    return redirect(request.referrer or url_for('dashboard'))
+
 # Error handlers
 @app.errorhandler(403)
 def forbidden(error):
@@ -59,46 +164,197 @@ def not_found(error):
 @app.route('/')
 @login_required
 def dashboard():
-    stats = get_dashboard_stats()
+    stats = get_dashboard_stats(current_location_id())
     return render_template('index.html', stats=stats)
 
+@app.route('/events')
+@login_required
+def event_stream():
+    """Server-Sent Events feed for open dashboards (low-stock alerts, ...)"""
+    ensure_listener()
+    q = hub.subscribe()
+    return Response(
+        stream_with_context(sse_stream(q)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/reports/sales')
+@login_required
+def sales_report_api():
+    """Revenue series vs. the same period last year, read from SalesRollup only"""
+    grain = request.args.get('grain', 'day')
+    dimension = request.args.get('dimension', 'all')
+    if grain not in GRAINS or dimension not in DIMENSIONS:
+        return jsonify({'error': 'Invalid grain or dimension'}), 400
+
+    periods = min(request.args.get('periods', 30, type=int), 366)
+    dimension_id = request.args.get('id', 0, type=int)
+    return jsonify(get_yoy_series(grain, periods, dimension, dimension_id))
+
+@app.route('/api/admission')
+@login_required
+@role_required('admin')
+def admission_stats():
+    """Admitted/shed request counts and current load per route class"""
+    return jsonify(get_admission_stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target; set METRICS_TOKEN to require 'Authorization: Bearer <token>'"""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/memory')
+@login_required
+@role_required('admin')
+def memory_status():
+    """Traced memory and the largest allocation sites (tracemalloc)"""
+    return jsonify(memory_report())
+
+@app.route('/admin/memory/snapshot', methods=['POST'])
+@login_required
+@role_required('admin')
+def memory_snapshot():
+    """Start tracing if needed and set the baseline for /admin/memory/diff"""
+    return jsonify(take_baseline())
+
+@app.route('/admin/memory/diff')
+@login_required
+@role_required('admin')
+def memory_diff():
+    diff = diff_baseline()
+    if diff is None:
+        return jsonify({'error': 'No baseline; POST /admin/memory/snapshot first'}), 409
+    return jsonify({'growth': diff})
+
+@app.route('/admin/memory/stop', methods=['POST'])
+@login_required
+@role_required('admin')
+def memory_stop():
+    stop_tracing()
+    return jsonify({'tracing': False})
+
+@app.route('/api/prices')
+@login_required
+def prices_at_api():
+    """Catalog list prices at ?at=YYYY-MM-DDTHH:MM (default now), optionally for one category subtree"""
+    try:
+        at = datetime.strptime(request.args['at'], '%Y-%m-%dT%H:%M') if request.args.get('at') else datetime.now()
+    except ValueError:
+        return jsonify({'error': 'Invalid time, expected YYYY-MM-DDTHH:MM'}), 400
+
+    rows = get_prices_at(at, request.args.get('category_id', type=int))
+    return jsonify({
+        'at': at.isoformat(timespec='minutes'),
+        'prices': [{'product_id': r[0], 'sku': r[1], 'product_name': r[2], 'price_cents': r[3]} for r in rows],
+    })
+
 # --- SALE MANAGEMENT (Your Implementation) ---
 
+def sale_entry(sale, items):
+    return {
+        'id': sale[0],
+        'date': sale[1],
+        'operator': sale[2],
+        'customer': sale[3],
+        'total': sale[4],
+        'items': items,
+    }
+
 @app.route('/sales')
 @login_required
 def sales_history():
-    """Display list of past sales transactions"""
-    history = get_sale_history()
-    
-    # Fetch items for each sale
-    sales_with_items = []
-    for sale in history:
-        sale_id = sale[0]
-        items = get_sale_with_items(sale_id)
-        sales_with_items.append({
-            'id': sale[0],
-            'date': sale[1],
-            'operator': sale[2],
-            'customer': sale[3],
-            'total': sale[4],
-            'items': items  # ← 追加
-        })
-    
-    return render_template('sales_history.html', sales=sales_with_items)
+    """Display list of past sales transactions (?limit=N for more than SALES_HISTORY_LIMIT)"""
+    limit = max(request.args.get('limit', SALES_HISTORY_LIMIT, type=int), 1)
+    history = get_sale_history(min(limit, LIST_ROW_CAP + 1))
+    if len(history) <= LIST_ROW_CAP:
+        # Items for all listed sales in one query
+        items_by_sale = get_items_for_sales([sale[0] for sale in history])
+        history = [sale_entry(sale, items_by_sale.get(sale[0], [])) for sale in history]
+
+    return render_rows('sales_history.html', history,
+                       lambda: (sale_entry(sale, items) for sale, items in iter_sale_history(limit)),
+                       name='sales', limit=limit)
+
+@app.route('/sales/export')
+@login_required
+@role_required('admin')
+def sales_export():
+    """Stream sale lines for a date range as CSV or JSON Lines, optionally gzipped"""
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') == '1'
+    try:
+        start, end = parse_date_range(request.args.get('start', ''), request.args.get('end', ''))
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'")
+    except ValueError as e:
+        flash(f'Invalid export request: {e}', 'error')
+        return redirect(url_for('sales_history'))
+
+    filename = f"sales_{request.args['start']}_{request.args['end']}.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    return Response(
+        stream_with_context(export_sales(start, end, fmt, compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
 
 @app.route('/sales/new')
 @login_required
 def new_sale_form():
     """Show the POS form for creating a new sale (uses live products)."""
-    products = get_all_products()  # [(id, name, stock, price)]
-    return render_template('new_sale.html', products=products)
+    products = get_all_products(current_location_id())  # [(id, name, available here, price_cents)]
+    # hold_key identifies this cart's stock holds; checkout_key makes the submit safe to retry
+    return render_template('new_sale.html', products=products, hold_key=uuid.uuid4().hex,
+                           checkout_key=uuid.uuid4().hex)
+
+@app.route('/api/holds/<hold_key>', methods=['PUT'])
+@login_required
+def sync_holds_api(hold_key):
+    """Hold the cart's current lines ({"items": {product_id: qty}}) at the current store"""
+    try:
+        items = {int(pid): int(qty) for pid, qty in (request.get_json(silent=True) or {}).get('items', {}).items()}
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'ok': False, 'message': 'Invalid cart'}), 400
+
+    ok, message = sync_holds(hold_key, current_location_id(), items)
+    return jsonify({'ok': ok, 'message': message}), 200 if ok else 409
+
+@app.route('/api/holds/<hold_key>/release', methods=['POST'])
+@login_required
+def release_holds_api(hold_key):
+    """Drop the cart's holds when its page is left without checking out (sendBeacon)"""
+    ok, message = release_holds(hold_key, current_location_id())
+    return jsonify({'ok': ok, 'message': message}), 200 if ok else 409
+
+def sale_failed(message, hold_key):
+    """
+    Back to a fresh POS form after a failed checkout. The form gets a new
+    hold_key, so the old cart's holds are released now rather than left
+    reserved until the sweeper expires them.
+    """
+    if hold_key:
+        release_holds(hold_key, current_location_id())
+    flash(message, 'error')
+    return redirect(url_for('new_sale_form'))
 
 @app.route('/sales/create', methods=['POST'])
 @login_required
 def create_sale_action():
     """Process the sale form submission"""
+    hold_key = (request.form.get('hold_key') or '')[:64] or None
     try:
         operator_id = current_user.operator_id  # Get from logged-in user
+        checkout_key = (request.form.get('checkout_key') or '')[:64] or None
+
+        # A double submit or network retry of a sale this process already completed
+        replay = checkout_results.get(checkout_key) if checkout_key else None
+        if replay:
+            flash(replay, 'success')
+            return redirect(url_for('sales_history'))
         customer_id = request.form.get('customer_id') or None
         
         items = []
@@ -113,32 +369,30 @@ def create_sale_action():
                 })
         
         if not items:
-            flash('Please add at least one product to the sale', 'error')
-            return redirect(url_for('new_sale_form'))
+            return sale_failed('Please add at least one product to the sale', hold_key)
         
-        success, message = create_sale(operator_id, customer_id, items)
+        success, message = create_sale(operator_id, customer_id, items, current_location_id(),
+                                       hold_key, checkout_key)
         
         if success:
             flash(message, 'success')
             return redirect(url_for('sales_history'))
         else:
-            flash(f'Sale failed: {message}', 'error')
-            return redirect(url_for('new_sale_form'))
+            return sale_failed(f'Sale failed: {message}', hold_key)
             
     except ValueError as e:
-        flash(f'Invalid input: {e}', 'error')
-        return redirect(url_for('new_sale_form'))
+        return sale_failed(f'Invalid input: {e}', hold_key)
     except Exception as e:
-        flash(f'Unexpected error: {e}', 'error')
-        return redirect(url_for('new_sale_form'))
+        return sale_failed(f'Unexpected error: {e}', hold_key)
 
 # --- PLACEHOLDERS FOR TEAMMATES ---
 # Filbert will work here
 @app.route('/products')
 @login_required
 def product_list():
-    rows = list_products()  # [(id, name, sku, price, qty, category_name)]
-    return render_template('products.html', rows=rows)
+    location_id = current_location_id()
+    rows = list_products(location_id, limit=LIST_ROW_CAP + 1)  # [(id, name, sku, price_cents, qty here, category_name)]
+    return render_rows('products.html', rows, lambda: iter_products(location_id))
 
 @app.route('/product/add', methods=['GET', 'POST'])
 @login_required
@@ -157,14 +411,14 @@ def product_add():
             return render_template('add_product.html', categories=categories)
 
         try:
-            qty = int(qty); price = Decimal(price)
+            qty = int(qty); price = cents_from_units(price)
             if qty < 0 or price < 0:
                 raise ValueError
-        except (ValueError, InvalidOperation):
+        except ValueError:
             flash('Quantity and price must be valid non-negative numbers.', 'error')
             return render_template('add_product.html', categories=categories)
 
-        new_id, err = create_product(name, sku, price, qty, int(cat))
+        new_id, err = create_product(name, sku, price, qty, int(cat), current_location_id())
         if err:
             flash(err, 'error')
             return render_template('add_product.html', categories=categories)
@@ -179,7 +433,7 @@ def product_add():
 @role_required('admin')
 def product_edit(id):
     categories = list_categories()
-    product = get_product(id)
+    product = get_product(id, current_location_id())
 
     if not product:
         flash('Product not found.', 'error')
@@ -194,25 +448,70 @@ def product_edit(id):
 
         if not name or not sku or not cat:
             flash('Name, SKU, and Category are required.', 'error')
-            return render_template('edit_product.html', categories=categories, product=product)
+            return render_template('edit_product.html', categories=categories, product=product,
+                           price_history=get_price_history(id))
 
         try:
-            qty = int(qty); price = Decimal(price)
+            qty = int(qty); price = cents_from_units(price)
             if qty < 0 or price < 0:
                 raise ValueError
-        except (ValueError, InvalidOperation):
+        except ValueError:
             flash('Quantity and price must be valid non-negative numbers.', 'error')
-            return render_template('edit_product.html', categories=categories, product=product)
+            return render_template('edit_product.html', categories=categories, product=product,
+                           price_history=get_price_history(id))
 
-        ok, err = update_product(id, name, sku, price, qty, int(cat))
+        ok, err = update_product(id, name, sku, price, qty, int(cat), current_location_id(), current_user.operator_id)
         if err:
             flash(err, 'error')
-            return render_template('edit_product.html', categories=categories, product=product)
+            return render_template('edit_product.html', categories=categories, product=product,
+                           price_history=get_price_history(id))
 
         flash('Product updated.', 'success')
         return redirect(url_for('product_list'))
 
-    return render_template('edit_product.html', categories=categories, product=product)
+    return render_template('edit_product.html', categories=categories, product=product,
+                           price_history=get_price_history(id))
+
+@app.route('/products/reprice', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def product_reprice():
+    """Bulk price change: 'preview' shows the diff, 'apply' writes it in one statement"""
+    categories = get_all_categories()
+    form = request.form
+    result = None
+
+    if request.method == 'POST':
+        try:
+            skus = [s.strip() for s in (form.get('skus') or '').replace(',', '\n').splitlines() if s.strip()]
+            mode = form.get('mode')
+            amount = form.get('amount') or '0'
+            min_price, max_price = form.get('min_price'), form.get('max_price')
+            ok, result = bulk_reprice(
+                mode,
+                # Percent stays a Decimal; an absolute change is money, so cents
+                Decimal(amount) if mode == 'percent' else cents_from_units(amount),
+                rounding=form.get('rounding', 'cent'),
+                category_id=_optional_int(form.get('category_id')),
+                skus=skus or None,
+                min_cents=cents_from_units(min_price) if min_price else None,
+                max_cents=cents_from_units(max_price) if max_price else None,
+                all_products=form.get('all_products') == '1',
+                dry_run=form.get('action') != 'apply',
+                operator_id=current_user.operator_id,
+            )
+        except (ValueError, InvalidOperation):
+            ok, result = False, 'Please enter valid numbers.'
+
+        if not ok:
+            flash(result, 'error')
+            result = None
+        elif form.get('action') == 'apply':
+            flash(f"Repriced {result['changed']} of {result['matched']} matching product(s).", 'success')
+
+    return render_template('reprice.html', categories=categories, modes=REPRICE_MODES,
+                           roundings=list(ROUNDING_RULES), result=result, form=form,
+                           applied=form.get('action') == 'apply')
 
 @app.route('/product/delete/<int:id>', methods=['POST'])
 @login_required
@@ -240,7 +539,7 @@ def product_update_stock():
         flash('Stock must be a non-negative integer.', 'error')
         return redirect(url_for('product_list'))
 
-    ok, msg = update_stock(pid, qty)
+    ok, msg = update_stock(pid, qty, current_location_id())
     flash('Stock updated.' if ok else (msg or 'Update failed.'), 'success' if ok else 'error')
     return redirect(url_for('product_list'))
 
@@ -248,8 +547,35 @@ def product_update_stock():
 @app.route('/customers')
 @login_required
 def customer_list():
-    customers = get_all_customers()
-    return render_template('customers.html', customers=customers)
+    search = (request.args.get('q') or '').strip()
+    after_id = request.args.get('after', type=int)
+    customers, next_after = get_customers_page(after_id=after_id, search=search)
+    return render_template('customers.html', customers=customers, search=search,
+                           after_id=after_id, next_after=next_after)
+
+@app.route('/customers/export')
+@login_required
+@role_required('admin')
+def customer_export():
+    """Stream every customer as CSV without loading the table into memory"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['customer_id', 'customer_name', 'phone', 'created_at'])
+        for i, row in enumerate(iter_customers(), start=1):
+            writer.writerow(row)
+            # Flush roughly every 1000 rows to keep chunks reasonably sized
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=customers.csv'},
+    )
 
 @app.route('/customer/add', methods=['GET', 'POST'])
 @login_required
@@ -259,11 +585,63 @@ def add_customer_page():
         name = request.form['customer_name']
         phone = request.form['phone']
 
+        # Warn before creating what looks like a second copy of someone
+        if not request.form.get('confirm_duplicate'):
+            matches = find_customer_matches(name, phone)
+            if matches:
+                return render_template('add_customer.html', matches=matches, name=name, phone=phone)
+
         add_customer(name, phone)
         return redirect(url_for('customer_list'))
 
     return render_template('add_customer.html')
 
+@app.route('/customers/import', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def customer_import():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file.', 'error')
+            return render_template('customer_import.html')
+
+        ok, result = import_customers(upload.stream)
+        if not ok:
+            flash(result, 'error')
+            return render_template('customer_import.html')
+
+        flash(f"{result['inserted']} of {result['total']} customer(s) imported, "
+              f"{result['duplicates']} duplicate(s) skipped.", 'success')
+        if result['shared_phones']:
+            flash("Some imported customers share a phone with another name; check the list below.", 'info')
+        return render_template('customer_import.html', result=result)
+
+    return render_template('customer_import.html')
+
+@app.route('/customers/duplicates')
+@login_required
+@role_required('admin')
+def customer_duplicates():
+    pairs = find_duplicate_candidates()  # [(keep_id, keep_name, keep_phone, dup_id, dup_name, dup_phone, reason)]
+    shared = find_shared_phones()  # [(phone, customer_count, [names])]
+    return render_template('customer_duplicates.html', pairs=pairs, shared=shared)
+
+@app.route('/customers/merge', methods=['POST'])
+@login_required
+@role_required('admin')
+def customer_merge():
+    try:
+        survivor_id = int(request.form.get('survivor_id', ''))
+        duplicate_ids = [int(d) for d in request.form.getlist('duplicate_id')]
+    except ValueError:
+        flash('Invalid customer IDs.', 'error')
+        return redirect(url_for('customer_duplicates'))
+
+    ok, msg = merge_customers(survivor_id, duplicate_ids)
+    flash(msg, 'success' if ok else 'error')
+    return redirect(url_for('customer_duplicates'))
+
 @app.route('/customer/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def customer_edit(id):
@@ -299,56 +677,212 @@ def customer_delete(id):
     flash('Customer deleted.' if ok else (msg or 'Delete failed.'), 'success' if ok else 'error')
     return redirect(url_for('customer_list'))
 
+# Customer Analytics
+@app.route('/reports/customers')
+@login_required
+@role_required('admin')
+def customer_segments():
+    segment = request.args.get('segment')
+    report = get_segment_report()  # [(segment, customers, total_spend, avg_spend, avg_orders)]
+    customers = get_segment_customers(segment) if segment else []
+    return render_template('customer_segments.html', report=report, segment=segment, customers=customers)
+
+@app.route('/reports/customers/recompute', methods=['POST'])
+@login_required
+@role_required('admin')
+def customer_segments_recompute():
+    ok, msg = recompute_customer_stats()
+    flash(msg, 'success' if ok else 'error')
+    return redirect(url_for('customer_segments'))
+
+# Promotions
+def _optional_int(value):
+    return int(value) if value else None
+
+def _optional_datetime(value):
+    """<input type="datetime-local"> value -> datetime or None"""
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M') if value else None
+
+@app.route('/promotions', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def promotion_list():
+    if request.method == 'POST':
+        form = request.form
+        kind = form.get('kind')
+        try:
+            price = form.get('override_price')
+            percent = form.get('percent_off')
+            ok, msg = create_promotion(
+                (form.get('promotion_name') or '').strip() or kind,
+                kind,
+                # Each type targets either one product or a category subtree
+                product_id=_optional_int(form.get('product_id')) if kind != 'category_percent' else None,
+                category_id=_optional_int(form.get('category_id')) if kind != 'price_override' else None,
+                override_cents=cents_from_units(price) if kind == 'price_override' and price else None,
+                percent_off=Decimal(percent) if kind == 'category_percent' and percent else None,
+                buy_qty=_optional_int(form.get('buy_qty')) if kind == 'buy_x_get_y' else None,
+                free_qty=_optional_int(form.get('free_qty')) if kind == 'buy_x_get_y' else None,
+                starts_at=_optional_datetime(form.get('starts_at')),
+                ends_at=_optional_datetime(form.get('ends_at')),
+            )
+        except (ValueError, InvalidOperation):
+            ok, msg = False, 'Please enter valid numbers and dates.'
+        flash(msg, 'success' if ok else 'error')
+        return redirect(url_for('promotion_list'))
+
+    return render_template('promotions.html', promotions=list_promotions(), kinds=PROMOTION_KINDS,
+                           products=list_products(current_location_id()), categories=get_all_categories())
+
+@app.route('/promotions/<int:id>/end', methods=['POST'])
+@login_required
+@role_required('admin')
+def promotion_end(id):
+    ok, msg = deactivate_promotion(id)
+    flash(msg, 'success' if ok else 'error')
+    return redirect(url_for('promotion_list'))
+
+# Inventory Analytics
+@app.route('/reports/inventory')
+@login_required
+@role_required('admin')
+def inventory_report():
+    window_days = max(1, min(request.args.get('days', 90, type=int), 730))
+    analysis = get_inventory_analysis(window_days)
+    return render_template('inventory_report.html', analysis=analysis, window_days=window_days)
+
+# End-of-day Z-report
+def _parse_report_date(value):
+    """'YYYY-MM-DD' -> date, defaulting to yesterday (the usual day to close)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else date.today() - timedelta(days=1)
+    except ValueError:
+        return date.today() - timedelta(days=1)
+
+@app.route('/reports/z')
+@login_required
+@role_required('admin')
+def z_report():
+    day = _parse_report_date(request.args.get('date'))
+    # A closed day is served from its stored row; an open day is a live preview
+    report = get_report(day)
+    closed = report is not None
+    if not closed:
+        report = build_report(day)
+    return render_template('z_report.html', report=report, day=day, closed=closed,
+                           can_close=not closed and day < date.today())
+
+@app.route('/reports/z/close', methods=['POST'])
+@login_required
+@role_required('admin')
+def z_report_close():
+    day = _parse_report_date(request.form.get('date'))
+    ok, msg = close_day(day, current_user.operator_id)
+    flash(msg, 'success' if ok else 'error')
+    return redirect(url_for('z_report', date=day.isoformat()))
+
+# Stores & Warehouses
+@app.route('/locations', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def location_list():
+    if request.method == 'POST':
+        ok, msg = create_location(request.form.get('location_name') or '', request.form.get('kind', 'store'))
+        flash(msg, 'success' if ok else 'error')
+        return redirect(url_for('location_list'))
+
+    return render_template('locations.html', all_locations=list_locations(active_only=False),
+                           kinds=LOCATION_KINDS, products=list_products(current_location_id()))
+
+@app.route('/locations/transfer', methods=['POST'])
+@login_required
+@role_required('admin')
+def location_transfer():
+    try:
+        ok, msg = transfer_stock(int(request.form['product_id']), int(request.form['from_location_id']),
+                                 int(request.form['to_location_id']), int(request.form['quantity']))
+    except (KeyError, ValueError):
+        ok, msg = False, 'Choose a product, two locations and a whole quantity.'
+    flash(msg, 'success' if ok else 'error')
+    return redirect(url_for('location_list'))
+
 # Category Management
+def _parse_parent_id(value):
+    """Form value for the parent dropdown -> int or None (root)"""
+    return int(value) if value else None
+
 @app.route('/categories')
 @login_required
 def category_list():
-    categories = get_all_categories()
-    return render_template('categories.html', categories=categories)
+    categories = get_all_categories()  # [(id, name, parent_id, depth)]
+    rollups = get_category_rollups()   # {id: (product_count, stock, revenue_cents)}
+    return render_template('categories.html', categories=categories, rollups=rollups)
+
+@app.route('/category/<int:id>/products')
+@login_required
+def category_products(id):
+    category = get_category(id)
+
+    if not category:
+        flash('Category not found.', 'error')
+        return redirect(url_for('category_list'))
+
+    rows = get_subtree_products(id, limit=LIST_ROW_CAP + 1)  # [(id, name, sku, price_cents, qty, category_name)]
+    return render_rows('products.html', rows, lambda: iter_subtree_products(id), category=category)
 
 @app.route('/category/add', methods=['GET', 'POST'])
 @login_required
 @role_required('admin')
 def category_add():
+    categories = get_all_categories()
     if request.method == 'POST':
         name = (request.form.get('category_name') or '').strip()
 
         if not name:
             flash('Category name is required.', 'error')
-            return render_template('add_category.html')
+            return render_template('add_category.html', categories=categories)
+
+        ok, err = create_category(name, _parse_parent_id(request.form.get('parent_id')))
+        if err:
+            flash(err, 'error')
+            return render_template('add_category.html', categories=categories)
 
-        create_category(name)
         flash('Category created successfully.', 'success')
         return redirect(url_for('category_list'))
 
-    return render_template('add_category.html')
+    return render_template('add_category.html', categories=categories)
 
 @app.route('/category/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 @role_required('admin')
 def category_edit(id):
-    category = get_category(id)
+    category = get_category(id)  # (id, name, parent_id)
 
     if not category:
         flash('Category not found.', 'error')
         return redirect(url_for('category_list'))
 
+    categories = get_all_categories()
+
     if request.method == 'POST':
         name = (request.form.get('category_name') or '').strip()
+        parent_id = _parse_parent_id(request.form.get('parent_id'))
 
         if not name:
             flash('Category name is required.', 'error')
-            return render_template('edit_category.html', category=category)
+            return render_template('edit_category.html', category=category, categories=categories)
 
         ok, err = update_category(id, name)
+        if not err and parent_id != category[2]:
+            ok, err = move_category(id, parent_id)
         if err:
             flash(err, 'error')
-            return render_template('edit_category.html', category=category)
+            return render_template('edit_category.html', category=category, categories=categories)
 
         flash('Category updated successfully.', 'success')
         return redirect(url_for('category_list'))
 
-    return render_template('edit_category.html', category=category)
+    return render_template('edit_category.html', category=category, categories=categories)
 
 @app.route('/category/delete/<int:id>', methods=['POST'])
 @login_required
@@ -3,6 +3,7 @@ from flask_login import LoginManager, UserMixin, login_user, logout_user, login_
 from functools import wraps
 import bcrypt
 from db_connect import get_connection
+from tracing import log
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -74,7 +75,7 @@ def load_user_from_db(operator_id):
         return None
 
     except Exception as e:
-        print(f"Error loading user: {e}")
+        log(f"Error loading user: {e}")
         return None
     finally:
         if cursor:
@@ -99,7 +100,7 @@ def verify_password(plain_password, password_hash):
         password_bytes = plain_password.encode('utf-8')
         return bcrypt.checkpw(password_bytes, hash_bytes)
     except Exception as e:
-        print(f"Password verification error: {e}")
+        log(f"Password verification error: {e}")
         return False
 
 
@@ -130,19 +131,19 @@ def authenticate_user(username, password):
         result = cursor.fetchone()
 
         if not result:
-            print(f"User '{username}' not found")
+            log(f"User '{username}' not found")
             return None
 
         operator_id, username, password_hash, operator_name, role, is_active = result
 
         # Check if account is active
         if not is_active:
-            print(f"User '{username}' account is inactive")
+            log(f"User '{username}' account is inactive")
             return None
 
         # Verify password
         if not verify_password(password, password_hash):
-            print(f"Invalid password for user '{username}'")
+            log(f"Invalid password for user '{username}'")
             return None
 
         # Authentication successful
@@ -155,7 +156,7 @@ def authenticate_user(username, password):
         )
 
     except Exception as e:
-        print(f"Authentication error: {e}")
+        log(f"Authentication error: {e}")
         return None
     finally:
         if cursor:
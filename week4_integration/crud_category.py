@@ -1,31 +1,68 @@
 from db_connect import get_connection
+from tracing import traced, log
+from locations import COMPANY_STOCK, COMPANY_STOCK_JOIN
+from promotions import refresh_effective_prices
 
-def create_category(name):
+# Advisory lock key serialising changes to the category tree
+CATEGORY_TREE_LOCK = 2601
+
+
+def lock_category_tree(cursor):
+    """
+    Held until the transaction ends by every change to the tree. The cycle
+    check in move_category reads CategoryClosure and nothing else would stop
+    two crossing moves (A under B, B under A) from both passing it.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CATEGORY_TREE_LOCK,))
+
+@traced
+def create_category(name, parent_id=None):
+    """Create a category, optionally under a parent, and record its closure rows"""
     conn = get_connection()
     if not conn:
-        print("Connection failed.")
-        return
+        log("Connection failed.")
+        return False, "Connection failed"
 
     cursor = None
     try:
         cursor = conn.cursor()
-        query = "INSERT INTO category (category_name) VALUES (%s)"
-
-        cursor.execute(query, (name,))
+        lock_category_tree(cursor)
+        query = "INSERT INTO category (category_name, parent_id) VALUES (%s, %s) RETURNING category_id"
+
+        cursor.execute(query, (name, parent_id))
+        category_id = cursor.fetchone()[0]
+
+        # Self row plus one row per ancestor of the parent
+        closure_query = """
+            INSERT INTO CategoryClosure (ancestor_id, descendant_id, depth)
+            SELECT %s, %s, 0
+            UNION ALL
+            SELECT ancestor_id, %s, depth + 1
+            FROM CategoryClosure
+            WHERE descendant_id = %s
+        """
+        cursor.execute(closure_query, (category_id, category_id, category_id, parent_id))
         conn.commit()
 
-        print(f"category '{name}' added successfully.")
+        log(f"category '{name}' added successfully.")
+        return True, None
 
     except Exception as e:
-        print(f"Error adding category: {e}")
+        log(f"Error adding category: {e}")
         conn.rollback()
+        return False, f"Error adding category: {e}"
 
     finally:
         if cursor:
             cursor.close()
         conn.close()
 
+@traced
 def get_all_categories():
+    """
+    Returns every category in tree order:
+    [(category_id, category_name, parent_id, depth)]
+    """
     conn = get_connection()
     if not conn:
         return []
@@ -33,7 +70,15 @@ def get_all_categories():
     cursor = None
     try:
         cursor = conn.cursor()
-        query = "SELECT category_id, category_name FROM category ORDER BY category_id ASC"
+        # Sort by the name path from the root so children follow their parent
+        query = """
+            SELECT c.category_id, c.category_name, c.parent_id, MAX(cc.depth) AS depth
+            FROM category c
+            JOIN CategoryClosure cc ON cc.descendant_id = c.category_id
+            JOIN category a ON a.category_id = cc.ancestor_id
+            GROUP BY c.category_id, c.category_name, c.parent_id
+            ORDER BY string_agg(lower(a.category_name) || '#' || a.category_id, '/' ORDER BY cc.depth DESC)
+        """
 
         cursor.execute(query)
         results = cursor.fetchall()
@@ -41,7 +86,7 @@ def get_all_categories():
         return results
 
     except Exception as e:
-        print(f"Error fetching categories: {e}")
+        log(f"Error fetching categories: {e}")
         return []
 
     finally:
@@ -49,6 +94,7 @@ def get_all_categories():
             cursor.close()
         conn.close()
 
+@traced
 def get_category(category_id):
     """Get a single category by ID"""
     conn = get_connection()
@@ -58,13 +104,13 @@ def get_category(category_id):
     cursor = None
     try:
         cursor = conn.cursor()
-        query = "SELECT category_id, category_name FROM category WHERE category_id = %s"
+        query = "SELECT category_id, category_name, parent_id FROM category WHERE category_id = %s"
         cursor.execute(query, (category_id,))
         result = cursor.fetchone()
         return result
 
     except Exception as e:
-        print(f"Error fetching category: {e}")
+        log(f"Error fetching category: {e}")
         return None
 
     finally:
@@ -72,6 +118,7 @@ def get_category(category_id):
             cursor.close()
         conn.close()
 
+@traced
 def update_category(category_id, name):
     """Update a category name"""
     conn = get_connection()
@@ -99,8 +146,78 @@ def update_category(category_id, name):
             cursor.close()
         conn.close()
 
+@traced
+def move_category(category_id, new_parent_id):
+    """
+    Re-parent a category (and its whole subtree).
+    new_parent_id=None makes it a root category.
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Connection failed"
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        lock_category_tree(cursor)
+
+        # A category cannot move underneath itself
+        if new_parent_id is not None:
+            cursor.execute(
+                "SELECT 1 FROM CategoryClosure WHERE ancestor_id = %s AND descendant_id = %s",
+                (category_id, new_parent_id),
+            )
+            if cursor.fetchone():
+                conn.rollback()
+                return False, "Cannot move a category under itself or one of its subcategories"
+
+        cursor.execute(
+            "UPDATE category SET parent_id = %s WHERE category_id = %s",
+            (new_parent_id, category_id),
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False, "Category not found"
+
+        # Detach: drop links from the old ancestors to every node in the subtree
+        detach_query = """
+            DELETE FROM CategoryClosure
+            WHERE descendant_id IN (SELECT descendant_id FROM CategoryClosure WHERE ancestor_id = %s)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM CategoryClosure WHERE ancestor_id = %s)
+        """
+        cursor.execute(detach_query, (category_id, category_id))
+
+        # Attach: link every new ancestor to every node in the subtree
+        attach_query = """
+            INSERT INTO CategoryClosure (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM CategoryClosure a
+            CROSS JOIN CategoryClosure d
+            WHERE a.descendant_id = %s AND d.ancestor_id = %s
+        """
+        cursor.execute(attach_query, (new_parent_id, category_id))
+
+        # Category promotions now reach a different set of products: the moved subtree's
+        refresh_effective_prices(cursor, category_id=category_id)
+        conn.commit()
+
+        return True, None
+
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error moving category: {e}"
+
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+@traced
 def delete_category(category_id):
-    """Delete a category if not referenced by products"""
+    """
+    Delete a category if not referenced by products.
+    Its subcategories move up to the deleted category's parent.
+    """
     conn = get_connection()
     if not conn:
         return False, "Connection failed"
@@ -108,6 +225,7 @@ def delete_category(category_id):
     cursor = None
     try:
         cursor = conn.cursor()
+        lock_category_tree(cursor)
 
         # Check if category is used by any products
         check_query = "SELECT COUNT(*) FROM product WHERE category_id = %s"
@@ -115,16 +233,37 @@ def delete_category(category_id):
         count = cursor.fetchone()[0]
 
         if count > 0:
+            conn.rollback()
             return False, f"Cannot delete category: {count} product(s) still using this category"
 
-        # Delete category
+        # Paths that ran through this category become one level shorter
+        shorten_query = """
+            UPDATE CategoryClosure
+               SET depth = depth - 1
+             WHERE ancestor_id IN (SELECT ancestor_id FROM CategoryClosure
+                                   WHERE descendant_id = %s AND depth > 0)
+               AND descendant_id IN (SELECT descendant_id FROM CategoryClosure
+                                     WHERE ancestor_id = %s AND depth > 0)
+        """
+        cursor.execute(shorten_query, (category_id, category_id))
+
+        # Hand direct children over to the grandparent
+        reparent_query = """
+            UPDATE category
+               SET parent_id = (SELECT parent_id FROM category WHERE category_id = %s)
+             WHERE parent_id = %s
+        """
+        cursor.execute(reparent_query, (category_id, category_id))
+
+        # Delete category (its own closure rows cascade)
         delete_query = "DELETE FROM category WHERE category_id = %s"
         cursor.execute(delete_query, (category_id,))
-        conn.commit()
 
         if cursor.rowcount == 0:
+            conn.rollback()
             return False, "Category not found"
 
+        conn.commit()
         return True, None
 
     except Exception as e:
@@ -136,6 +275,108 @@ def delete_category(category_id):
             cursor.close()
         conn.close()
 
+SUBTREE_PRODUCTS_SQL = f"""
+  SELECT p.product_id, p.product_name, p.sku, (p.price * 100)::bigint, {COMPANY_STOCK},
+         c.category_name
+  FROM CategoryClosure cc
+  JOIN product p ON p.category_id = cc.descendant_id
+  {COMPANY_STOCK_JOIN}
+  JOIN category c ON c.category_id = p.category_id
+  WHERE cc.ancestor_id = %s AND p.is_active = TRUE
+  ORDER BY p.product_name
+"""
+
+@traced
+def get_subtree_products(category_id, limit=None):
+    """
+    Returns active products in a category or any of its subcategories:
+    [(id, name, sku, price_cents, qty, category_name)], at most limit rows (None = all)
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SUBTREE_PRODUCTS_SQL + " LIMIT %s", (category_id, limit))
+        return cursor.fetchall()
+
+    except Exception as e:
+        log(f"Error fetching subtree products: {e}")
+        return []
+
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+def iter_subtree_products(category_id, batch_size=1000):
+    """Same rows as get_subtree_products from a named cursor, for streamed pages"""
+    conn = get_connection()
+    if not conn:
+        return
+
+    try:
+        with conn.cursor(name='subtree_products') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(SUBTREE_PRODUCTS_SQL, (category_id,))
+            for row in cursor:
+                yield row
+    finally:
+        conn.rollback()
+        conn.close()
+
+@traced
+def get_category_rollups(category_id=None):
+    """
+    Product count, stock and revenue summed over each category's whole subtree.
+    Returns {category_id: (product_count, total_stock, revenue_cents)};
+    pass category_id to roll up a single subtree.
+    """
+    sql = f"""
+      WITH product_totals AS (
+          SELECT p.category_id, COUNT(*) AS product_count, SUM({COMPANY_STOCK}) AS total_stock
+          FROM product p
+          {COMPANY_STOCK_JOIN}
+          WHERE p.is_active = TRUE
+          GROUP BY p.category_id
+      ),
+      sales_totals AS (
+          SELECT p.category_id, SUM(si.subtotal) AS revenue
+          FROM SaleItem si
+          JOIN product p ON p.product_id = si.product_id
+          GROUP BY p.category_id
+      )
+      SELECT cc.ancestor_id,
+             COALESCE(SUM(pt.product_count), 0),
+             COALESCE(SUM(pt.total_stock), 0),
+             (COALESCE(SUM(st.revenue), 0) * 100)::bigint
+      FROM CategoryClosure cc
+      LEFT JOIN product_totals pt ON pt.category_id = cc.descendant_id
+      LEFT JOIN sales_totals st ON st.category_id = cc.descendant_id
+      WHERE %(root)s IS NULL OR cc.ancestor_id = %(root)s
+      GROUP BY cc.ancestor_id;
+    """
+    conn = get_connection()
+    if not conn:
+        return {}
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, {"root": category_id})
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    except Exception as e:
+        log(f"Error fetching category rollups: {e}")
+        return {}
+
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
 
 # Test
 if __name__ == "__main__":    
@@ -1,23 +1,108 @@
 # crud_customer.py
+import re
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from db_connect import get_connection
+from db_connect import get_connection, TimedRealDictCursor
+from tracing import traced, log
 from datetime import datetime
 
-# GET ALL CUSTOMERS
-def get_all_customers():
+CUSTOMER_PAGE_SIZE = 50
+CUSTOMER_COLUMNS = "customer_id, customer_name, phone, created_at"
+
+
+def normalize_phone(phone):
+    """Digits only, matching the generated customer.phone_normalized column"""
+    return re.sub(r'[^0-9]', '', phone or '')
+
+
+def _like_prefix(term):
+    """Escape LIKE wildcards so user input is matched literally as a prefix"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# LIST / SEARCH CUSTOMERS (keyset paginated)
+@traced
+def get_customers_page(after_id=None, limit=CUSTOMER_PAGE_SIZE, search=None):
+    """
+    One page of customers ordered by customer_id.
+
+    Args:
+        after_id (int or None): Last customer_id of the previous page.
+        limit (int): Page size.
+        search (str or None): Phone number (any formatting) or name prefix.
+
+    Returns:
+        (list, int or None): (rows, after_id for the next page or None if last page)
+    """
+    conditions = ["(%(after)s IS NULL OR customer_id > %(after)s)"]
+    params = {"after": after_id, "limit": limit + 1}
+
+    search = (search or '').strip()
+    if search:
+        # Anything that is only digits and phone punctuation is a phone search
+        if re.fullmatch(r'[0-9+()\-\s]+', search) and normalize_phone(search):
+            conditions.append("phone_normalized LIKE %(prefix)s")
+            params["prefix"] = _like_prefix(normalize_phone(search))
+        else:
+            conditions.append("lower(customer_name) LIKE %(prefix)s")
+            params["prefix"] = _like_prefix(search.lower())
+
+    query = f'''
+        SELECT {CUSTOMER_COLUMNS}
+        FROM customer
+        WHERE {" AND ".join(conditions)}
+        ORDER BY customer_id ASC
+        LIMIT %(limit)s
+    '''
+
     conn = get_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if not conn:
+        return [], None
 
-    cur.execute('SELECT * FROM customer ORDER BY customer_id ASC;')
-    rows = cur.fetchall()
+    cursor = None
+    try:
+        cursor = conn.cursor(cursor_factory=TimedRealDictCursor)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
 
-    cur.close()
-    conn.close()
-    return rows
+        # We fetched one extra row to know whether another page exists
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1]['customer_id']
+        return rows, None
+
+    except Exception as e:
+        log(f"Error fetching customers: {e}")
+        return [], None
+
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+
+# STREAM ALL CUSTOMERS (server-side cursor)
+def iter_customers(batch_size=2000):
+    """
+    Yields (customer_id, customer_name, phone, created_at) for every customer.
+    Uses a named (server-side) cursor so only batch_size rows are held in memory.
+    """
+    conn = get_connection()
+    if not conn:
+        return
+
+    try:
+        with conn.cursor(name='customer_export') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(f"SELECT {CUSTOMER_COLUMNS} FROM customer ORDER BY customer_id ASC")
+            for row in cursor:
+                yield row
+    finally:
+        conn.rollback()
+        conn.close()
 
 
 # ADD CUSTOMER
+@traced
 def add_customer(name, phone):
     conn = get_connection()
     cur = conn.cursor()
@@ -34,6 +119,7 @@ def add_customer(name, phone):
     conn.close()
 
 # GET SINGLE CUSTOMER
+@traced
 def get_customer(customer_id):
     """Get a single customer by ID"""
     conn = get_connection()
@@ -42,14 +128,14 @@ def get_customer(customer_id):
 
     cursor = None
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor(cursor_factory=TimedRealDictCursor)
         query = "SELECT * FROM customer WHERE customer_id = %s"
         cursor.execute(query, (customer_id,))
         result = cursor.fetchone()
         return result
 
     except Exception as e:
-        print(f"Error fetching customer: {e}")
+        log(f"Error fetching customer: {e}")
         return None
 
     finally:
@@ -58,6 +144,7 @@ def get_customer(customer_id):
         conn.close()
 
 # UPDATE CUSTOMER
+@traced
 def update_customer(customer_id, name, phone):
     """Update a customer's information"""
     conn = get_connection()
@@ -86,6 +173,7 @@ def update_customer(customer_id, name, phone):
         conn.close()
 
 # DELETE CUSTOMER
+@traced
 def delete_customer(customer_id):
     """Delete a customer if not referenced by sales"""
     conn = get_connection()
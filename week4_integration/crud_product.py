@@ -1,42 +1,98 @@
 from db_connect import get_connection
-from decimal import Decimal
+from tracing import traced
 from psycopg2 import errors
+from money import from_cents
+from promotions import EFFECTIVE_PRICE_JOIN, EFFECTIVE_PRICE_CENTS, refresh_effective_prices
+from pricing import record_price
 
-def get_all_products():
+def record_stock_movement(cur, location_id: int, product_id: int, change: int, reason: str, sale_id=None):
+    """
+    Append one StockMovement row on the caller's cursor, so it commits with
+    the stock change it describes. reason: initial, sale, adjustment, transfer, correction.
+    """
+    if change == 0:
+        return
+    cur.execute(
+        "INSERT INTO StockMovement (location_id, product_id, sale_id, change, reason) VALUES (%s, %s, %s, %s, %s);",
+        (location_id, product_id, sale_id, change, reason),
+    )
+
+def _set_location_stock(cur, location_id: int, pid: int, new_stock: int):
+    """Set one location's stock of a product (creating the row if needed) and log the delta"""
+    cur.execute("""
+      INSERT INTO LocationStock (location_id, product_id, quantity) VALUES (%s, %s, 0)
+      ON CONFLICT (location_id, product_id) DO NOTHING;
+    """, (location_id, pid))
+    cur.execute("SELECT quantity FROM LocationStock WHERE location_id = %s AND product_id = %s FOR UPDATE;",
+                (location_id, pid))
+    old_stock = cur.fetchone()[0]
+    cur.execute("UPDATE LocationStock SET quantity = %s WHERE location_id = %s AND product_id = %s;",
+                (new_stock, location_id, pid))
+    record_stock_movement(cur, location_id, pid, new_stock - old_stock, 'adjustment')
+
+@traced
+def get_all_products(location_id: int):
     """
     Returns products for POS dropdown in shape:
-    [(product_id, product_name, quantity_stock, price)]
-    Only active products, sorted by name.
+    [(product_id, product_name, quantity_stock, price_cents)]
+    Only active products, sorted by name. quantity_stock is what location_id
+    can sell (on hand minus holds); price_cents is the promotional price if any.
     """
-    sql = """
-        SELECT product_id, product_name, quantity_stock, price
-        FROM product
-        WHERE is_active = TRUE
-        ORDER BY product_name;
+    sql = f"""
+        SELECT p.product_id, p.product_name, GREATEST(COALESCE(ls.quantity - ls.reserved, 0), 0), {EFFECTIVE_PRICE_CENTS}
+        FROM product p
+        LEFT JOIN LocationStock ls ON ls.location_id = %s AND ls.product_id = p.product_id
+        {EFFECTIVE_PRICE_JOIN}
+        WHERE p.is_active = TRUE
+        ORDER BY p.product_name;
     """
     conn = get_connection()
     with conn, conn.cursor() as cur:
-        cur.execute(sql)
+        cur.execute(sql, (location_id,))
         rows = cur.fetchall()
     conn.close()
     return rows
 
-def list_products():
-    sql = """
-      SELECT p.product_id, p.product_name, p.sku, p.price, p.quantity_stock,
-             c.category_name
-      FROM product p
-      JOIN category c ON c.category_id = p.category_id
-      WHERE p.is_active = TRUE
-      ORDER BY p.product_name;
-    """
+LIST_PRODUCTS_SQL = """
+  SELECT p.product_id, p.product_name, p.sku, (p.price * 100)::bigint, COALESCE(ls.quantity, 0),
+         c.category_name
+  FROM product p
+  JOIN category c ON c.category_id = p.category_id
+  LEFT JOIN LocationStock ls ON ls.location_id = %s AND ls.product_id = p.product_id
+  WHERE p.is_active = TRUE
+  ORDER BY p.product_name
+"""
+
+@traced
+def list_products(location_id: int, limit=None):
+    """At most limit rows (None = all); see iter_products for lists too big to hold"""
     conn = get_connection()
     with conn, conn.cursor() as cur:
-        cur.execute(sql)
+        cur.execute(LIST_PRODUCTS_SQL + " LIMIT %s", (location_id, limit))
         rows = cur.fetchall()
     conn.close()
-    return rows  # [(id,name,sku,price,qty,category_name)]
+    return rows  # [(id,name,sku,price_cents,qty_at_location,category_name)]
+
+def iter_products(location_id: int, batch_size=1000):
+    """
+    Yields the same rows as list_products from a named (server-side) cursor,
+    so a streamed page only holds batch_size rows at a time.
+    """
+    conn = get_connection()
+    if not conn:
+        return
 
+    try:
+        with conn.cursor(name='product_list') as cur:
+            cur.itersize = batch_size
+            cur.execute(LIST_PRODUCTS_SQL, (location_id,))
+            for row in cur:
+                yield row
+    finally:
+        conn.rollback()
+        conn.close()
+
+@traced
 def list_categories():
     sql = "SELECT category_id, category_name FROM category ORDER BY category_name;"
     conn = get_connection()
@@ -46,52 +102,78 @@ def list_categories():
     conn.close()
     return rows  # [(id, name)]
 
-def create_product(name: str, sku: str, price: Decimal, qty: int, category_id: int):
+@traced
+def create_product(name: str, sku: str, price_cents: int, qty: int, category_id: int, location_id: int):
+    """Opening stock qty is placed at location_id"""
     sql = """
-      INSERT INTO product (product_name, sku, price, quantity_stock, category_id)
-      VALUES (%s, %s, %s, %s, %s)
+      INSERT INTO product (product_name, sku, price, category_id)
+      VALUES (%s, %s, %s, %s)
       RETURNING product_id;
     """
     conn = get_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(sql, (name.strip(), sku.strip(), price, qty, category_id))
+            cur.execute(sql, (name.strip(), sku.strip(), from_cents(price_cents), category_id))
             new_id = cur.fetchone()[0]
+            cur.execute("INSERT INTO LocationStock (location_id, product_id, quantity) VALUES (%s, %s, %s);",
+                        (location_id, new_id, qty))
+            record_stock_movement(cur, location_id, new_id, qty, 'initial')
+            record_price(cur, new_id, from_cents(price_cents), 'initial')
+            # Category promotions reach the new product now, not at the next scheduled refresh
+            refresh_effective_prices(cur, product_ids=[new_id])
         return new_id, None
     except errors.UniqueViolation:
         conn.rollback()
         return None, "SKU already exists."
     except errors.ForeignKeyViolation:
         conn.rollback()
-        return None, "Invalid category."
+        return None, "Invalid category or location."
     finally:
         conn.close()
 
-def get_product(pid: int):
+@traced
+def get_product(pid: int, location_id: int):
+    """(id, name, sku, price_cents, qty_at_location, category_id) or None"""
     sql = """
-      SELECT product_id, product_name, sku, price, quantity_stock, category_id
-      FROM product WHERE product_id = %s;
+      SELECT p.product_id, p.product_name, p.sku, (p.price * 100)::bigint, COALESCE(ls.quantity, 0), p.category_id
+      FROM product p
+      LEFT JOIN LocationStock ls ON ls.location_id = %s AND ls.product_id = p.product_id
+      WHERE p.product_id = %s;
     """
     conn = get_connection()
     with conn, conn.cursor() as cur:
-        cur.execute(sql, (pid,))
+        cur.execute(sql, (location_id, pid))
         row = cur.fetchone()
     conn.close()
     return row
 
-def update_product(pid: int, name: str, sku: str, price: Decimal, qty: int, category_id: int):
+@traced
+def update_product(pid: int, name: str, sku: str, price_cents: int, qty: int, category_id: int,
+                   location_id: int, changed_by=None):
+    """qty is the stock at location_id; other locations are untouched"""
     sql = """
       UPDATE product
-         SET product_name=%s, sku=%s, price=%s, quantity_stock=%s, category_id=%s
+         SET product_name=%s, sku=%s, price=%s, category_id=%s
        WHERE product_id=%s;
     """
     conn = get_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(sql, (name.strip(), sku.strip(), price, qty, category_id, pid))
-            if cur.rowcount == 0:
+            # Lock the row first so the price history records the real change
+            cur.execute("SELECT price, category_id FROM product WHERE product_id = %s FOR UPDATE;", (pid,))
+            row = cur.fetchone()
+            if not row:
                 conn.rollback()
                 return False, "Product not found."
+            old_price, old_category_id = row
+            new_price = from_cents(price_cents)
+            cur.execute(sql, (name.strip(), sku.strip(), new_price, category_id, pid))
+            _set_location_stock(cur, location_id, pid, qty)
+            if new_price != old_price:
+                record_price(cur, pid, new_price, 'edit', changed_by)
+            if category_id != old_category_id:
+                # Category promotions follow the product to its new category
+                refresh_effective_prices(cur, product_ids=[pid])
         return True, None
     except errors.UniqueViolation:
         conn.rollback()
@@ -101,6 +183,7 @@ def update_product(pid: int, name: str, sku: str, price: Decimal, qty: int, cate
     finally:
         conn.close()
 
+@traced
 def delete_product(pid: int):
     """Delete if not in sales, otherwise soft delete"""
     conn = get_connection()
@@ -124,25 +207,20 @@ def delete_product(pid: int):
     finally:
         conn.close()
 
-def update_stock(pid: int, new_stock: int):
+@traced
+def update_stock(pid: int, new_stock: int, location_id: int):
     """
-    Set product.quantity_stock = new_stock.
+    Set the stock of a product at one location to new_stock.
     Returns (ok, msg) where ok is True/False.
     """
-    sql = """
-      UPDATE product
-         SET quantity_stock = %s
-       WHERE product_id = %s
-       RETURNING product_id;
-    """
     conn = get_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(sql, (new_stock, pid))
-            row = cur.fetchone()
-            if not row:
+            cur.execute("SELECT 1 FROM product WHERE product_id = %s;", (pid,))
+            if not cur.fetchone():
                 conn.rollback()
                 return False, "Product not found."
+            _set_location_stock(cur, location_id, pid, new_stock)
         return True, None
     except Exception as e:
         conn.rollback()
@@ -0,0 +1,373 @@
+import sys
+
+from db_connect import get_connection
+from tracing import log, traced
+
+# Names within this edit distance count as the same person (same phone, or same name block)
+MAX_NAME_DISTANCE = 2
+
+# Blocking key: first initial + soundex of the surname (last word), e.g. 'JS530'
+# for John Smith. Same expression as the generated Customer.name_key (db_setup.py).
+NAME_KEY_SQL = "upper(left(btrim({name}), 1)) || soundex(substring(btrim({name}) from '(\\S+)$'))"
+
+# Same columns/blocking keys as the Customer table (see db_setup.py)
+STAGE_TABLE_SQL = f"""
+    CREATE TEMP TABLE customer_import_stage (
+        row_no BIGSERIAL PRIMARY KEY,
+        customer_name VARCHAR(100) NOT NULL,
+        phone VARCHAR(20),
+        phone_normalized VARCHAR(20) GENERATED ALWAYS AS (regexp_replace(phone, '[^0-9]', '', 'g')) STORED,
+        name_key VARCHAR(5) GENERATED ALWAYS AS ({NAME_KEY_SQL.format(name='customer_name')}) STORED,
+        duplicate_of INTEGER,
+        duplicate_row BIGINT,
+        shares_phone_with INTEGER,
+        shares_phone_row BIGINT
+    ) ON COMMIT DROP
+"""
+
+
+@traced
+def import_customers(csv_file, sample_size=20):
+    """
+    Bulk-load customers from a CSV with a header row and columns customer_name,phone.
+
+    Rows are COPY'd into a staging table, then matched against existing
+    customers and earlier rows of the same file. A duplicate is a row with a
+    near-identical name (small edit distance) that also has the same phone,
+    or is in the same name block (first initial + surname soundex). Only rows
+    sharing a key are compared, so the work grows with block size rather
+    than n². Duplicates are skipped; everything else is inserted in one
+    statement. A row that only shares a phone (a family or a business line)
+    is imported and reported for review.
+
+    Args:
+        csv_file: File-like object (text or binary) positioned at the header.
+        sample_size (int): How many skipped rows to return for review.
+
+    Returns:
+        (bool, dict or str): (True, summary) or (False, error message).
+        summary = {'total', 'inserted', 'duplicates', 'samples', 'shared_phones'} where samples
+        (skipped rows) and shared_phones (imported rows sharing a phone with another name) are
+        [(row_no, customer_name, phone, matched_customer_id or None, matched_row or None)]
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    params = {"max_distance": MAX_NAME_DISTANCE}
+    try:
+        cursor = conn.cursor()
+        cursor.execute(STAGE_TABLE_SQL)
+        cursor.copy_expert(
+            "COPY customer_import_stage (customer_name, phone) FROM STDIN WITH (FORMAT csv, HEADER true)",
+            csv_file,
+        )
+        cursor.execute("""
+            CREATE INDEX ON customer_import_stage (phone_normalized);
+            CREATE INDEX ON customer_import_stage (name_key);
+            ANALYZE customer_import_stage;
+        """)
+
+        # 1. Already a customer with the same phone and a near-identical name
+        cursor.execute("""
+            UPDATE customer_import_stage s
+               SET duplicate_of = c.customer_id
+              FROM customer c
+             WHERE s.phone_normalized <> ''
+               AND c.phone_normalized = s.phone_normalized
+               AND levenshtein_less_equal(lower(c.customer_name), lower(s.customer_name), %(max_distance)s)
+                   <= %(max_distance)s
+        """, params)
+
+        # 2. Already a customer with a near-identical name in the same phonetic block
+        cursor.execute("""
+            UPDATE customer_import_stage s
+               SET duplicate_of = c.customer_id
+              FROM customer c
+             WHERE s.duplicate_of IS NULL
+               AND c.name_key = s.name_key
+               AND levenshtein_less_equal(lower(c.customer_name), lower(s.customer_name), %(max_distance)s)
+                   <= %(max_distance)s
+        """, params)
+
+        # 3. Repeats inside the file itself: keep the first occurrence. Each phone
+        #    is compared with the first row carrying it (one window pass, no self-join).
+        cursor.execute("""
+            UPDATE customer_import_stage s
+               SET duplicate_row = d.first_row
+              FROM (SELECT row_no, MIN(row_no) OVER (PARTITION BY phone_normalized) AS first_row
+                      FROM customer_import_stage
+                     WHERE phone_normalized <> '') d
+              JOIN customer_import_stage f ON f.row_no = d.first_row
+             WHERE s.row_no = d.row_no AND d.first_row < d.row_no AND s.duplicate_of IS NULL
+               AND levenshtein_less_equal(lower(f.customer_name), lower(s.customer_name), %(max_distance)s)
+                   <= %(max_distance)s
+        """, params)
+        cursor.execute("""
+            UPDATE customer_import_stage s
+               SET duplicate_row = d.first_row
+              FROM (SELECT later.row_no, MIN(earlier.row_no) AS first_row
+                      FROM customer_import_stage earlier
+                      JOIN customer_import_stage later
+                        ON later.name_key = earlier.name_key
+                       AND later.row_no > earlier.row_no
+                     WHERE levenshtein_less_equal(lower(earlier.customer_name), lower(later.customer_name),
+                                                  %(max_distance)s) <= %(max_distance)s
+                     GROUP BY later.row_no) d
+             WHERE s.row_no = d.row_no AND s.duplicate_of IS NULL AND s.duplicate_row IS NULL
+        """, params)
+
+        # 4. Rows kept that share a phone with someone else: imported, but reported
+        cursor.execute("""
+            UPDATE customer_import_stage s
+               SET shares_phone_with = (SELECT MIN(c.customer_id) FROM customer c
+                                         WHERE c.phone_normalized = s.phone_normalized),
+                   shares_phone_row = (SELECT MIN(e.row_no) FROM customer_import_stage e
+                                        WHERE e.phone_normalized = s.phone_normalized
+                                          AND e.row_no < s.row_no)
+             WHERE s.phone_normalized <> ''
+               AND s.duplicate_of IS NULL AND s.duplicate_row IS NULL
+        """)
+
+        cursor.execute("""
+            INSERT INTO customer (customer_name, phone)
+            SELECT customer_name, phone
+            FROM customer_import_stage
+            WHERE duplicate_of IS NULL AND duplicate_row IS NULL
+            ORDER BY row_no
+        """)
+        inserted = cursor.rowcount
+
+        cursor.execute("SELECT COUNT(*) FROM customer_import_stage")
+        total = cursor.fetchone()[0]
+
+        cursor.execute("""
+            SELECT row_no, customer_name, phone, duplicate_of, duplicate_row
+            FROM customer_import_stage
+            WHERE duplicate_of IS NOT NULL OR duplicate_row IS NOT NULL
+            ORDER BY row_no
+            LIMIT %s
+        """, (sample_size,))
+        samples = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT row_no, customer_name, phone, shares_phone_with, shares_phone_row
+            FROM customer_import_stage
+            WHERE shares_phone_with IS NOT NULL OR shares_phone_row IS NOT NULL
+            ORDER BY row_no
+            LIMIT %s
+        """, (sample_size,))
+        shared_phones = cursor.fetchall()
+
+        conn.commit()
+        return True, {
+            "total": total,
+            "inserted": inserted,
+            "duplicates": total - inserted,
+            "samples": samples,
+            "shared_phones": shared_phones,
+        }
+
+    except Exception as e:
+        conn.rollback()
+        log(f"Customer import failed: {e}")
+        return False, f"Import failed: {e}"
+
+    finally:
+        conn.close()
+
+
+@traced
+def find_customer_matches(name, phone, limit=5):
+    """
+    Existing customers that look like the same person as (name, phone).
+    Returns [(customer_id, customer_name, phone)].
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT customer_id, customer_name, phone
+            FROM customer
+            WHERE (phone_normalized = regexp_replace(%(phone)s, '[^0-9]', '', 'g')
+                   AND regexp_replace(%(phone)s, '[^0-9]', '', 'g') <> '')
+               OR (name_key = {NAME_KEY_SQL.format(name='%(name)s')}
+                   AND levenshtein_less_equal(lower(customer_name), lower(%(name)s), %(max_distance)s)
+                       <= %(max_distance)s)
+            ORDER BY customer_id
+            LIMIT %(limit)s
+        """, {"name": name, "phone": phone or '', "max_distance": MAX_NAME_DISTANCE, "limit": limit})
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error matching customer: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def find_duplicate_candidates(limit=200):
+    """
+    Likely duplicate pairs already in the Customer table, older record first.
+    A shared phone alone is not a duplicate (see find_shared_phones): each
+    customer is paired with the oldest customer of its phone whose name is
+    also within MAX_NAME_DISTANCE.
+    Returns [(keep_id, keep_name, keep_phone, dup_id, dup_name, dup_phone, reason)].
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT a.customer_id, a.customer_name, a.phone,
+                   b.customer_id, b.customer_name, b.phone, 'Same phone'
+            FROM customer b
+            JOIN LATERAL (
+                SELECT customer_id, customer_name, phone
+                FROM customer a
+                WHERE a.phone_normalized = b.phone_normalized
+                  AND a.customer_id < b.customer_id
+                  AND levenshtein_less_equal(lower(a.customer_name), lower(b.customer_name), %(max_distance)s)
+                      <= %(max_distance)s
+                ORDER BY a.customer_id
+                LIMIT 1
+            ) a ON TRUE
+            WHERE b.phone_normalized <> ''
+            UNION
+            SELECT a.customer_id, a.customer_name, a.phone,
+                   b.customer_id, b.customer_name, b.phone, 'Similar name'
+            FROM customer a
+            JOIN customer b ON b.name_key = a.name_key AND b.customer_id > a.customer_id
+            WHERE levenshtein_less_equal(lower(a.customer_name), lower(b.customer_name), %(max_distance)s)
+                  <= %(max_distance)s
+            ORDER BY 1, 4
+            LIMIT %(limit)s
+        """, {"max_distance": MAX_NAME_DISTANCE, "limit": limit})
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error finding duplicates: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def find_shared_phones(limit=50):
+    """
+    Phone numbers on more than one customer (a family or office line), most
+    customers first. Listed for review, not offered as merges.
+    Returns [(phone, customer_count, [first 10 customer_names, oldest first])].
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MIN(phone), COUNT(*), (array_agg(customer_name ORDER BY customer_id))[1:10]
+            FROM customer
+            WHERE phone_normalized <> ''
+            GROUP BY phone_normalized
+            HAVING COUNT(*) > 1
+            ORDER BY COUNT(*) DESC, MIN(customer_id)
+            LIMIT %s
+        """, (limit,))
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error finding shared phones: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def merge_customers(survivor_id, duplicate_ids):
+    """
+    Fold duplicate customers into survivor_id: their sales are repointed to the
+    survivor, the survivor's CustomerStats totals are rebuilt, and the
+    duplicates are deleted.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    duplicate_ids = [int(d) for d in duplicate_ids if int(d) != int(survivor_id)]
+    if not duplicate_ids:
+        return False, "Nothing to merge"
+
+    conn = get_connection()
+    if not conn:
+        return False, "Connection failed"
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM customer WHERE customer_id = %s FOR UPDATE", (survivor_id,))
+        if not cursor.fetchone():
+            return False, "Customer not found"
+
+        # Repoint the sales and flag their months for the next snapshot export
+        cursor.execute("""
+            WITH moved AS (
+                UPDATE sale SET customer_id = %s WHERE customer_id = ANY(%s)
+                RETURNING sale_date
+            ), marked AS (
+                INSERT INTO SnapshotDirtyMonth (month)
+                SELECT DISTINCT date_trunc('month', sale_date)::date FROM moved ORDER BY 1
+                ON CONFLICT (month) DO UPDATE SET version = SnapshotDirtyMonth.version + 1
+            )
+            SELECT COUNT(*) FROM moved
+        """, (survivor_id, duplicate_ids))
+        moved = cursor.fetchone()[0]
+
+        # Totals are additive, so rebuild them from the survivor's sales;
+        # RFM scores are left for the next bulk recompute.
+        cursor.execute("""
+            INSERT INTO CustomerStats (customer_id, lifetime_spend, order_count, first_purchase, last_purchase)
+            SELECT customer_id, SUM(total_amount), COUNT(*), MIN(sale_date), MAX(sale_date)
+            FROM sale
+            WHERE customer_id = %s
+            GROUP BY customer_id
+            ON CONFLICT (customer_id) DO UPDATE
+               SET lifetime_spend = EXCLUDED.lifetime_spend,
+                   order_count = EXCLUDED.order_count,
+                   first_purchase = EXCLUDED.first_purchase,
+                   last_purchase = EXCLUDED.last_purchase
+        """, (survivor_id,))
+
+        cursor.execute("DELETE FROM customer WHERE customer_id = ANY(%s)", (duplicate_ids,))
+        removed = cursor.rowcount
+
+        conn.commit()
+        return True, f"Merged {removed} customer(s) into #{survivor_id}; {moved} sale(s) moved."
+
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error merging customers: {e}"
+
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    # python customer_dedupe.py customers.csv   -> bulk import
+    # python customer_dedupe.py                 -> list duplicate candidates
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], newline='', encoding='utf-8') as f:
+            ok, result = import_customers(f)
+        if not ok:
+            print(f"❌ {result}")
+            sys.exit(1)
+        print(f"✅ {result['inserted']} of {result['total']} row(s) imported, "
+              f"{result['duplicates']} duplicate(s) skipped.")
+    else:
+        for pair in find_duplicate_candidates():
+            print(pair)
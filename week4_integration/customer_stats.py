@@ -0,0 +1,268 @@
+import io
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from db_connect import get_connection
+from tracing import log, traced
+
+# RFM scores run 1 (worst) .. 5 (best), one quintile per score
+RFM_BUCKETS = 5
+
+# Checked in order, first match wins (see _segment)
+SEGMENTS = [
+    "Champions",
+    "Loyal",
+    "New",
+    "At Risk",
+    "Hibernating",
+    "Potential",
+]
+
+# Report label for customers not scored yet (segment IS NULL)
+UNSCORED = "Unscored"
+
+
+def record_sale(cursor, customer_id, amount, sale_date):
+    """
+    Fold one committed sale into the customer's running totals.
+    Runs on the caller's cursor so it commits/rolls back with the sale.
+    RFM scores are relative to all customers, so they are only refreshed by
+    recompute_customer_stats().
+    """
+    if customer_id is None:
+        return
+
+    query = """
+        INSERT INTO CustomerStats (customer_id, lifetime_spend, order_count, first_purchase, last_purchase)
+        VALUES (%s, %s, 1, %s, %s)
+        ON CONFLICT (customer_id) DO UPDATE
+           SET lifetime_spend = CustomerStats.lifetime_spend + EXCLUDED.lifetime_spend,
+               order_count = CustomerStats.order_count + 1,
+               first_purchase = LEAST(CustomerStats.first_purchase, EXCLUDED.first_purchase),
+               last_purchase = GREATEST(CustomerStats.last_purchase, EXCLUDED.last_purchase)
+    """
+    cursor.execute(query, (customer_id, amount, sale_date, sale_date))
+
+
+def _quintile_scores(values):
+    """
+    1..5 score per element from the quintile its value falls in (higher value ->
+    higher score). Equal values always get equal scores, so e.g. all one-time
+    buyers share one frequency score whatever order the rows came in.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int16)
+    cuts = np.quantile(values, np.arange(1, RFM_BUCKETS) / RFM_BUCKETS)
+    return (np.searchsorted(cuts, values, side="right") + 1).astype(np.int16)
+
+
+def _segment(r, f, order_count):
+    """Vectorized segment label from recency/frequency scores"""
+    conditions = [
+        (r >= 4) & (f >= 4),
+        f >= 4,
+        (r >= 4) & (order_count == 1),
+        (r <= 2) & (f >= 3),
+        (r <= 2) & (f <= 2),
+    ]
+    return np.select(conditions, SEGMENTS[:-1], default=SEGMENTS[-1])
+
+
+@traced
+def recompute_customer_stats(batch_size=50000, update_batch=2000):
+    """
+    Rebuild CustomerStats for every customer from Sale.
+    Aggregates are pulled from a server-side cursor into arrays and scored with
+    NumPy. The results are staged with COPY and written back in short
+    transactions of update_batch customers, so checkout (record_sale) only ever
+    waits on the handful of rows being rewritten, never on the whole table.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+
+        ids, spend, counts, first, last = [], [], [], [], []
+        with conn.cursor(name="customer_stats_scan") as scan:
+            scan.itersize = batch_size
+            scan.execute("""
+                SELECT customer_id, SUM(total_amount), COUNT(*), MIN(sale_date), MAX(sale_date)
+                FROM Sale
+                WHERE customer_id IS NOT NULL
+                GROUP BY customer_id
+            """)
+            for row in scan:
+                ids.append(row[0])
+                spend.append(row[1])
+                counts.append(row[2])
+                first.append(row[3])
+                last.append(row[4])
+
+        now = np.datetime64(datetime.now(), "s")
+        spend_arr = np.array(spend, dtype=np.float64)
+        count_arr = np.array(counts, dtype=np.int64)
+        last_arr = np.array(last, dtype="datetime64[s]")
+        recency_days = (now - last_arr).astype("timedelta64[D]").astype(np.int64)
+
+        r = _quintile_scores(-recency_days)
+        f = _quintile_scores(count_arr)
+        m = _quintile_scores(spend_arr)
+        segments = _segment(r, f, count_arr)
+
+        # Only the scores come from the scan; totals are re-read per batch below
+        buffer = io.StringIO()
+        for row in zip(ids, r, f, m, segments):
+            buffer.write("\t".join(str(v) for v in row) + "\n")
+        buffer.seek(0)
+
+        cursor.execute("""
+            CREATE TEMP TABLE customer_stats_stage (
+                customer_id INTEGER PRIMARY KEY,
+                recency_score SMALLINT,
+                frequency_score SMALLINT,
+                monetary_score SMALLINT,
+                segment VARCHAR(30)
+            ) ON COMMIT PRESERVE ROWS
+        """)
+        cursor.copy_expert("""
+            COPY customer_stats_stage (customer_id, recency_score, frequency_score, monetary_score, segment)
+            FROM STDIN
+        """, buffer)
+
+        # Customers with no row yet get an empty one; a sale committing meanwhile
+        # then just adds to it (record_sale) instead of racing the rebuild's insert
+        cursor.execute("""
+            INSERT INTO CustomerStats (customer_id)
+            SELECT customer_id FROM customer_stats_stage
+            ON CONFLICT (customer_id) DO NOTHING
+        """)
+        conn.commit()
+
+        ids.sort()
+        for i in range(0, len(ids), update_batch):
+            batch = ids[i:i + update_batch]
+            # Lock first, then aggregate in a new statement: every sale committed
+            # before the lock is counted, and any sale still in flight waits and
+            # applies its own increment on top.
+            cursor.execute("""
+                SELECT customer_id FROM CustomerStats
+                WHERE customer_id = ANY(%s)
+                ORDER BY customer_id
+                FOR UPDATE
+            """, (batch,))
+            cursor.execute("""
+                UPDATE CustomerStats cs
+                   SET lifetime_spend = agg.spend,
+                       order_count = agg.orders,
+                       first_purchase = agg.first_purchase,
+                       last_purchase = agg.last_purchase,
+                       recency_score = st.recency_score,
+                       frequency_score = st.frequency_score,
+                       monetary_score = st.monetary_score,
+                       segment = st.segment,
+                       scored_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT customer_id, SUM(total_amount) AS spend, COUNT(*) AS orders,
+                           MIN(sale_date) AS first_purchase, MAX(sale_date) AS last_purchase
+                    FROM Sale
+                    WHERE customer_id = ANY(%s)
+                    GROUP BY customer_id
+                ) agg
+                JOIN customer_stats_stage st ON st.customer_id = agg.customer_id
+                WHERE cs.customer_id = agg.customer_id
+            """, (batch,))
+            conn.commit()
+
+        # Customers whose sales are all gone (e.g. merged away) drop out
+        cursor.execute("""
+            DELETE FROM CustomerStats cs
+            WHERE NOT EXISTS (SELECT 1 FROM Sale s WHERE s.customer_id = cs.customer_id)
+        """)
+        cursor.execute("DROP TABLE customer_stats_stage")
+        conn.commit()
+        return True, f"Recomputed stats for {len(ids)} customer(s)."
+
+    except Exception as e:
+        conn.rollback()
+        log(f"Customer stats recompute failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
+
+
+@traced
+def get_segment_report():
+    """
+    Per-segment summary read from precomputed CustomerStats rows.
+    Returns [(segment, customers, total_spend_cents, avg_spend_cents, avg_orders)];
+    customers not yet scored are reported as 'Unscored'.
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(segment, %s), COUNT(*), (SUM(lifetime_spend) * 100)::bigint,
+                   (AVG(lifetime_spend) * 100)::bigint, AVG(order_count)
+            FROM CustomerStats
+            GROUP BY 1
+            ORDER BY SUM(lifetime_spend) DESC
+        """, (UNSCORED,))
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching segment report: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def get_segment_customers(segment, limit=50):
+    """
+    Top spenders in one segment: [(customer_id, name, phone, spend_cents, orders, last_purchase, r, f, m)].
+    UNSCORED lists the customers with no segment yet.
+    """
+    if segment == UNSCORED:
+        condition, params = "cs.segment IS NULL", (limit,)
+    else:
+        condition, params = "cs.segment = %s", (segment, limit)
+
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT c.customer_id, c.customer_name, c.phone, (cs.lifetime_spend * 100)::bigint, cs.order_count,
+                   cs.last_purchase, cs.recency_score, cs.frequency_score, cs.monetary_score
+            FROM CustomerStats cs
+            JOIN Customer c ON c.customer_id = cs.customer_id
+            WHERE {condition}
+            ORDER BY cs.lifetime_spend DESC
+            LIMIT %s
+        """, params)
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching segment customers: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Nightly job: python customer_stats.py
+    ok, message = recompute_customer_stats()
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
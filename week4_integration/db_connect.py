@@ -1,28 +1,81 @@
 import os
+import sys
+import time
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+
 # Load variables from .env file
 load_dotenv()
 
+
+class _TimedMixin:
+    """Counts and times every statement, labelled with the function that ran it"""
+    def _timed(self, run, *args):
+        caller = sys._getframe(2).f_code.co_name
+        module = sys._getframe(2).f_globals.get('__name__', '?')
+        labels = (('function', f"{module}.{caller}"),)
+        started = time.perf_counter()
+        try:
+            with tracing.sql_span(args[0]):
+                return run(*args)
+        finally:
+            metrics.inc('db_statements_total', labels)
+            metrics.observe('db_statement_duration_seconds', time.perf_counter() - started, labels)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+
+class TimedCursor(_TimedMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedMixin, RealDictCursor):
+    pass
+
+
+class TrackedConnection(psycopg2.extensions.connection):
+    """Keeps the open-connection gauge right however the connection is closed"""
+    def close(self):
+        if not self.closed:
+            metrics.inc('db_connections_open', value=-1)
+        return super().close()
+
+
 def get_connection():
     # Get the URL from the environment
     db_url = os.getenv("DB_URL")
 
     if not db_url:
-        print("❌ Error: DB_URL not found.")
-        print("Did you create the .env file?")
+        tracing.log("❌ Error: DB_URL not found.")
+        tracing.log("Did you create the .env file?")
         return None
 
     try:
-        conn = psycopg2.connect(db_url)
+        # No pool: every call opens a connection, so the connect time is part of each request
+        with metrics.timer('db_connect_duration_seconds'):
+            conn = psycopg2.connect(db_url, connection_factory=TrackedConnection, cursor_factory=TimedCursor)
+        metrics.inc('db_connections_opened_total')
+        metrics.inc('db_connections_open')
         return conn
     except Exception as e:
-        print(f"❌ Connection Failed: {e}")
+        metrics.inc('db_connections_failed_total')
+        tracing.log(f"❌ Connection Failed: {e}")
         return None
 
 if __name__ == "__main__":
     conn = get_connection()
     if conn:
         print("✅ Successfully connected to Neon DB!")
-        conn.close()
\ No newline at end of file
+        conn.close()
@@ -26,9 +26,25 @@ def setup_database():
         # --- 1. CLEANUP (Drop existing tables) ---
         print("🗑️  Dropping old tables (if any)...")
         cursor.execute("""
+            DROP TABLE IF EXISTS DailyReport CASCADE;
+            DROP TABLE IF EXISTS SnapshotDirtyMonth CASCADE;
+            DROP TABLE IF EXISTS SalesRollup CASCADE;
+            DROP TABLE IF EXISTS RollupWatermark CASCADE;
+            DROP TABLE IF EXISTS PriceHistory CASCADE;
+            DROP TABLE IF EXISTS EffectivePrice CASCADE;
+            DROP TABLE IF EXISTS Promotion CASCADE;
+            DROP TABLE IF EXISTS CheckoutRequest CASCADE;
+            DROP TABLE IF EXISTS StockReservation CASCADE;
+            DROP TABLE IF EXISTS StockMovement CASCADE;
             DROP TABLE IF EXISTS SaleItem CASCADE;
             DROP TABLE IF EXISTS Sale CASCADE;
+            DROP TABLE IF EXISTS CustomerStats CASCADE;
+            DROP TABLE IF EXISTS StockAlert CASCADE;
+            DROP TABLE IF EXISTS ProductForecast CASCADE;
+            DROP TABLE IF EXISTS LocationStock CASCADE;
             DROP TABLE IF EXISTS Product CASCADE;
+            DROP TABLE IF EXISTS Location CASCADE;
+            DROP TABLE IF EXISTS CategoryClosure CASCADE;
             DROP TABLE IF EXISTS Category CASCADE;
             DROP TABLE IF EXISTS Customer CASCADE;
             DROP TABLE IF EXISTS Operator CASCADE;
@@ -37,10 +53,35 @@ def setup_database():
         # --- 2. CREATE TABLES ---
         print("🏗️  Creating new tables...")
         cursor.execute("""
+            --- soundex()/levenshtein() for customer duplicate detection
+            CREATE EXTENSION IF NOT EXISTS fuzzystrmatch;
+            --- btree_gist lets PriceHistory's exclusion constraint combine product_id = with range overlap
+            CREATE EXTENSION IF NOT EXISTS btree_gist;
+
             --- Category Table
             CREATE TABLE Category (
                 category_id SERIAL PRIMARY KEY,
-                category_name VARCHAR(100) NOT NULL
+                category_name VARCHAR(100) NOT NULL,
+                parent_id INTEGER NULL,
+                CONSTRAINT fk_category_parent FOREIGN KEY (parent_id) REFERENCES Category(category_id) ON DELETE RESTRICT
+            );
+
+            --- Category Closure Table (one row per ancestor/descendant pair, incl. self at depth 0)
+            CREATE TABLE CategoryClosure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL CHECK (depth >= 0),
+                PRIMARY KEY (ancestor_id, descendant_id),
+                CONSTRAINT fk_closure_ancestor FOREIGN KEY (ancestor_id) REFERENCES Category(category_id) ON DELETE CASCADE,
+                CONSTRAINT fk_closure_descendant FOREIGN KEY (descendant_id) REFERENCES Category(category_id) ON DELETE CASCADE
+            );
+
+            --- Locations: shops and warehouses, each holding its own stock
+            CREATE TABLE Location (
+                location_id SERIAL PRIMARY KEY,
+                location_name VARCHAR(100) NOT NULL UNIQUE,
+                kind VARCHAR(10) NOT NULL DEFAULT 'store' CHECK (kind IN ('store', 'warehouse')),
+                is_active BOOLEAN NOT NULL DEFAULT TRUE
             );
 
             --- Product Table
@@ -50,17 +91,97 @@ def setup_database():
                 product_name VARCHAR(200) NOT NULL,
                 sku VARCHAR(50) NOT NULL UNIQUE,
                 price DECIMAL(10, 2) NOT NULL CHECK (price >= 0),
-                quantity_stock INTEGER NOT NULL DEFAULT 0 CHECK (quantity_stock >= 0),
                 low_stock_threshold INTEGER NOT NULL DEFAULT 10 CHECK (low_stock_threshold >= 0),
                 is_active BOOLEAN NOT NULL DEFAULT TRUE,
                 CONSTRAINT fk_product_category FOREIGN KEY (category_id) REFERENCES Category(category_id) ON DELETE RESTRICT
             );
 
+            --- Demand forecast per product (see forecasting.py)
+            CREATE TABLE ProductForecast (
+                product_id INTEGER PRIMARY KEY,
+                daily_demand DECIMAL(12, 3) NOT NULL,
+                demand_sd DECIMAL(12, 3) NOT NULL,
+                reorder_point INTEGER NOT NULL,
+                order_qty INTEGER NOT NULL,
+                lead_time_days INTEGER NOT NULL,
+                service_level DECIMAL(4, 3) NOT NULL,
+                computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_forecast_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE
+            );
+
+            --- Stock on hand per location. Keyed by location first, so each store's reads
+            --- and writes stay within its own slice of the index.
+            CREATE TABLE LocationStock (
+                location_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+                reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0),  -- sum of active StockReservation holds
+                is_low BOOLEAN NOT NULL DEFAULT FALSE,  -- quantity <= the product's low_stock_threshold (kept by triggers)
+                PRIMARY KEY (location_id, product_id),
+                CONSTRAINT fk_locationstock_location FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE RESTRICT,
+                CONSTRAINT fk_locationstock_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE
+            );
+
+            --- Low-stock alert log (written by the low-stock triggers)
+            CREATE TABLE StockAlert (
+                alert_id SERIAL PRIMARY KEY,
+                location_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity_stock INTEGER NOT NULL,
+                low_stock_threshold INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_stockalert_location FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE CASCADE,
+                CONSTRAINT fk_stockalert_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE
+            );
+
+            --- Promotions: product price overrides, category-wide % off, buy X get Y (see promotions.py)
+            CREATE TABLE Promotion (
+                promotion_id SERIAL PRIMARY KEY,
+                promotion_name VARCHAR(100) NOT NULL,
+                kind VARCHAR(20) NOT NULL CHECK (kind IN ('price_override', 'category_percent', 'buy_x_get_y')),
+                product_id INTEGER NULL,
+                category_id INTEGER NULL,
+                override_price DECIMAL(10, 2) NULL CHECK (override_price >= 0),
+                percent_off DECIMAL(5, 2) NULL CHECK (percent_off > 0 AND percent_off < 100),
+                buy_qty INTEGER NULL CHECK (buy_qty > 0),
+                free_qty INTEGER NULL CHECK (free_qty > 0),
+                starts_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                ends_at TIMESTAMP NULL,
+                is_active BOOLEAN NOT NULL DEFAULT TRUE,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CHECK ((product_id IS NULL) <> (category_id IS NULL)),
+                CHECK (ends_at IS NULL OR ends_at > starts_at),
+                CHECK (kind <> 'price_override' OR (product_id IS NOT NULL AND override_price IS NOT NULL)),
+                CHECK (kind <> 'category_percent' OR (category_id IS NOT NULL AND percent_off IS NOT NULL)),
+                CHECK (kind <> 'buy_x_get_y' OR (buy_qty IS NOT NULL AND free_qty IS NOT NULL)),
+                CONSTRAINT fk_promotion_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE,
+                CONSTRAINT fk_promotion_category FOREIGN KEY (category_id) REFERENCES Category(category_id) ON DELETE CASCADE
+            );
+
+            --- Active promotions compiled per product; checkout reads only this (rebuilt by refresh_effective_prices)
+            CREATE TABLE EffectivePrice (
+                product_id INTEGER PRIMARY KEY,
+                override_price DECIMAL(10, 2) NULL,
+                percent_off DECIMAL(5, 2) NULL,
+                price_promotion_id INTEGER NULL,
+                buy_qty INTEGER NULL,
+                free_qty INTEGER NULL,
+                price_valid_until TIMESTAMP NULL,
+                bundle_promotion_id INTEGER NULL,
+                bundle_valid_until TIMESTAMP NULL,
+                computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_effectiveprice_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE
+            );
+
             --- Customer Table
             CREATE TABLE Customer (
                 customer_id SERIAL PRIMARY KEY,
                 customer_name VARCHAR(100) NOT NULL,
                 phone VARCHAR(20),
+                phone_normalized VARCHAR(20) GENERATED ALWAYS AS (regexp_replace(phone, '[^0-9]', '', 'g')) STORED,
+                -- First initial + surname soundex: the duplicate-matching block (customer_dedupe.py)
+                name_key VARCHAR(5) GENERATED ALWAYS AS
+                    (upper(left(btrim(customer_name), 1)) || soundex(substring(btrim(customer_name) from '(\\S+)$'))) STORED,
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             );
 
@@ -75,15 +196,49 @@ def setup_database():
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             );
 
+            --- Price history: the list price of each product over time, one row per [valid_from, valid_to)
+            --- (see pricing.py). The open row (upper bound infinite) is the current price.
+            CREATE TABLE PriceHistory (
+                price_history_id BIGSERIAL PRIMARY KEY,
+                product_id INTEGER NOT NULL,
+                price DECIMAL(10, 2) NOT NULL CHECK (price >= 0),
+                valid TSRANGE NOT NULL,
+                source VARCHAR(20) NOT NULL CHECK (source IN ('initial', 'edit', 'bulk')),
+                changed_by INTEGER NULL,
+                CONSTRAINT fk_pricehistory_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE,
+                CONSTRAINT fk_pricehistory_operator FOREIGN KEY (changed_by) REFERENCES Operator(operator_id) ON DELETE SET NULL,
+                -- No two prices for one product at the same instant. Deferred so a change can
+                -- open the new row and close the old one in the same statement.
+                CONSTRAINT excl_pricehistory_overlap EXCLUDE USING gist (product_id WITH =, valid WITH &&)
+                    DEFERRABLE INITIALLY DEFERRED
+            );
+
             --- Sale Table
             CREATE TABLE Sale (
                 sale_id SERIAL PRIMARY KEY,
                 customer_id INTEGER NULL,
                 operator_id INTEGER NOT NULL,
+                location_id INTEGER NOT NULL,
                 sale_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 total_amount DECIMAL(10, 2) NOT NULL DEFAULT 0 CHECK (total_amount >= 0),
                 CONSTRAINT fk_sale_customer FOREIGN KEY (customer_id) REFERENCES Customer(customer_id) ON DELETE SET NULL,
-                CONSTRAINT fk_sale_operator FOREIGN KEY (operator_id) REFERENCES Operator(operator_id) ON DELETE RESTRICT
+                CONSTRAINT fk_sale_operator FOREIGN KEY (operator_id) REFERENCES Operator(operator_id) ON DELETE RESTRICT,
+                CONSTRAINT fk_sale_location FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE RESTRICT
+            );
+
+            --- Customer Statistics (running totals + RFM scores)
+            CREATE TABLE CustomerStats (
+                customer_id INTEGER PRIMARY KEY,
+                lifetime_spend DECIMAL(12, 2) NOT NULL DEFAULT 0,
+                order_count INTEGER NOT NULL DEFAULT 0,
+                first_purchase TIMESTAMP,
+                last_purchase TIMESTAMP,
+                recency_score SMALLINT,
+                frequency_score SMALLINT,
+                monetary_score SMALLINT,
+                segment VARCHAR(30),
+                scored_at TIMESTAMP,
+                CONSTRAINT fk_customerstats_customer FOREIGN KEY (customer_id) REFERENCES Customer(customer_id) ON DELETE CASCADE
             );
 
             CREATE TABLE SaleItem (
@@ -97,16 +252,203 @@ def setup_database():
                 CONSTRAINT fk_saleitem_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE RESTRICT
             );
             
+            --- Stock ledger: every change to LocationStock.quantity, so stock can be re-derived (see reconcile.py)
+            CREATE TABLE StockMovement (
+                movement_id BIGSERIAL PRIMARY KEY,
+                location_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                sale_id INTEGER NULL,
+                change INTEGER NOT NULL,
+                reason VARCHAR(20) NOT NULL CHECK (reason IN ('initial', 'sale', 'adjustment', 'transfer', 'correction')),
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_stockmovement_location FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE CASCADE,
+                CONSTRAINT fk_stockmovement_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE,
+                CONSTRAINT fk_stockmovement_sale FOREIGN KEY (sale_id) REFERENCES Sale(sale_id) ON DELETE SET NULL
+            );
+
+            --- One row per committed checkout, keyed by the POS form's idempotency key (see idempotency.py).
+            --- Written in the sale's own transaction, so a retried submit finds it and replays the result.
+            CREATE TABLE CheckoutRequest (
+                idempotency_key VARCHAR(64) PRIMARY KEY,
+                sale_id INTEGER NULL,
+                message TEXT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_checkoutrequest_sale FOREIGN KEY (sale_id) REFERENCES Sale(sale_id) ON DELETE CASCADE
+            );
+
+            --- Stock held for a parked cart or web order until it is sold or expires (see reservations.py).
+            --- LocationStock.reserved carries the running total, so checkout never sums these rows.
+            CREATE TABLE StockReservation (
+                reservation_id BIGSERIAL PRIMARY KEY,
+                hold_key VARCHAR(64) NOT NULL,
+                location_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL CHECK (quantity > 0),
+                status VARCHAR(10) NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'converted', 'released', 'expired')),
+                sale_id INTEGER NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL,
+                CONSTRAINT fk_reservation_location FOREIGN KEY (location_id) REFERENCES Location(location_id) ON DELETE CASCADE,
+                CONSTRAINT fk_reservation_product FOREIGN KEY (product_id) REFERENCES Product(product_id) ON DELETE CASCADE,
+                CONSTRAINT fk_reservation_sale FOREIGN KEY (sale_id) REFERENCES Sale(sale_id) ON DELETE SET NULL
+            );
+
+            --- Sales Rollups (pre-aggregated revenue per time bucket; see rollup.py)
+            CREATE TABLE SalesRollup (
+                grain VARCHAR(5) NOT NULL CHECK (grain IN ('hour', 'day', 'month')),
+                dimension VARCHAR(10) NOT NULL CHECK (dimension IN ('all', 'product', 'category', 'operator')),
+                dimension_id INTEGER NOT NULL,
+                bucket_start TIMESTAMP NOT NULL,
+                revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                units BIGINT NOT NULL DEFAULT 0,
+                basket_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, dimension, dimension_id, bucket_start)
+            );
+
+            --- Rollup progress: highest sale_id already folded in
+            CREATE TABLE RollupWatermark (
+                rollup_name VARCHAR(50) PRIMARY KEY,
+                last_sale_id INTEGER NOT NULL DEFAULT 0,
+                refreshed_at TIMESTAMP
+            );
+
+            --- End-of-day Z-reports (immutable once written; see zreport.py)
+            CREATE TABLE DailyReport (
+                report_date DATE PRIMARY KEY,
+                sale_count INTEGER NOT NULL,
+                revenue DECIMAL(14, 2) NOT NULL,
+                payload JSONB NOT NULL,
+                generated_by INTEGER NULL,
+                generated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT fk_dailyreport_operator FOREIGN KEY (generated_by) REFERENCES Operator(operator_id) ON DELETE SET NULL
+            );
+
+            --- Months whose existing sales were changed (customer merge, total repair); snapshot.py
+            --- re-exports them on its next run. version tells a re-mark apart from the one it read.
+            CREATE TABLE SnapshotDirtyMonth (
+                month DATE PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 1
+            );
+
             -- Create Indexes
+            CREATE INDEX idx_category_parent ON Category(parent_id);
+            CREATE INDEX idx_closure_descendant ON CategoryClosure(descendant_id, ancestor_id);
             CREATE INDEX idx_product_category ON Product(category_id);
+            CREATE INDEX idx_locationstock_product ON LocationStock(product_id);
+            CREATE INDEX idx_locationstock_low ON LocationStock(location_id, quantity) WHERE is_low;
+            CREATE INDEX idx_stockalert_created ON StockAlert(location_id, created_at DESC);
+            CREATE INDEX idx_customer_phone_normalized ON Customer(phone_normalized text_pattern_ops);
+            CREATE INDEX idx_customer_name_prefix ON Customer(lower(customer_name) text_pattern_ops);
+            CREATE INDEX idx_customer_name_key ON Customer(name_key);
             CREATE INDEX idx_sale_customer ON Sale(customer_id);
             CREATE INDEX idx_sale_operator ON Sale(operator_id);
             CREATE INDEX idx_sale_date ON Sale(sale_date);
+            CREATE INDEX idx_sale_location_date ON Sale(location_id, sale_date);
             CREATE INDEX idx_saleitem_sale ON SaleItem(sale_id);
             CREATE INDEX idx_saleitem_product ON SaleItem(product_id);
+            CREATE INDEX idx_pricehistory_valid ON PriceHistory USING gist (valid);
+            CREATE INDEX idx_pricehistory_current ON PriceHistory(product_id) WHERE upper_inf(valid);
+            CREATE INDEX idx_promotion_active ON Promotion(starts_at) WHERE is_active = TRUE;
+            CREATE INDEX idx_stockmovement_product ON StockMovement(product_id, location_id, change);
+            CREATE INDEX idx_stockmovement_sale ON StockMovement(sale_id) WHERE sale_id IS NOT NULL;
+            CREATE UNIQUE INDEX idx_reservation_hold ON StockReservation(hold_key, location_id, product_id) WHERE status = 'active';
+            CREATE INDEX idx_reservation_expiry ON StockReservation(expires_at) WHERE status = 'active';
+            CREATE INDEX idx_checkoutrequest_created ON CheckoutRequest(created_at);
+            CREATE INDEX idx_customerstats_segment ON CustomerStats(segment, lifetime_spend DESC);
+
+            -- Available to sell: on hand minus what carts and web orders are holding
+            CREATE VIEW AvailableStock AS
+            SELECT location_id, product_id, quantity, reserved, GREATEST(quantity - reserved, 0) AS available
+            FROM LocationStock;
         """)
 
-        # --- 3. INSERT DUMMY DATA ---
+        # --- 3. TRIGGERS ---
+        print("🔔 Creating triggers...")
+        cursor.execute("""
+            -- Log and NOTIFY when a location's stock of a product crosses down to the
+            -- product's threshold. Called for every writer (create_sale, update_stock,
+            -- transfers, threshold changes); the notification is only delivered if the
+            -- transaction commits.
+            CREATE OR REPLACE FUNCTION raise_low_stock(p_location_id INTEGER, p_product_id INTEGER,
+                                                       p_quantity INTEGER, p_threshold INTEGER) RETURNS void AS $$
+            DECLARE
+                new_alert_id INTEGER;
+            BEGIN
+                INSERT INTO StockAlert (location_id, product_id, quantity_stock, low_stock_threshold)
+                VALUES (p_location_id, p_product_id, p_quantity, p_threshold)
+                RETURNING alert_id INTO new_alert_id;
+
+                PERFORM pg_notify('low_stock', json_build_object(
+                    'alert_id', new_alert_id,
+                    'location_id', p_location_id,
+                    'product_id', p_product_id,
+                    'product_name', (SELECT product_name FROM Product WHERE product_id = p_product_id),
+                    'quantity_stock', p_quantity,
+                    'low_stock_threshold', p_threshold
+                )::text);
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- Keep LocationStock.is_low in step with quantity, so the dashboard's
+            -- low-stock reads use the partial index instead of joining Product
+            CREATE OR REPLACE FUNCTION set_low_stock_flag() RETURNS trigger AS $$
+            BEGIN
+                NEW.is_low := NEW.quantity <= (SELECT low_stock_threshold FROM Product WHERE product_id = NEW.product_id);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_locationstock_low_flag
+            BEFORE INSERT OR UPDATE OF quantity ON LocationStock
+            FOR EACH ROW EXECUTE FUNCTION set_low_stock_flag();
+
+            CREATE OR REPLACE FUNCTION notify_low_stock() RETURNS trigger AS $$
+            BEGIN
+                PERFORM raise_low_stock(NEW.location_id, NEW.product_id, NEW.quantity,
+                                        (SELECT low_stock_threshold FROM Product WHERE product_id = NEW.product_id));
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_locationstock_low_stock
+            AFTER UPDATE OF quantity ON LocationStock
+            FOR EACH ROW WHEN (NEW.is_low AND NOT OLD.is_low)
+            EXECUTE FUNCTION notify_low_stock();
+
+            -- A raised threshold (e.g. from forecasting.py) can put locations below it without any sale
+            CREATE OR REPLACE FUNCTION notify_low_stock_threshold() RETURNS trigger AS $$
+            BEGIN
+                PERFORM raise_low_stock(ls.location_id, ls.product_id, ls.quantity, NEW.low_stock_threshold)
+                FROM LocationStock ls
+                WHERE ls.product_id = NEW.product_id
+                  AND ls.quantity <= NEW.low_stock_threshold
+                  AND ls.quantity > OLD.low_stock_threshold;
+
+                UPDATE LocationStock
+                   SET is_low = (quantity <= NEW.low_stock_threshold)
+                 WHERE product_id = NEW.product_id
+                   AND is_low <> (quantity <= NEW.low_stock_threshold);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_product_low_stock_threshold
+            AFTER UPDATE OF low_stock_threshold ON Product
+            FOR EACH ROW EXECUTE FUNCTION notify_low_stock_threshold();
+
+            -- Closed days are final: reprints always show what was printed
+            CREATE OR REPLACE FUNCTION reject_daily_report_change() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'Z-report for % is immutable', OLD.report_date;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_daily_report_immutable
+            BEFORE UPDATE OR DELETE ON DailyReport
+            FOR EACH ROW EXECUTE FUNCTION reject_daily_report_change();
+        """)
+
+        # --- 4. INSERT DUMMY DATA ---
         print("🌱 Inserting dummy data...")
         
         # Generate hash for "admin123"
@@ -119,12 +461,24 @@ def setup_database():
         INSERT INTO Category (category_name) VALUES 
         ('Electronics'), ('Stationery'), ('Beverages');
 
-        -- 2. Insert Products
-        INSERT INTO Product (category_id, product_name, sku, price, quantity_stock) VALUES 
-        (1, 'Wireless Mouse', 'TECH-001', 15.50, 50),
-        (1, 'USB Keyboard', 'TECH-002', 25.00, 30),
-        (2, 'Notebook A4', 'STAT-001', 2.50, 100),
-        (3, 'Mineral Water', 'DRNK-001', 1.00, 100);
+        -- Every category is its own ancestor at depth 0
+        INSERT INTO CategoryClosure (ancestor_id, descendant_id, depth)
+        SELECT category_id, category_id, 0 FROM Category;
+
+        -- 2. Insert Locations, Products and their stock per location
+        INSERT INTO Location (location_name, kind) VALUES
+        ('Main Store', 'store'),
+        ('Warehouse', 'warehouse');
+
+        INSERT INTO Product (category_id, product_name, sku, price) VALUES 
+        (1, 'Wireless Mouse', 'TECH-001', 15.50),
+        (1, 'USB Keyboard', 'TECH-002', 25.00),
+        (2, 'Notebook A4', 'STAT-001', 2.50),
+        (3, 'Mineral Water', 'DRNK-001', 1.00);
+
+        INSERT INTO LocationStock (location_id, product_id, quantity) VALUES
+        (1, 1, 50), (1, 2, 30), (1, 3, 100), (1, 4, 100),
+        (2, 1, 200), (2, 2, 120), (2, 3, 500), (2, 4, 400);
 
         -- 3. Insert Operators
         INSERT INTO Operator (username, password_hash, operator_name, role) VALUES 
@@ -138,20 +492,44 @@ def setup_database():
 
         -- 5. Insert Sales (Transactions)
         -- Sale 1: Admin sold to Alice (Total: $31.00)
-        INSERT INTO Sale (customer_id, operator_id, total_amount) VALUES 
-        (1, 1, 31.00); 
+        INSERT INTO Sale (customer_id, operator_id, location_id, total_amount) VALUES 
+        (1, 1, 1, 31.00); 
 
         -- Sale Items for Sale 1
         INSERT INTO SaleItem (sale_id, product_id, quantity, unit_price, subtotal) VALUES 
         (1, 1, 2, 15.50, 31.00);
 
         -- Sale 2: Cashier sold to Bob (Total: $7.50)
-        INSERT INTO Sale (customer_id, operator_id, total_amount) VALUES 
-        (2, 2, 7.50);
+        INSERT INTO Sale (customer_id, operator_id, location_id, total_amount) VALUES 
+        (2, 2, 1, 7.50);
 
         -- Sale Items for Sale 2
         INSERT INTO SaleItem (sale_id, product_id, quantity, unit_price, subtotal) VALUES 
         (2, 3, 3, 2.50, 7.50);
+
+        -- 6. Stock ledger: opening balance (stock before the sales above) + one movement per sold line
+        INSERT INTO StockMovement (location_id, product_id, change, reason)
+        SELECT ls.location_id, ls.product_id, ls.quantity + COALESCE(SUM(si.quantity), 0), 'initial'
+        FROM LocationStock ls
+        LEFT JOIN Sale s ON s.location_id = ls.location_id
+        LEFT JOIN SaleItem si ON si.sale_id = s.sale_id AND si.product_id = ls.product_id
+        GROUP BY ls.location_id, ls.product_id, ls.quantity;
+
+        INSERT INTO StockMovement (location_id, product_id, sale_id, change, reason)
+        SELECT s.location_id, si.product_id, si.sale_id, -si.quantity, 'sale'
+        FROM SaleItem si
+        JOIN Sale s ON s.sale_id = si.sale_id;
+
+        -- 7. Price history starts with today's prices
+        INSERT INTO PriceHistory (product_id, price, valid, source)
+        SELECT product_id, price, tsrange(LOCALTIMESTAMP, NULL), 'initial' FROM Product;
+
+        -- 8. Customer running totals for the sales above
+        INSERT INTO CustomerStats (customer_id, lifetime_spend, order_count, first_purchase, last_purchase)
+        SELECT customer_id, SUM(total_amount), COUNT(*), MIN(sale_date), MAX(sale_date)
+        FROM Sale
+        WHERE customer_id IS NOT NULL
+        GROUP BY customer_id;
         """
         
         cursor.execute(sql_insert_data, (hashed_pw, hashed_pw))
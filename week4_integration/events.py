@@ -0,0 +1,142 @@
+import json
+import queue
+import select
+import threading
+import time
+
+from db_connect import get_connection
+from tracing import log
+
+# Postgres NOTIFY channels forwarded to the in-process hub
+CHANNELS = ('low_stock', 'sale_committed')
+
+# Per-subscriber buffer; a dashboard that falls this far behind starts losing events
+SUBSCRIBER_QUEUE_SIZE = 100
+
+HEARTBEAT_SECONDS = 15
+
+
+class EventHub:
+    """
+    In-process fan-out: one publisher, any number of subscriber queues.
+    Each open dashboard holds one queue, so N dashboards share a single
+    database listener instead of each polling.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Slow consumer: drop rather than block the publisher
+                pass
+
+
+hub = EventHub()
+
+
+def notify_sale_committed(cursor, sale_id):
+    """
+    Queue a 'sale_committed' notification on the caller's transaction.
+    Postgres only delivers it if the sale commits, so dashboards never see
+    a rolled-back sale.
+    """
+    cursor.execute("""
+        SELECT pg_notify('sale_committed', json_build_object(
+            'sale_id', s.sale_id,
+            'location_id', s.location_id,
+            'sale_date', to_char(s.sale_date, 'YYYY-MM-DD HH24:MI'),
+            'operator_name', o.operator_name,
+            'total_cents', (s.total_amount * 100)::bigint
+        )::text)
+        FROM Sale s
+        JOIN Operator o ON o.operator_id = s.operator_id
+        WHERE s.sale_id = %s
+    """, (sale_id,))
+
+
+_listener_lock = threading.Lock()
+_listener_thread = None
+
+
+def _listen_forever():
+    """Hold one LISTEN connection and forward every notification to the hub"""
+    backoff = 1
+    while True:
+        conn = get_connection()
+        if not conn:
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            for channel in CHANNELS:
+                cursor.execute(f"LISTEN {channel}")
+            backoff = 1
+
+            while True:
+                # Wakes as soon as a NOTIFY arrives; the timeout only bounds idle waits
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        payload = notify.payload
+                    hub.publish(notify.channel, payload)
+
+        except Exception as e:
+            log(f"Event listener error: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def ensure_listener():
+    """Start the background LISTEN thread once per process"""
+    global _listener_thread
+    with _listener_lock:
+        if _listener_thread is None or not _listener_thread.is_alive():
+            _listener_thread = threading.Thread(target=_listen_forever, name='pg-listener', daemon=True)
+            _listener_thread.start()
+
+
+def sse_stream(q):
+    """
+    Yield Server-Sent Events for one subscriber queue until the client goes away.
+    A comment line is sent when idle so proxies keep the connection open.
+    """
+    try:
+        while True:
+            try:
+                event, data = q.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    finally:
+        hub.unsubscribe(q)
@@ -0,0 +1,190 @@
+import argparse
+import io
+import sys
+from datetime import datetime, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+from db_connect import get_connection
+from locations import COMPANY_STOCK, COMPANY_STOCK_JOIN
+
+DEFAULT_HISTORY_DAYS = 90
+DEFAULT_ALPHA = 0.3          # exponential smoothing factor
+DEFAULT_LEAD_TIME_DAYS = 7   # supplier lead time
+DEFAULT_SERVICE_LEVEL = 0.95 # probability of not stocking out during lead time
+DEFAULT_REVIEW_DAYS = 14     # how many days one order should cover
+
+
+def _load_demand_matrix(history_days):
+    """
+    Daily units sold per product as a (products x days) matrix, built from the
+    daily product rollups in one scan. Only products with at least one sale in
+    the window appear.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - timedelta(days=history_days)
+
+    conn = get_connection()
+    if not conn:
+        return None, None
+
+    product_ids, day_index, units = [], [], []
+    try:
+        with conn.cursor(name='demand_history') as cursor:
+            cursor.execute("""
+                SELECT r.dimension_id, (r.bucket_start::date - %s::date), r.units
+                FROM SalesRollup r
+                JOIN Product p ON p.product_id = r.dimension_id
+                WHERE r.grain = 'day' AND r.dimension = 'product'
+                  AND r.bucket_start >= %s AND r.bucket_start < %s
+                  AND p.is_active = TRUE
+            """, (since, since, today))
+            while True:
+                rows = cursor.fetchmany(50000)
+                if not rows:
+                    break
+                for row in rows:
+                    product_ids.append(row[0])
+                    day_index.append(row[1])
+                    units.append(row[2])
+    finally:
+        conn.rollback()
+        conn.close()
+
+    ids = np.array(product_ids, dtype=np.int64)
+    unique_ids, rows = np.unique(ids, return_inverse=True)
+    matrix = np.zeros((len(unique_ids), history_days), dtype=np.float64)
+    np.add.at(matrix, (rows, np.array(day_index, dtype=np.int64)), np.array(units, dtype=np.float64))
+    return unique_ids, matrix
+
+
+def forecast_demand(matrix, alpha=DEFAULT_ALPHA):
+    """
+    Simple exponential smoothing for every product at once.
+    Loops over days only; each step is a vector operation across products.
+
+    Returns:
+        (level, sigma): forecast daily demand and the RMS one-step error.
+    """
+    n_products, n_days = matrix.shape
+    if n_days == 0:
+        return np.zeros(n_products), np.zeros(n_products)
+
+    level = matrix[:, 0].copy()
+    sq_error = np.zeros(n_products)
+    for t in range(1, n_days):
+        error = matrix[:, t] - level
+        sq_error += error * error
+        level += alpha * error
+    sigma = np.sqrt(sq_error / max(n_days - 1, 1))
+    return level, sigma
+
+
+def compute_reorder_points(level, sigma, lead_time_days, service_level, review_days):
+    """Reorder point and order-up-to level, both in whole units and never below zero"""
+    z = NormalDist().inv_cdf(service_level)
+    reorder_point = np.maximum(np.ceil(level * lead_time_days + z * sigma * np.sqrt(lead_time_days)), 0)
+    order_up_to = reorder_point + np.ceil(level * review_days)
+    return reorder_point.astype(np.int64), order_up_to.astype(np.int64)
+
+
+def run_forecast(history_days=DEFAULT_HISTORY_DAYS, alpha=DEFAULT_ALPHA,
+                 lead_time_days=DEFAULT_LEAD_TIME_DAYS, service_level=DEFAULT_SERVICE_LEVEL,
+                 review_days=DEFAULT_REVIEW_DAYS):
+    """
+    Fit demand for the whole catalog, store the results in ProductForecast and
+    set Product.low_stock_threshold to each reorder point, all in one
+    set-based statement. Products with no sales in the history window keep
+    their current threshold.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    # Below 0.5 the safety stock turns negative; 0 and 1 have no z-score
+    if not 0.5 <= service_level < 1:
+        return False, f"Service level must be at least 0.5 and below 1 (got {service_level})."
+
+    product_ids, matrix = _load_demand_matrix(history_days)
+    if product_ids is None:
+        return False, "Database connection failed"
+    if len(product_ids) == 0:
+        return True, "No sales history to forecast from."
+
+    level, sigma = forecast_demand(matrix, alpha)
+    reorder_point, order_up_to = compute_reorder_points(level, sigma, lead_time_days, service_level, review_days)
+
+    buffer = io.StringIO()
+    for row in zip(product_ids, np.round(level, 3), np.round(sigma, 3), reorder_point, order_up_to):
+        buffer.write("\t".join(str(v) for v in row) + "\n")
+    buffer.seek(0)
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE forecast_stage (
+                product_id INTEGER PRIMARY KEY,
+                daily_demand NUMERIC(12, 3),
+                demand_sd NUMERIC(12, 3),
+                reorder_point INTEGER,
+                order_up_to INTEGER
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert("COPY forecast_stage FROM STDIN", buffer)
+
+        # Suggested order = top back up to order_up_to from today's stock
+        cursor.execute(f"""
+            WITH saved AS (
+                INSERT INTO ProductForecast (product_id, daily_demand, demand_sd, reorder_point,
+                                             order_qty, lead_time_days, service_level, computed_at)
+                SELECT f.product_id, f.daily_demand, f.demand_sd, f.reorder_point,
+                       GREATEST(f.order_up_to - {COMPANY_STOCK}, 0), %s, %s, CURRENT_TIMESTAMP
+                FROM forecast_stage f
+                JOIN Product p ON p.product_id = f.product_id
+                {COMPANY_STOCK_JOIN}
+                ON CONFLICT (product_id) DO UPDATE
+                   SET daily_demand = EXCLUDED.daily_demand,
+                       demand_sd = EXCLUDED.demand_sd,
+                       reorder_point = EXCLUDED.reorder_point,
+                       order_qty = EXCLUDED.order_qty,
+                       lead_time_days = EXCLUDED.lead_time_days,
+                       service_level = EXCLUDED.service_level,
+                       computed_at = EXCLUDED.computed_at
+                RETURNING product_id, reorder_point
+            )
+            UPDATE Product p
+               SET low_stock_threshold = saved.reorder_point
+              FROM saved
+             WHERE p.product_id = saved.product_id
+        """, (lead_time_days, service_level))
+        updated = cursor.rowcount
+
+        conn.commit()
+        return True, f"Updated reorder points for {updated} product(s)."
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Forecast failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Nightly, after rollup.py: python forecasting.py --lead-time 7 --service-level 0.95
+    parser = argparse.ArgumentParser(description="Recompute reorder points from recent demand.")
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY_DAYS, help="days of sales history")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="smoothing factor (0-1)")
+    parser.add_argument("--lead-time", type=int, default=DEFAULT_LEAD_TIME_DAYS, help="supplier lead time in days")
+    parser.add_argument("--service-level", type=float, default=DEFAULT_SERVICE_LEVEL, help="e.g. 0.95")
+    parser.add_argument("--review", type=int, default=DEFAULT_REVIEW_DAYS, help="days each order should cover")
+    args = parser.parse_args()
+
+    ok, message = run_forecast(args.history, args.alpha, args.lead_time, args.service_level, args.review)
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
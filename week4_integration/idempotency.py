@@ -0,0 +1,146 @@
+import argparse
+import sys
+import threading
+from collections import OrderedDict
+
+import metrics
+from db_connect import get_connection
+
+# Results remembered per process; older keys fall back to the CheckoutRequest table
+CACHE_SIZE = 1024
+
+# A retry comes within seconds or minutes; keys older than this are pruned
+KEY_RETENTION_DAYS = 7
+PRUNE_BATCH = 5000
+
+
+class ResultCache:
+    """
+    Small thread-safe LRU of idempotency key -> result message. It only saves
+    the database round trip on a replay; CheckoutRequest is the record.
+    """
+    def __init__(self, name, size=CACHE_SIZE):
+        self._labels = (('cache', name),)
+        self._lock = threading.Lock()
+        self._size = size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+        metrics.inc('cache_requests_total', self._labels + (('result', 'hit' if value is not None else 'miss'),))
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+
+checkout_results = ResultCache('checkout_results')
+
+
+def claim_key(cursor, key):
+    """
+    Claim an idempotency key on the caller's transaction. Returns True if
+    this request owns it. A concurrent request with the same key waits on the
+    unique index until the owner commits (False: replay its result) or rolls
+    back (True: the key is free again).
+    """
+    cursor.execute("""
+        INSERT INTO CheckoutRequest (idempotency_key) VALUES (%s)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING idempotency_key
+    """, (key,))
+    return cursor.fetchone() is not None
+
+
+def store_result(cursor, key, sale_id, message):
+    """Record the outcome on the claimed key; commits with the sale itself"""
+    cursor.execute("""
+        UPDATE CheckoutRequest SET sale_id = %s, message = %s
+        WHERE idempotency_key = %s
+    """, (sale_id, message, key))
+
+
+def get_result(key):
+    """Stored message of a committed checkout, or None if the key was never used"""
+    cached = checkout_results.get(key)
+    if cached is not None:
+        return cached
+
+    conn = get_connection()
+    if not conn:
+        return None
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT message FROM CheckoutRequest WHERE idempotency_key = %s", (key,))
+        row = cursor.fetchone()
+        if row:
+            checkout_results.put(key, row[0])
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def prune_keys(retention_days=KEY_RETENTION_DAYS, batch_size=PRUNE_BATCH):
+    """
+    Delete idempotency keys older than retention_days in batches of
+    batch_size, one transaction each. SKIP LOCKED leaves a key that a
+    checkout is claiming right now alone.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    pruned = 0
+    try:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("""
+                WITH due AS (
+                    SELECT idempotency_key
+                    FROM CheckoutRequest
+                    WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                    ORDER BY created_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                DELETE FROM CheckoutRequest c
+                 USING due
+                 WHERE c.idempotency_key = due.idempotency_key
+            """, (retention_days, batch_size))
+            deleted = cursor.rowcount
+            conn.commit()
+            pruned += deleted
+            if deleted < batch_size:
+                break
+
+        return True, f"Pruned {pruned} checkout key(s)."
+
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error pruning checkout keys: {e}"
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Daily: python idempotency.py
+    parser = argparse.ArgumentParser(description="Delete old checkout idempotency keys.")
+    parser.add_argument("--days", type=int, default=KEY_RETENTION_DAYS, help="keep keys this many days")
+    parser.add_argument("--batch", type=int, default=PRUNE_BATCH, help="keys deleted per transaction")
+    args = parser.parse_args()
+
+    ok, message = prune_keys(args.days, args.batch)
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
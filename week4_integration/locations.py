@@ -0,0 +1,134 @@
+from psycopg2 import errors
+
+from db_connect import get_connection
+from tracing import log, traced
+from crud_product import record_stock_movement
+
+LOCATION_KINDS = ('store', 'warehouse')
+
+# Company-wide stock per product (all stores and warehouses), for queries
+# that join Product as p: select COMPANY_STOCK after COMPANY_STOCK_JOIN.
+# Summed per joined product through idx_locationstock_product, so a paged
+# or filtered query only reads the stock rows of the products it returns.
+COMPANY_STOCK_JOIN = """
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(SUM(ls.quantity), 0) AS quantity
+        FROM LocationStock ls
+        WHERE ls.product_id = p.product_id
+    ) ts ON TRUE
+"""
+COMPANY_STOCK = "ts.quantity"
+
+
+@traced
+def list_locations(active_only=True):
+    """[(location_id, location_name, kind, is_active)] stores first, then warehouses"""
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT location_id, location_name, kind, is_active
+            FROM Location
+            WHERE is_active OR NOT %s
+            ORDER BY kind = 'warehouse', location_name
+        """, (active_only,))
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching locations: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def create_location(name, kind='store'):
+    """
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if kind not in LOCATION_KINDS:
+        return False, f"Unknown location type '{kind}'."
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Location (location_name, kind) VALUES (%s, %s) RETURNING location_id",
+                       (name.strip(), kind))
+        location_id = cursor.fetchone()[0]
+        conn.commit()
+        return True, f"Location #{location_id} created."
+    except errors.UniqueViolation:
+        conn.rollback()
+        return False, "A location with that name already exists."
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error creating location: {e}"
+    finally:
+        conn.close()
+
+
+@traced
+def transfer_stock(product_id, from_location_id, to_location_id, quantity):
+    """
+    Move stock between two locations in one transaction. Both rows are
+    locked in location_id order so two opposite transfers can't deadlock,
+    and each side gets a 'transfer' ledger movement.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if from_location_id == to_location_id:
+        return False, "Choose two different locations."
+    if quantity <= 0:
+        return False, "Quantity must be positive."
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        # The destination may not stock this product yet
+        cursor.execute("""
+            INSERT INTO LocationStock (location_id, product_id, quantity) VALUES (%s, %s, 0)
+            ON CONFLICT (location_id, product_id) DO NOTHING
+        """, (to_location_id, product_id))
+        cursor.execute("""
+            SELECT location_id, quantity - reserved
+            FROM LocationStock
+            WHERE product_id = %s AND location_id IN (%s, %s)
+            ORDER BY location_id
+            FOR UPDATE
+        """, (product_id, from_location_id, to_location_id))
+        stock = dict(cursor.fetchall())
+
+        # Units held for carts at the source stay put
+        available = max(stock.get(from_location_id, 0), 0)
+        if available < quantity:
+            conn.rollback()
+            return False, f"Not enough stock to transfer. (Available: {available}, Requested: {quantity})"
+
+        cursor.execute("""
+            UPDATE LocationStock
+               SET quantity = quantity + CASE WHEN location_id = %(to)s THEN %(qty)s ELSE -%(qty)s END
+             WHERE product_id = %(product)s AND location_id IN (%(from)s, %(to)s)
+        """, {'product': product_id, 'from': from_location_id, 'to': to_location_id, 'qty': quantity})
+        record_stock_movement(cursor, from_location_id, product_id, -quantity, 'transfer')
+        record_stock_movement(cursor, to_location_id, product_id, quantity, 'transfer')
+
+        conn.commit()
+        return True, f"Transferred {quantity} unit(s)."
+    except errors.ForeignKeyViolation:
+        conn.rollback()
+        return False, "Invalid product or location."
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error transferring stock: {e}"
+    finally:
+        conn.close()
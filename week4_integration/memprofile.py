@@ -0,0 +1,145 @@
+import os
+import threading
+import tracemalloc
+
+from flask import g, request
+
+import metrics
+from tracing import log
+
+# MEMORY_PROFILE=1 traces allocations from startup; otherwise tracing starts when an
+# admin takes the first snapshot. Tracing roughly doubles allocation cost, so leave
+# it off in normal operation.
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "") == "1"
+MEMORY_PROFILE_FRAMES = int(os.getenv("MEMORY_PROFILE_FRAMES", "1"))
+
+# Requests whose peak allocation passes this are printed (bytes)
+MEMORY_WARN_BYTES = int(os.getenv("MEMORY_WARN_BYTES", str(64 * 1024 * 1024)))
+
+TOP_N = 25
+
+# Long-lived streams (the dashboard's SSE feed stays open as long as the page)
+# would overlap every other request; they are neither measured nor counted.
+# Their own allocations are small and per event.
+UNMEASURED_ENDPOINTS = frozenset({'event_stream'})
+
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_baseline_lock = threading.Lock()
+_baseline = None
+
+# tracemalloc's peak is process-wide, so a request's peak is only its own if no
+# other request ran at any point during it. _overlaps counts requests that
+# started while another was in flight; a measurement is kept only if it
+# didn't change while the request ran.
+_inflight_lock = threading.Lock()
+_inflight = 0
+_overlaps = 0
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+
+def _location(trace_or_stat):
+    frame = trace_or_stat.traceback[0]
+    return f"{os.path.relpath(frame.filename)}:{frame.lineno}"
+
+
+def memory_report(limit=TOP_N):
+    """Current and peak traced memory plus the largest allocation sites"""
+    if not tracemalloc.is_tracing():
+        return {'tracing': False}
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'tracing': True,
+        'current_kb': current // 1024,
+        'peak_kb': peak // 1024,
+        'has_baseline': _baseline is not None,
+        'top': [
+            {'location': _location(stat), 'size_kb': stat.size // 1024, 'count': stat.count}
+            for stat in _snapshot().statistics('lineno')[:limit]
+        ],
+    }
+
+
+def take_baseline():
+    """Start tracing if needed and remember a snapshot to diff against"""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_PROFILE_FRAMES)
+    with _baseline_lock:
+        _baseline = _snapshot()
+    return memory_report()
+
+
+def diff_baseline(limit=TOP_N):
+    """Allocation sites that grew the most since the baseline, or None without one"""
+    with _baseline_lock:
+        baseline = _baseline
+    if baseline is None or not tracemalloc.is_tracing():
+        return None
+    return [
+        {
+            'location': _location(stat),
+            'size_kb': stat.size // 1024,
+            'size_diff_kb': stat.size_diff // 1024,
+            'count_diff': stat.count_diff,
+        }
+        for stat in _snapshot().compare_to(baseline, 'lineno')[:limit]
+    ]
+
+
+def stop_tracing():
+    global _baseline
+    with _baseline_lock:
+        _baseline = None
+    tracemalloc.stop()
+
+
+def _start_request():
+    global _inflight, _overlaps
+    if not tracemalloc.is_tracing() or request.endpoint in UNMEASURED_ENDPOINTS:
+        return
+    with _inflight_lock:
+        _inflight += 1
+        g.memory_counted = True
+        if _inflight > 1:
+            # Spoils the measurement of whatever is already running; this one isn't measured
+            _overlaps += 1
+            return
+        tracemalloc.reset_peak()
+        g.memory_start = (tracemalloc.get_traced_memory()[0], _overlaps)
+
+
+def _record_peak(exc=None):
+    # Teardown: runs after a streamed response has been fully sent, so streaming counts too
+    global _inflight
+    if not g.pop('memory_counted', False):
+        return
+    start = g.pop('memory_start', None)
+    with _inflight_lock:
+        _inflight -= 1
+        if start is None or start[1] != _overlaps or not tracemalloc.is_tracing():
+            return
+        peak = max(tracemalloc.get_traced_memory()[1] - start[0], 0)
+    metrics.observe('http_request_peak_alloc_bytes', peak, (('route', request.endpoint or 'unknown'),))
+    if peak > MEMORY_WARN_BYTES:
+        log(f"⚠️ {request.method} {request.path} peaked at {peak // (1024 * 1024)} MiB allocated")
+
+
+def init_memory_profile(app):
+    """
+    Per-request peak tracking while tracemalloc is tracing. Only requests that
+    ran with no other request overlapping them are recorded, so each value is
+    that request's own peak. Open SSE streams (UNMEASURED_ENDPOINTS) don't
+    count as overlapping.
+    """
+    if MEMORY_PROFILE:
+        tracemalloc.start(MEMORY_PROFILE_FRAMES)
+    app.before_request(_start_request)
+    app.teardown_request(_record_peak)
@@ -0,0 +1,161 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds in seconds (Prometheus defaults)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histograms that don't measure seconds
+HISTOGRAM_BUCKETS = {
+    'http_request_peak_alloc_bytes': tuple(2 ** n for n in range(16, 29, 2)),  # 64 KiB .. 256 MiB
+}
+
+# name: (type, help). Every metric recorded must be declared here.
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by route and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by route.'),
+    'http_request_peak_alloc_bytes': ('histogram', 'Peak Python allocation of requests that ran alone, by route (only while tracemalloc runs).'),
+    'db_statements_total': ('counter', 'SQL statements executed, by calling function.'),
+    'db_statement_duration_seconds': ('histogram', 'SQL statement execution time, by calling function.'),
+    'db_connections_opened_total': ('counter', 'Database connections opened (there is no pool; every call connects).'),
+    'db_connections_failed_total': ('counter', 'Database connection attempts that failed.'),
+    'db_connections_open': ('gauge', 'Database connections currently open in this process.'),
+    'db_connect_duration_seconds': ('histogram', 'Time to open a database connection.'),
+    'cache_requests_total': ('counter', 'In-memory cache lookups, by cache and hit/miss.'),
+    'checkout_total': ('counter', 'create_sale outcomes: success, failure, replay.'),
+}
+
+
+class _Shard:
+    """One thread's metric values. Only its owner thread writes, so no lock is needed."""
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.values = {}       # (name, labels) -> number
+        self.histograms = {}   # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+
+_local = threading.local()
+_shards_lock = threading.Lock()   # taken once per thread and per scrape, never per update
+_shards = []
+_retired = _Shard()               # values of threads that have exited
+_collectors = []
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def inc(name, labels=(), value=1):
+    """Add value to a counter or gauge. labels is a tuple of (key, value) pairs."""
+    values = _shard().values
+    key = (name, labels)
+    values[key] = values.get(key, 0) + value
+
+
+def observe(name, value, labels=()):
+    """Record one observation in a histogram (seconds unless HISTOGRAM_BUCKETS says otherwise)"""
+    buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+    histograms = _shard().histograms
+    key = (name, labels)
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0] * (len(buckets) + 2)
+    counts[bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+class timer:
+    """with timer('name', labels): ... observes the block's duration"""
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, self.labels)
+        return False
+
+
+def register_collector(collect):
+    """
+    Add values owned elsewhere (e.g. admission counters) to every scrape.
+    collect() returns [(name, type, help, [(labels, value), ...])].
+    """
+    _collectors.append(collect)
+
+
+def _merge(into, shard):
+    for key, value in list(shard.values.items()):
+        into.values[key] = into.values.get(key, 0) + value
+    for key, counts in list(shard.histograms.items()):
+        total = into.histograms.setdefault(key, [0] * len(counts))
+        for i, count in enumerate(counts):
+            total[i] += count
+
+
+def _snapshot():
+    """Sum every shard; shards of finished threads are folded into _retired and dropped"""
+    merged = _Shard()
+    with _shards_lock:
+        for shard in list(_shards):
+            if not shard.thread.is_alive():
+                _merge(_retired, shard)
+                _shards.remove(shard)
+            else:
+                _merge(merged, shard)
+        _merge(merged, _retired)
+    return merged
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    merged = _snapshot()
+    by_name = {}
+    for (name, labels), value in merged.values.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), counts in merged.histograms.items():
+        by_name.setdefault(name, []).append((labels, counts))
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for labels, value in sorted(by_name.get(name, [])):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, (("le", bound),))} {cumulative}')
+            cumulative += value[len(buckets)]
+            lines.append(f'{name}_bucket{_labels(labels, (("le", "+Inf"),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+
+    for collect in _collectors:
+        for name, kind, help_text, samples in collect():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(labels)} {_number(value)}' for labels, value in samples]
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,46 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Money is carried as integer cents everywhere in Python and only turned into
+# Decimal at the database boundary (NUMERIC columns) or into text at display time.
+# Queries read NUMERIC columns as cents directly: (price * 100)::bigint
+CENTS = 100
+
+
+def cents_from_units(value):
+    """
+    Parse an amount in currency units (form input, Decimal, int) into integer
+    cents, rounded half-up: '15.50' -> 1550, 15 -> 1500.
+
+    Raises:
+        ValueError: if value is not a number. Floats are refused; pass the
+        original string or a Decimal instead.
+    """
+    if isinstance(value, (bool, float)) or value is None:
+        raise ValueError(f"Not a money amount: {value!r}")
+    try:
+        amount = value if isinstance(value, Decimal) else Decimal(str(value).strip())
+        if not amount.is_finite():
+            raise ValueError
+        return int((amount * CENTS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Not a money amount: {value!r}")
+
+
+def from_cents(cents):
+    """Integer cents -> Decimal with two places, for NUMERIC query parameters"""
+    return Decimal(cents).scaleb(-2)
+
+
+def format_money(cents, symbol=True):
+    """
+    Integer cents -> '$1234.50' for display; symbol=False gives '1234.50' for
+    form inputs. Anything but an int is refused rather than guessed at.
+
+    Raises:
+        TypeError: if cents is not an int.
+    """
+    if not isinstance(cents, int) or isinstance(cents, bool):
+        raise TypeError(f"format_money takes integer cents, got {cents!r}")
+    sign = '-' if cents < 0 else ''
+    whole, frac = divmod(abs(cents), CENTS)
+    return f"{sign}{'$' if symbol else ''}{whole}.{frac:02d}"
@@ -0,0 +1,255 @@
+from decimal import Decimal
+
+from db_connect import get_connection
+from money import cents_from_units, from_cents
+from tracing import log, traced
+
+REPRICE_MODES = ('percent', 'absolute')
+
+# How the raw new price is rounded; every result is clamped at zero
+ROUNDING_RULES = {
+    'cent': "ROUND({raw}, 2)",
+    'nickel': "ROUND({raw} * 20) / 20",
+    'whole': "ROUND({raw}, 0)",
+    'ending_99': "CEIL({raw}) - 0.01",
+}
+
+PREVIEW_LIMIT = 200
+
+# When a product's open PriceHistory row hands over to a new price: this
+# transaction's start, unless the open row started later (a change committed
+# while we waited for the product lock). Then it is the current clock time,
+# so the concurrent row keeps a non-empty range instead of vanishing.
+HANDOVER_AT = """
+    CASE WHEN lower({valid}) < LOCALTIMESTAMP THEN LOCALTIMESTAMP
+         ELSE GREATEST(clock_timestamp()::timestamp, lower({valid}) + interval '1 microsecond') END
+"""
+
+# Products a reprice applies to. Every filter is optional; the category
+# filter covers the whole subtree through the closure table.
+TARGET_SQL = """
+    SELECT p.product_id, p.sku, p.product_name, p.price AS old_price,
+           GREATEST({new_price}, 0)::numeric(10, 2) AS new_price
+    FROM Product p
+    WHERE p.is_active = TRUE
+      AND (%(category_id)s::int IS NULL OR p.category_id IN (
+            SELECT descendant_id FROM CategoryClosure WHERE ancestor_id = %(category_id)s))
+      AND (%(skus)s::text[] IS NULL OR p.sku = ANY(%(skus)s))
+      AND (%(min_price)s::numeric IS NULL OR p.price >= %(min_price)s)
+      AND (%(max_price)s::numeric IS NULL OR p.price <= %(max_price)s)
+"""
+
+
+def record_price(cursor, product_id, price, source, changed_by=None):
+    """
+    Make price the product's current list price in PriceHistory: the open
+    row is closed and the new open row starts at the same instant
+    (HANDOVER_AT). Runs on the caller's cursor, after it has locked the
+    product, so history commits with the price change itself.
+    """
+    cursor.execute(f"""
+        UPDATE PriceHistory h
+           SET valid = tsrange(lower(h.valid), o.changed_at)
+          FROM (SELECT price_history_id, {HANDOVER_AT.format(valid='valid')} AS changed_at
+                FROM PriceHistory
+                WHERE product_id = %s AND upper_inf(valid)) o
+         WHERE h.price_history_id = o.price_history_id
+        RETURNING o.changed_at
+    """, (product_id,))
+    closed = cursor.fetchone()
+    cursor.execute("""
+        INSERT INTO PriceHistory (product_id, price, valid, source, changed_by)
+        VALUES (%s, %s, tsrange(COALESCE(%s, LOCALTIMESTAMP), NULL), %s, %s)
+    """, (product_id, price, closed[0] if closed else None, source, changed_by))
+
+
+@traced
+def get_prices_at(at, category_id=None):
+    """
+    Catalog list prices at a point in time, answered from the GiST index on
+    the validity ranges rather than by scanning each product's history.
+    Returns [(product_id, sku, product_name, price_cents)].
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.product_id, p.sku, p.product_name, (h.price * 100)::bigint
+            FROM PriceHistory h
+            JOIN Product p ON p.product_id = h.product_id
+            WHERE h.valid @> %(at)s::timestamp
+              AND (%(category_id)s::int IS NULL OR p.category_id IN (
+                    SELECT descendant_id FROM CategoryClosure WHERE ancestor_id = %(category_id)s))
+            ORDER BY p.product_name
+        """, {'at': at, 'category_id': category_id})
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching prices at {at}: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+@traced
+def get_price_history(product_id):
+    """Newest first: [(price_cents, valid_from, valid_to or None, source, operator_name)]"""
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT (h.price * 100)::bigint, lower(h.valid), upper(h.valid), h.source, o.operator_name
+            FROM PriceHistory h
+            LEFT JOIN Operator o ON o.operator_id = h.changed_by
+            WHERE h.product_id = %s AND NOT isempty(h.valid)
+            ORDER BY lower(h.valid) DESC
+        """, (product_id,))
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching price history: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def _row_in_cents(row):
+    """(id, sku, name, old_price, new_price) with both prices as integer cents"""
+    return (*row[:3], cents_from_units(row[3]), cents_from_units(row[4]))
+
+
+def _new_price_sql(mode, rounding):
+    if mode not in REPRICE_MODES:
+        raise ValueError(f"Unknown reprice mode '{mode}'")
+    if rounding not in ROUNDING_RULES:
+        raise ValueError(f"Unknown rounding rule '{rounding}'")
+    raw = "p.price * (1 + %(amount)s / 100.0)" if mode == 'percent' else "p.price + %(amount)s"
+    return ROUNDING_RULES[rounding].format(raw=f"({raw})")
+
+
+@traced
+def bulk_reprice(mode, amount, rounding='cent', category_id=None, skus=None,
+                 min_cents=None, max_cents=None, all_products=False, dry_run=True, operator_id=None):
+    """
+    Reprice every matching product in one set-based statement.
+
+    Args:
+        mode (str): 'percent' (amount = +/- percent) or 'absolute' (amount = +/- cents).
+        amount (Decimal or int): Percent for 'percent', integer cents for 'absolute'.
+        rounding (str): Key of ROUNDING_RULES.
+        category_id (int or None): Limit to this category and its subcategories.
+        skus (list or None): Limit to these SKUs.
+        min_cents, max_cents (int or None): Limit to a current-price band.
+        all_products (bool): Must be set to run with none of the filters above,
+            so the whole catalog is never repriced by leaving the form empty.
+        dry_run (bool): Only compute the diff; nothing is written.
+        operator_id (int or None): Recorded on the price history rows.
+
+    Returns:
+        (bool, dict or str): On success a dict with 'matched', 'changed',
+        'delta_total' (cents) and 'rows' [(id, sku, name, old_cents, new_cents)],
+        the first PREVIEW_LIMIT changed products. On failure a message.
+    """
+    try:
+        new_price = _new_price_sql(mode, rounding)
+    except ValueError as e:
+        return False, str(e)
+
+    if category_id is None and not skus and min_cents is None and max_cents is None and not all_products:
+        return False, "Choose a category, SKUs or a price band, or confirm repricing all products."
+
+    params = {
+        'amount': Decimal(amount) if mode == 'percent' else from_cents(amount),
+        'category_id': category_id,
+        'skus': list(skus) if skus else None,
+        'min_price': from_cents(min_cents) if min_cents is not None else None,
+        'max_price': from_cents(max_cents) if max_cents is not None else None,
+        'operator_id': operator_id,
+        'limit': PREVIEW_LIMIT,
+    }
+    target = TARGET_SQL.format(new_price=new_price)
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        if dry_run:
+            cursor.execute(f"""
+                WITH target AS ({target})
+                SELECT COUNT(*) OVER (),
+                       COUNT(*) FILTER (WHERE new_price <> old_price) OVER (),
+                       COALESCE(SUM(new_price - old_price) OVER (), 0),
+                       product_id, sku, product_name, old_price, new_price
+                FROM target
+                ORDER BY (new_price = old_price), product_name
+                LIMIT %(limit)s
+            """, params)
+            rows = cursor.fetchall()
+            matched, changed, delta = rows[0][:3] if rows else (0, 0, Decimal('0'))
+            return True, {
+                'matched': matched,
+                'changed': changed,
+                'delta_total': cents_from_units(delta),
+                'rows': [_row_in_cents(row[3:]) for row in rows if row[6] != row[7]],
+            }
+
+        # Lock the targets first, so the update below reads the price history
+        # of any change that committed while we waited
+        cursor.execute(f"SELECT COUNT(*) FROM ({target} FOR UPDATE OF p) t", params)
+
+        # Update and log in one statement: all or nothing, however many SKUs
+        cursor.execute(f"""
+            WITH target AS ({target}),
+            changed AS (
+                UPDATE Product p
+                   SET price = t.new_price
+                  FROM target t
+                 WHERE p.product_id = t.product_id
+                   AND t.new_price <> t.old_price
+                RETURNING p.product_id, p.sku, p.product_name, t.old_price, t.new_price
+            ),
+            closed AS (
+                UPDATE PriceHistory h
+                   SET valid = tsrange(lower(h.valid), o.changed_at)
+                  FROM (SELECT oh.price_history_id, {HANDOVER_AT.format(valid='oh.valid')} AS changed_at
+                        FROM PriceHistory oh
+                        JOIN changed c ON c.product_id = oh.product_id
+                        WHERE upper_inf(oh.valid)) o
+                 WHERE h.price_history_id = o.price_history_id
+                RETURNING h.product_id, o.changed_at
+            ),
+            opened AS (
+                INSERT INTO PriceHistory (product_id, price, valid, source, changed_by)
+                SELECT c.product_id, c.new_price, tsrange(COALESCE(h.changed_at, LOCALTIMESTAMP), NULL),
+                       'bulk', %(operator_id)s
+                FROM changed c
+                LEFT JOIN closed h ON h.product_id = c.product_id
+            )
+            SELECT m.matched, c.product_id, c.sku, c.product_name, c.old_price, c.new_price
+            FROM (SELECT COUNT(*) AS matched FROM target) m
+            LEFT JOIN changed c ON TRUE
+            ORDER BY c.product_name
+        """, params)
+        rows = cursor.fetchall()
+        conn.commit()
+        changed = [_row_in_cents(row[1:]) for row in rows if row[1] is not None]
+        return True, {
+            'matched': rows[0][0],
+            'changed': len(changed),
+            'delta_total': sum(row[4] - row[3] for row in changed),
+            'rows': changed[:PREVIEW_LIMIT],
+        }
+
+    except Exception as e:
+        conn.rollback()
+        log(f"Bulk reprice failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
@@ -0,0 +1,130 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+from tracing import log
+
+# Opt-in: nothing is hooked into the app unless one of these selects some requests
+PROFILE_RATE = float(os.getenv("PROFILE_RATE", "0"))            # fraction of requests, 0..1
+PROFILE_ROUTES = {r for r in os.getenv("PROFILE_ROUTES", "").split(",") if r}  # endpoints always profiled
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "")                # e.g. X-Profile: profile requests sending it
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+SUMMARY_ROWS = 40
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples one thread's Python stack every interval until stopped. Wall-clock
+    sampling, so time blocked on the database shows up under the query's caller.
+    """
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(name=f"profiler-{thread_id}", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def _selected():
+    if request.endpoint in PROFILE_ROUTES:
+        return True
+    if PROFILE_HEADER and request.headers.get(PROFILE_HEADER):
+        return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+def _start():
+    if request.endpoint == 'static' or not _selected():
+        return
+    sampler = StackSampler(threading.get_ident())
+    g.profile = (sampler, time.perf_counter())
+    sampler.start()
+
+
+def _finish(exc=None):
+    # Teardown runs after a streamed response has been fully sent
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    sampler, started = profile
+    stacks = sampler.stop()
+    try:
+        write_profile(request.endpoint or 'unknown', time.perf_counter() - started, stacks)
+    except OSError as e:
+        log(f"Profiler could not write output: {e}")
+
+
+def summarize(stacks):
+    """[(function, self samples, inclusive samples)] heaviest self time first"""
+    own, inclusive = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    return sorted(((name, own[name], inclusive[name]) for name in inclusive),
+                  key=lambda row: (-row[1], -row[2]))
+
+
+def write_profile(endpoint, seconds, stacks):
+    """
+    Write <PROFILE_DIR>/<time>_<endpoint>_<ms>ms.folded (collapsed stacks, for
+    flamegraph.pl or speedscope) and a matching .txt per-function summary.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = "{}_{}_{}ms".format(datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+                               re.sub(r"[^\w.-]", "_", endpoint), round(seconds * 1000))
+    base = os.path.join(PROFILE_DIR, stem)
+
+    with open(base + ".folded", "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+    total = sum(stacks.values()) or 1
+    with open(base + ".txt", "w") as f:
+        f.write(f"{endpoint}: {seconds * 1000:.1f} ms, {sum(stacks.values())} samples "
+                f"every {PROFILE_INTERVAL * 1000:g} ms\n\n")
+        f.write(f"{'self':>7} {'self%':>6} {'total':>7} {'total%':>6}  function\n")
+        for name, own, inclusive in summarize(stacks)[:SUMMARY_ROWS]:
+            f.write(f"{own:>7} {100 * own / total:>5.1f}% {inclusive:>7} {100 * inclusive / total:>5.1f}%  {name}\n")
+    return base
+
+
+def init_profiler(app):
+    """Hook the sampler into app if profiling is configured; otherwise add nothing"""
+    if PROFILE_RATE <= 0 and not PROFILE_ROUTES and not PROFILE_HEADER:
+        return False
+    app.before_request(_start)
+    app.teardown_request(_finish)
+    print(f"Profiling on: rate={PROFILE_RATE}, routes={sorted(PROFILE_ROUTES)}, "
+          f"header={PROFILE_HEADER or '-'} -> {PROFILE_DIR}")
+    return True
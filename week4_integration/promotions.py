@@ -0,0 +1,268 @@
+import sys
+
+from psycopg2 import errors
+
+from db_connect import get_connection
+from tracing import log, traced
+from money import from_cents
+
+PROMOTION_KINDS = ('price_override', 'category_percent', 'buy_x_get_y')
+
+# Join a Product row (alias p) to its compiled promotion (alias e). The price
+# rule and the bundle rule each carry their own end, so one ending leaves the
+# other in force; an ended rule reads as NULL even before the next refresh.
+EFFECTIVE_PRICE_JOIN = """
+    LEFT JOIN (
+        SELECT product_id,
+               CASE WHEN price_valid_until IS NULL OR price_valid_until > CURRENT_TIMESTAMP
+                    THEN override_price END AS override_price,
+               CASE WHEN price_valid_until IS NULL OR price_valid_until > CURRENT_TIMESTAMP
+                    THEN percent_off END AS percent_off,
+               CASE WHEN bundle_valid_until IS NULL OR bundle_valid_until > CURRENT_TIMESTAMP
+                    THEN buy_qty END AS buy_qty,
+               CASE WHEN bundle_valid_until IS NULL OR bundle_valid_until > CURRENT_TIMESTAMP
+                    THEN free_qty END AS free_qty
+        FROM EffectivePrice
+    ) e ON e.product_id = p.product_id
+"""
+
+# Unit price in cents after any override or percentage discount
+EFFECTIVE_PRICE_CENTS = """
+    (COALESCE(e.override_price, ROUND(p.price * (100 - e.percent_off) / 100, 2), p.price) * 100)::bigint
+"""
+
+# Products a scoped refresh recompiles: the listed products plus every
+# product in the category's subtree (either may be NULL)
+SCOPE_SQL = """
+    SELECT product_id FROM Product WHERE product_id = ANY(%(product_ids)s)
+    UNION
+    SELECT p.product_id
+    FROM CategoryClosure cc
+    JOIN Product p ON p.category_id = cc.descendant_id
+    WHERE cc.ancestor_id = %(category_id)s
+"""
+
+# One pass over the active rules. Category rules reach every product in the
+# category's subtree through the closure table. Per product, an explicit price
+# override beats a category discount and the deepest discount wins; the most
+# generous buy-X-get-Y wins independently, so both can apply to one line.
+# %(everything)s compiles the whole catalog, otherwise only SCOPE_SQL.
+COMPILE_SQL = f"""
+    WITH scope AS ({SCOPE_SQL}),
+    active AS (
+        SELECT *
+        FROM Promotion
+        WHERE is_active = TRUE
+          AND starts_at <= CURRENT_TIMESTAMP
+          AND (ends_at IS NULL OR ends_at > CURRENT_TIMESTAMP)
+    ),
+    targets AS (
+        SELECT a.promotion_id, a.kind, a.override_price, a.percent_off, a.buy_qty, a.free_qty,
+               a.ends_at, a.product_id
+        FROM active a
+        WHERE a.product_id IS NOT NULL
+          AND (%(everything)s OR a.product_id IN (SELECT product_id FROM scope))
+        UNION ALL
+        SELECT a.promotion_id, a.kind, a.override_price, a.percent_off, a.buy_qty, a.free_qty,
+               a.ends_at, p.product_id
+        FROM active a
+        JOIN CategoryClosure cc ON cc.ancestor_id = a.category_id
+        JOIN Product p ON p.category_id = cc.descendant_id
+        WHERE %(everything)s OR p.product_id IN (SELECT product_id FROM scope)
+    ),
+    price_rule AS (
+        SELECT DISTINCT ON (product_id) product_id, promotion_id, override_price, percent_off, ends_at
+        FROM targets
+        WHERE kind IN ('price_override', 'category_percent')
+        ORDER BY product_id, (kind = 'price_override') DESC, percent_off DESC NULLS LAST, promotion_id DESC
+    ),
+    bundle_rule AS (
+        SELECT DISTINCT ON (product_id) product_id, promotion_id, buy_qty, free_qty, ends_at
+        FROM targets
+        WHERE kind = 'buy_x_get_y'
+        ORDER BY product_id, free_qty::numeric / (buy_qty + free_qty) DESC, promotion_id DESC
+    )
+    INSERT INTO EffectivePrice (product_id, override_price, percent_off, price_promotion_id, price_valid_until,
+                                buy_qty, free_qty, bundle_promotion_id, bundle_valid_until)
+    SELECT product_id, pr.override_price, pr.percent_off, pr.promotion_id, pr.ends_at,
+           br.buy_qty, br.free_qty, br.promotion_id, br.ends_at
+    FROM price_rule pr
+    FULL JOIN bundle_rule br USING (product_id)
+"""
+
+
+def free_units(quantity, buy_qty, free_qty):
+    """Units given away on a line: every full group of buy_qty + free_qty earns free_qty"""
+    if not buy_qty or not free_qty:
+        return 0
+    return quantity // (buy_qty + free_qty) * free_qty
+
+
+def refresh_effective_prices(cursor=None, product_ids=None, category_id=None):
+    """
+    Rebuild EffectivePrice from the currently active promotions.
+
+    Pass a cursor to run inside the caller's transaction (rule edits, and
+    product/category moves that change which products a category rule
+    reaches, do this so the table changes together with the edit). Readers
+    keep seeing the old rows until commit.
+
+    With product_ids and/or category_id only those products (and the
+    category's subtree) are recompiled; their Product rows are locked in id
+    order so overlapping refreshes queue per product. Without either, the
+    whole table is rebuilt under a table lock.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if cursor is not None:
+        params = {
+            'everything': product_ids is None and category_id is None,
+            'product_ids': list(product_ids) if product_ids is not None else None,
+            'category_id': category_id,
+        }
+        if params['everything']:
+            cursor.execute("LOCK TABLE EffectivePrice IN EXCLUSIVE MODE")
+            cursor.execute("DELETE FROM EffectivePrice")
+        else:
+            cursor.execute(f"""
+                SELECT product_id FROM Product
+                WHERE product_id IN ({SCOPE_SQL})
+                ORDER BY product_id
+                FOR NO KEY UPDATE
+            """, params)
+            cursor.execute(f"DELETE FROM EffectivePrice WHERE product_id IN ({SCOPE_SQL})", params)
+        cursor.execute(COMPILE_SQL, params)
+        return True, f"{cursor.rowcount} product(s) on promotion."
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        ok, message = refresh_effective_prices(conn.cursor())
+        conn.commit()
+        return ok, message
+    except Exception as e:
+        conn.rollback()
+        log(f"Error refreshing effective prices: {e}")
+        return False, str(e)
+    finally:
+        conn.close()
+
+
+@traced
+def create_promotion(name, kind, product_id=None, category_id=None, override_cents=None,
+                     percent_off=None, buy_qty=None, free_qty=None, starts_at=None, ends_at=None):
+    """
+    Add a promotion and recompile effective prices in the same transaction.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if kind not in PROMOTION_KINDS:
+        return False, f"Unknown promotion type '{kind}'."
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO Promotion (promotion_name, kind, product_id, category_id, override_price,
+                                   percent_off, buy_qty, free_qty, starts_at, ends_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s)
+            RETURNING promotion_id
+        """, (name.strip(), kind, product_id, category_id,
+              from_cents(override_cents) if override_cents is not None else None,
+              percent_off, buy_qty, free_qty, starts_at, ends_at))
+        promotion_id = cursor.fetchone()[0]
+        refresh_effective_prices(cursor, product_ids=[product_id] if product_id else None, category_id=category_id)
+        conn.commit()
+        return True, f"Promotion #{promotion_id} created."
+    except errors.CheckViolation:
+        conn.rollback()
+        return False, "Promotion details don't match its type."
+    except errors.ForeignKeyViolation:
+        conn.rollback()
+        return False, "Invalid product or category."
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error creating promotion: {e}"
+    finally:
+        conn.close()
+
+
+@traced
+def deactivate_promotion(promotion_id):
+    """
+    Switch a promotion off (kept for history) and recompile effective prices.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE Promotion SET is_active = FALSE
+            WHERE promotion_id = %s AND is_active
+            RETURNING product_id, category_id
+        """, (promotion_id,))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return False, "Promotion not found or already inactive."
+        product_id, category_id = row
+        refresh_effective_prices(cursor, product_ids=[product_id] if product_id else None, category_id=category_id)
+        conn.commit()
+        return True, f"Promotion #{promotion_id} ended."
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error ending promotion: {e}"
+    finally:
+        conn.close()
+
+
+@traced
+def list_promotions():
+    """
+    Returns promotions newest first:
+    [(id, name, kind, target_name, override_cents, percent_off, buy_qty, free_qty,
+      starts_at, ends_at, is_active, products_covered)]
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT pr.promotion_id, pr.promotion_name, pr.kind,
+                   COALESCE(p.product_name, c.category_name),
+                   (pr.override_price * 100)::bigint, pr.percent_off, pr.buy_qty, pr.free_qty,
+                   pr.starts_at, pr.ends_at, pr.is_active,
+                   (SELECT COUNT(*) FROM EffectivePrice e
+                     WHERE e.price_promotion_id = pr.promotion_id OR e.bundle_promotion_id = pr.promotion_id)
+            FROM Promotion pr
+            LEFT JOIN Product p ON p.product_id = pr.product_id
+            LEFT JOIN Category c ON c.category_id = pr.category_id
+            ORDER BY pr.is_active DESC, pr.promotion_id DESC
+        """)
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching promotions: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Every few minutes so scheduled promotions start on time: python promotions.py
+    ok, message = refresh_effective_prices()
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
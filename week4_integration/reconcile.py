@@ -0,0 +1,242 @@
+import argparse
+import sys
+from multiprocessing import Pool
+
+from db_connect import get_connection
+from rollup import read_sale_high_water
+
+DEFAULT_WORKERS = 4
+DEFAULT_SALE_CHUNK = 200000     # sale_ids per task (~ a few hundred thousand lines)
+DEFAULT_PRODUCT_CHUNK = 5000    # product_ids per task
+SAMPLE_LIMIT = 20               # mismatching rows kept per check for the report
+
+# Sales whose header total differs from the sum of their lines.
+# The ranges are scanned with the sale_id indexes, so each task touches only its own slice.
+TOTALS_SQL = """
+    SELECT s.sale_id, s.total_amount, COALESCE(i.items_total, 0)
+    FROM Sale s
+    LEFT JOIN (
+        SELECT sale_id, SUM(subtotal) AS items_total
+        FROM SaleItem
+        WHERE sale_id BETWEEN %(low)s AND %(high)s
+        GROUP BY sale_id
+    ) i ON i.sale_id = s.sale_id
+    WHERE s.sale_id BETWEEN %(low)s AND %(high)s
+      AND s.total_amount <> COALESCE(i.items_total, 0)
+    ORDER BY s.sale_id
+"""
+
+# Same condition, fixed in one statement per chunk; CustomerStats moves by the same delta
+# and the repaired months are flagged for re-export by snapshot.py
+REPAIR_TOTALS_SQL = """
+    WITH fixed AS (
+        UPDATE Sale s
+           SET total_amount = t.items_total
+          FROM (
+            SELECT s2.sale_id, s2.total_amount AS old_total, COALESCE(SUM(si.subtotal), 0) AS items_total
+            FROM Sale s2
+            LEFT JOIN SaleItem si ON si.sale_id = s2.sale_id
+            WHERE s2.sale_id BETWEEN %(low)s AND %(high)s
+            GROUP BY s2.sale_id
+          ) t
+         WHERE s.sale_id = t.sale_id
+           AND s.total_amount = t.old_total
+           AND t.old_total <> t.items_total
+        RETURNING s.customer_id, s.sale_date, t.items_total - t.old_total AS delta
+    ), marked AS (
+        INSERT INTO SnapshotDirtyMonth (month)
+        SELECT DISTINCT date_trunc('month', sale_date)::date FROM fixed ORDER BY 1  -- lock order across workers
+        ON CONFLICT (month) DO UPDATE SET version = SnapshotDirtyMonth.version + 1
+    ), by_customer AS (
+        SELECT customer_id, SUM(delta) AS delta
+        FROM fixed
+        WHERE customer_id IS NOT NULL
+        GROUP BY customer_id
+    ), stats AS (
+        UPDATE CustomerStats cs
+           SET lifetime_spend = cs.lifetime_spend + b.delta
+          FROM by_customer b
+         WHERE cs.customer_id = b.customer_id
+    )
+    SELECT COUNT(*) FROM fixed
+"""
+
+# (location, product) pairs whose on-hand stock differs from the sum of their
+# ledger movements. A full join also catches ledger rows for a pair with no
+# LocationStock row (on hand 0). One statement, so a sale committing mid-scan
+# is either fully in or fully out.
+STOCK_DIFF_SQL = """
+    SELECT COALESCE(ls.location_id, m.location_id) AS location_id,
+           COALESCE(ls.product_id, m.product_id) AS product_id,
+           COALESCE(ls.quantity, 0) AS quantity,
+           COALESCE(m.ledger, 0) AS ledger
+    FROM (
+        SELECT location_id, product_id, quantity
+        FROM LocationStock
+        WHERE product_id BETWEEN %(low)s AND %(high)s
+    ) ls
+    FULL JOIN (
+        SELECT location_id, product_id, SUM(change) AS ledger
+        FROM StockMovement
+        WHERE product_id BETWEEN %(low)s AND %(high)s
+        GROUP BY location_id, product_id
+    ) m ON m.location_id = ls.location_id AND m.product_id = ls.product_id
+    WHERE COALESCE(ls.quantity, 0) <> COALESCE(m.ledger, 0)
+"""
+
+STOCK_SQL = f"""
+    SELECT location_id, product_id, quantity, ledger
+    FROM ({STOCK_DIFF_SQL}) d
+    ORDER BY product_id, location_id
+"""
+
+# Trust the on-hand count (it is what was last counted or edited) and post the difference
+REPAIR_STOCK_SQL = f"""
+    INSERT INTO StockMovement (location_id, product_id, change, reason)
+    SELECT location_id, product_id, quantity - ledger, 'correction'
+    FROM ({STOCK_DIFF_SQL}) d
+"""
+
+CHECKS = {
+    'totals': (TOTALS_SQL, REPAIR_TOTALS_SQL),
+    'stock': (STOCK_SQL, REPAIR_STOCK_SQL),
+}
+
+
+def _ranges(low, high, size):
+    """Split [low, high] into inclusive (start, end) chunks of at most size ids"""
+    start = low
+    while start <= high:
+        end = min(start + size - 1, high)
+        yield start, end
+        start = end + 1
+
+
+def _check_chunk(task):
+    """
+    Worker: scan one id range on its own connection.
+
+    Returns:
+        (check, mismatches, repaired, samples, error)
+    """
+    check, low, high, repair = task
+    find_sql, repair_sql = CHECKS[check]
+    params = {'low': low, 'high': high}
+
+    conn = get_connection()
+    if not conn:
+        return check, 0, 0, [], f"{check} {low}-{high}: database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(find_sql, params)
+        rows = cursor.fetchall()
+        repaired = 0
+        if rows and repair:
+            cursor.execute(repair_sql, params)
+            repaired = cursor.fetchone()[0] if check == 'totals' else cursor.rowcount
+        conn.commit()
+        return check, len(rows), repaired, rows[:SAMPLE_LIMIT], None
+    except Exception as e:
+        conn.rollback()
+        return check, 0, 0, [], f"{check} {low}-{high}: {e}"
+    finally:
+        conn.close()
+
+
+def _plan(sale_chunk, product_chunk):
+    """Id bounds for each check. Sales stop at the committed high-water mark, so in-flight sales are skipped."""
+    conn = get_connection()
+    if not conn:
+        return None
+
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        high_sale = read_sale_high_water(cursor)
+        cursor.execute("SELECT COALESCE(MIN(sale_id), 1) FROM Sale")
+        low_sale = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MIN(product_id), 1), COALESCE(MAX(product_id), 0) FROM Product")
+        low_product, high_product = cursor.fetchone()
+    finally:
+        conn.close()
+
+    tasks = [('totals', lo, hi) for lo, hi in _ranges(low_sale, high_sale, sale_chunk)]
+    tasks += [('stock', lo, hi) for lo, hi in _ranges(low_product, high_product, product_chunk)]
+    return tasks
+
+
+def run_reconciliation(repair_totals=False, repair_stock=False, workers=DEFAULT_WORKERS,
+                       sale_chunk=DEFAULT_SALE_CHUNK, product_chunk=DEFAULT_PRODUCT_CHUNK):
+    """
+    Compare Sale.total_amount with SUM(SaleItem.subtotal) and each
+    LocationStock.quantity with SUM(StockMovement.change) for that location.
+
+    Both tables are split into id ranges that a pool of worker processes
+    scans in parallel, each on its own connection. Repairs run per chunk in
+    that chunk's transaction, so a large fix is applied in small batches.
+
+    Returns:
+        dict: {check: {'mismatches', 'repaired', 'samples'}, 'errors': [...]},
+              or None if the database is unreachable.
+    """
+    tasks = _plan(sale_chunk, product_chunk)
+    if tasks is None:
+        return None
+
+    repair = {'totals': repair_totals, 'stock': repair_stock}
+    result = {check: {'mismatches': 0, 'repaired': 0, 'samples': []} for check in CHECKS}
+    result['errors'] = []
+
+    with Pool(processes=workers) as pool:
+        jobs = [(check, low, high, repair[check]) for check, low, high in tasks]
+        for check, mismatches, repaired, samples, error in pool.imap_unordered(_check_chunk, jobs):
+            if error:
+                result['errors'].append(error)
+                continue
+            summary = result[check]
+            summary['mismatches'] += mismatches
+            summary['repaired'] += repaired
+            summary['samples'].extend(samples[:SAMPLE_LIMIT - len(summary['samples'])])
+
+    for check in CHECKS:
+        result[check]['samples'].sort()
+    return result
+
+
+if __name__ == "__main__":
+    # Nightly in the maintenance window: python reconcile.py --workers 8 --repair-totals
+    parser = argparse.ArgumentParser(description="Check Sale totals and stock against their line items and ledger.")
+    parser.add_argument("--repair-totals", action="store_true", help="set Sale.total_amount to the sum of its lines")
+    parser.add_argument("--repair-stock", action="store_true", help="post correction movements so the ledger matches on-hand stock")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="parallel worker processes")
+    parser.add_argument("--sale-chunk", type=int, default=DEFAULT_SALE_CHUNK, help="sale_ids per task")
+    parser.add_argument("--product-chunk", type=int, default=DEFAULT_PRODUCT_CHUNK, help="product_ids per task")
+    args = parser.parse_args()
+
+    result = run_reconciliation(args.repair_totals, args.repair_stock, args.workers,
+                                args.sale_chunk, args.product_chunk)
+    if result is None:
+        print("❌ Database connection failed")
+        sys.exit(1)
+
+    headers = {
+        'totals': "sale_id, total_amount, sum of lines",
+        'stock': "location_id, product_id, quantity, ledger",
+    }
+    unresolved = 0
+    for check in CHECKS:
+        summary = result[check]
+        print(f"{check}: {summary['mismatches']} mismatch(es), {summary['repaired']} repaired")
+        if summary['samples']:
+            print(f"  sample ({headers[check]}):")
+            for row in summary['samples']:
+                print("   ", ", ".join(str(v) for v in row))
+        unresolved += summary['mismatches'] - summary['repaired']
+
+    for error in result['errors']:
+        print(f"❌ {error}")
+
+    ok = unresolved == 0 and not result['errors']
+    print("✅ Consistent." if ok else f"❌ {unresolved} unresolved mismatch(es).")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,195 @@
+import argparse
+import sys
+
+from db_connect import get_connection
+from tracing import log, traced
+
+# How long a cart's hold lasts without activity; every sync pushes it out again
+HOLD_MINUTES = 15
+
+# Expired holds released per sweeper transaction
+SWEEP_BATCH = 500
+
+# Lock order everywhere: a cart's StockReservation rows first, then LocationStock
+# rows in (location_id, product_id) order. Checkout, cart syncs and the sweeper
+# all follow it, so they can't deadlock each other.
+
+
+@traced
+def sync_holds(hold_key, location_id, quantities, minutes=HOLD_MINUTES):
+    """
+    Make a cart's holds at one location match its current lines.
+
+    Args:
+        hold_key (str): Cart or web-order id, chosen by the client.
+        location_id (int): Store whose stock is held.
+        quantities (dict): {product_id: quantity}; products left out are released.
+        minutes (int): Hold lifetime from now.
+
+    Returns:
+        (bool, str): (Success/Fail, Message). On failure nothing changes.
+    """
+    if not hold_key or len(hold_key) > 64:
+        return False, "Invalid hold key."
+    quantities = {int(pid): int(qty) for pid, qty in quantities.items() if int(qty) > 0}
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT product_id, quantity
+            FROM StockReservation
+            WHERE hold_key = %s AND location_id = %s AND status = 'active'
+            FOR UPDATE
+        """, (hold_key, location_id))
+        held = dict(cursor.fetchall())
+
+        product_ids = sorted(set(held) | set(quantities))
+        if not product_ids:
+            conn.rollback()
+            return True, "Nothing held."
+        cursor.execute("""
+            SELECT ls.product_id, ls.quantity, ls.reserved, p.product_name
+            FROM LocationStock ls
+            JOIN Product p ON p.product_id = ls.product_id
+            WHERE ls.location_id = %s AND ls.product_id = ANY(%s)
+            ORDER BY ls.product_id
+            FOR UPDATE OF ls
+        """, (location_id, product_ids))
+        stock = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        for pid in product_ids:
+            qty, old = quantities.get(pid, 0), held.get(pid, 0)
+            if pid not in stock:
+                raise ValueError(f"Product ID {pid} is not stocked at this location.")
+            on_hand, reserved, name = stock[pid]
+            available = on_hand - (reserved - old)
+            if qty > old and qty > available:
+                conn.rollback()
+                return False, f"Not enough stock for '{name}'. (Available: {max(available, 0)}, Requested: {qty})"
+
+            if qty != old:
+                cursor.execute("""
+                    UPDATE LocationStock SET reserved = reserved + %s
+                    WHERE location_id = %s AND product_id = %s
+                """, (qty - old, location_id, pid))
+            if qty == 0:
+                cursor.execute("""
+                    UPDATE StockReservation SET status = 'released'
+                    WHERE hold_key = %s AND location_id = %s AND product_id = %s AND status = 'active'
+                """, (hold_key, location_id, pid))
+            elif old:
+                cursor.execute("""
+                    UPDATE StockReservation
+                       SET quantity = %s, expires_at = CURRENT_TIMESTAMP + make_interval(mins => %s)
+                    WHERE hold_key = %s AND location_id = %s AND product_id = %s AND status = 'active'
+                """, (qty, minutes, hold_key, location_id, pid))
+            else:
+                cursor.execute("""
+                    INSERT INTO StockReservation (hold_key, location_id, product_id, quantity, expires_at)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(mins => %s))
+                """, (hold_key, location_id, pid, qty, minutes))
+
+        conn.commit()
+        return True, f"Holding {sum(quantities.values())} unit(s) for {minutes} minutes."
+
+    except Exception as e:
+        conn.rollback()
+        log(f"Hold sync failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
+
+
+@traced
+def release_holds(hold_key, location_id):
+    """Drop every active hold of a cart (e.g. the cart was abandoned)"""
+    return sync_holds(hold_key, location_id, {})
+
+
+def convert_holds(cursor, hold_key, location_id, sale_id):
+    """
+    Mark a cart's active holds as sold, on create_sale's cursor. Returns
+    {product_id: quantity}; the caller takes these off LocationStock.reserved
+    while it has the stock rows locked, so the sale may use the held units.
+    """
+    cursor.execute("""
+        UPDATE StockReservation
+           SET status = 'converted', sale_id = %s
+         WHERE hold_key = %s AND location_id = %s AND status = 'active'
+        RETURNING product_id, quantity
+    """, (sale_id, hold_key, location_id))
+    return dict(cursor.fetchall())
+
+
+def expire_holds(batch_size=SWEEP_BATCH):
+    """
+    Release holds past their expiry in batches of batch_size, one transaction
+    each. SKIP LOCKED leaves holds that a checkout or cart sync is touching
+    right now to that transaction, so the sweeper never waits on a till.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    expired = 0
+    try:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("""
+                WITH due AS (
+                    SELECT reservation_id
+                    FROM StockReservation
+                    WHERE status = 'active' AND expires_at <= CURRENT_TIMESTAMP
+                    ORDER BY expires_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE StockReservation r
+                   SET status = 'expired'
+                  FROM due
+                 WHERE r.reservation_id = due.reservation_id
+                RETURNING r.location_id, r.product_id, r.quantity
+            """, (batch_size,))
+            rows = cursor.fetchall()
+
+            released = {}
+            for location_id, product_id, quantity in rows:
+                key = (location_id, product_id)
+                released[key] = released.get(key, 0) + quantity
+            cursor.executemany("""
+                UPDATE LocationStock SET reserved = reserved - %s
+                WHERE location_id = %s AND product_id = %s
+            """, [(qty, loc, pid) for (loc, pid), qty in sorted(released.items())])
+
+            conn.commit()
+            expired += len(rows)
+            if len(rows) < batch_size:
+                break
+
+        return True, f"Expired {expired} hold(s)."
+
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error expiring holds: {e}"
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Every minute: python reservations.py
+    parser = argparse.ArgumentParser(description="Release stock holds past their expiry.")
+    parser.add_argument("--batch", type=int, default=SWEEP_BATCH, help="holds released per transaction")
+    args = parser.parse_args()
+
+    ok, message = expire_holds(args.batch)
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,208 @@
+import sys
+from datetime import datetime, timedelta
+
+from db_connect import get_connection
+from tracing import log, traced
+
+GRAINS = ('hour', 'day', 'month')
+DIMENSIONS = ('all', 'product', 'category', 'operator')
+
+# Advisory lock key shared by create_sale (shared) and the refresh job (exclusive)
+SALE_WATERMARK_LOCK = 4301
+
+
+def hold_sale_watermark(cursor):
+    """
+    Called by create_sale before it inserts a Sale. Holding this shared lock
+    for the transaction lets the refresh job wait for in-flight sales, so a
+    sale_id can never commit below a watermark that has already been read.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock_shared(%s)", (SALE_WATERMARK_LOCK,))
+
+
+def read_sale_high_water(cursor):
+    """Highest sale_id that is guaranteed to be committed (0 if no sales)"""
+    cursor.execute("SELECT pg_advisory_lock(%s)", (SALE_WATERMARK_LOCK,))
+    try:
+        cursor.execute("SELECT COALESCE(MAX(sale_id), 0) FROM Sale")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (SALE_WATERMARK_LOCK,))
+
+
+def refresh_rollups():
+    """
+    Fold every sale committed since the last run into SalesRollup.
+
+    One pass over the new Sale/SaleItem rows produces hourly, daily and
+    monthly buckets for all dimensions at once (GROUPING SETS), which are
+    added onto the existing buckets. The watermark moves in the same
+    transaction, so a failed run is simply retried.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        high = read_sale_high_water(cursor)
+        conn.autocommit = False
+
+        cursor.execute("""
+            INSERT INTO RollupWatermark (rollup_name, last_sale_id) VALUES ('sales', 0)
+            ON CONFLICT (rollup_name) DO NOTHING
+        """)
+        cursor.execute("SELECT last_sale_id FROM RollupWatermark WHERE rollup_name = 'sales' FOR UPDATE")
+        low = cursor.fetchone()[0]
+
+        if high <= low:
+            conn.commit()
+            return True, "Rollups already up to date."
+
+        cursor.execute("""
+            WITH lines AS (
+                SELECT s.sale_id, s.sale_date, s.operator_id,
+                       si.product_id, p.category_id, si.quantity, si.subtotal
+                FROM Sale s
+                JOIN SaleItem si ON si.sale_id = s.sale_id
+                JOIN Product p ON p.product_id = si.product_id
+                WHERE s.sale_id > %(low)s AND s.sale_id <= %(high)s
+            )
+            INSERT INTO SalesRollup (grain, bucket_start, dimension, dimension_id, revenue, units, basket_count)
+            SELECT g.grain,
+                   date_trunc(g.grain, l.sale_date),
+                   CASE WHEN GROUPING(l.product_id) = 0 THEN 'product'
+                        WHEN GROUPING(l.category_id) = 0 THEN 'category'
+                        WHEN GROUPING(l.operator_id) = 0 THEN 'operator'
+                        ELSE 'all' END,
+                   COALESCE(l.product_id, l.category_id, l.operator_id, 0),
+                   SUM(l.subtotal),
+                   SUM(l.quantity),
+                   COUNT(DISTINCT l.sale_id)
+            FROM lines l
+            CROSS JOIN (VALUES ('hour'), ('day'), ('month')) AS g(grain)
+            GROUP BY g.grain, date_trunc(g.grain, l.sale_date),
+                     GROUPING SETS ((l.product_id), (l.category_id), (l.operator_id), ())
+            ON CONFLICT (grain, dimension, dimension_id, bucket_start) DO UPDATE
+               SET revenue = SalesRollup.revenue + EXCLUDED.revenue,
+                   units = SalesRollup.units + EXCLUDED.units,
+                   basket_count = SalesRollup.basket_count + EXCLUDED.basket_count
+        """, {"low": low, "high": high})
+
+        cursor.execute("""
+            UPDATE RollupWatermark
+               SET last_sale_id = %s, refreshed_at = CURRENT_TIMESTAMP
+             WHERE rollup_name = 'sales'
+        """, (high,))
+
+        conn.commit()
+        return True, f"Rolled up sales {low + 1}..{high}."
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Rollup refresh failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
+
+
+@traced
+def get_revenue_series(grain, start, end, dimension='all', dimension_id=0):
+    """
+    Read one series straight from SalesRollup.
+
+    Args:
+        grain (str): 'hour', 'day' or 'month'.
+        start, end (datetime): Bucket range, end exclusive.
+        dimension (str): 'all', 'product', 'category' or 'operator'.
+        dimension_id (int): ID within the dimension (ignored for 'all').
+
+    Returns:
+        list: [(bucket_start, revenue_cents, units, basket_count, avg_basket_cents)]
+    """
+    if grain not in GRAINS or dimension not in DIMENSIONS:
+        return []
+    if dimension == 'all':
+        dimension_id = 0
+
+    conn = get_connection()
+    if not conn:
+        return []
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT bucket_start, (revenue * 100)::bigint, units, basket_count,
+                   ROUND(revenue * 100 / NULLIF(basket_count, 0))::bigint
+            FROM SalesRollup
+            WHERE grain = %s AND dimension = %s AND dimension_id = %s
+              AND bucket_start >= %s AND bucket_start < %s
+            ORDER BY bucket_start
+        """, (grain, dimension, dimension_id, start, end))
+        return cursor.fetchall()
+    except Exception as e:
+        log(f"Error fetching revenue series: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def _shift_year(value, years):
+    try:
+        return value.replace(year=value.year + years)
+    except ValueError:
+        # 29 Feb -> 28 Feb
+        return value.replace(year=value.year + years, day=28)
+
+
+@traced
+def get_yoy_series(grain='day', periods=30, dimension='all', dimension_id=0):
+    """
+    The last `periods` buckets alongside the same buckets one year earlier.
+
+    Returns:
+        dict: {'labels': [...], 'current': [...], 'previous': [...]}
+        with revenue as integer cents, zero-filled for empty buckets.
+    """
+    now = datetime.now()
+    if grain == 'month':
+        end = (now.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=32)).replace(day=1)
+        starts = []
+        cursor_date = end
+        for _ in range(periods):
+            cursor_date = (cursor_date - timedelta(days=1)).replace(day=1)
+            starts.append(cursor_date)
+        starts.reverse()
+        label_format = '%Y-%m'
+    else:
+        step = timedelta(hours=1) if grain == 'hour' else timedelta(days=1)
+        if grain == 'hour':
+            end = now.replace(minute=0, second=0, microsecond=0) + step
+            label_format = '%m-%d %H:00'
+        else:
+            end = now.replace(hour=0, minute=0, second=0, microsecond=0) + step
+            label_format = '%m-%d'
+        starts = [end - step * (periods - i) for i in range(periods)]
+
+    start = starts[0]
+    current = {row[0]: row[1] for row in get_revenue_series(grain, start, end, dimension, dimension_id)}
+    previous = {row[0]: row[1] for row in get_revenue_series(
+        grain, _shift_year(start, -1), _shift_year(end, -1), dimension, dimension_id)}
+
+    return {
+        'labels': [s.strftime(label_format) for s in starts],
+        'current': [current.get(s, 0) for s in starts],
+        'previous': [previous.get(_shift_year(s, -1), 0) for s in starts],
+    }
+
+
+if __name__ == "__main__":
+    # Run every minute or so from cron: python rollup.py
+    ok, message = refresh_rollups()
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
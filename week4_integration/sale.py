@@ -1,6 +1,17 @@
 from db_connect import get_connection
+from tracing import traced, log
+from customer_stats import record_sale
+from rollup import hold_sale_watermark
+from events import notify_sale_committed
+from crud_product import record_stock_movement
+from money import from_cents, format_money
+from promotions import EFFECTIVE_PRICE_JOIN, EFFECTIVE_PRICE_CENTS, free_units
+from reservations import convert_holds
+import metrics
+from idempotency import claim_key, store_result, get_result, checkout_results
 
-def create_sale(operator_id, customer_id, items):
+@traced
+def create_sale(operator_id, customer_id, items, location_id, hold_key=None, idempotency_key=None):
     """
     Executes a sales transaction.
     
@@ -8,6 +19,10 @@ def create_sale(operator_id, customer_id, items):
         operator_id (int): ID of the logged-in user.
         customer_id (int or None): ID of the customer (optional).
         items (list): List of dicts [{'product_id': 1, 'quantity': 2}, ...]
+        location_id (int): Store the sale is rung up at; stock comes from there.
+        hold_key (str or None): Cart whose stock holds (reservations.py) this sale uses up.
+        idempotency_key (str or None): Checkout attempt id. A retry with a key
+            that already committed returns the original result and changes nothing.
 
     Returns:
         (bool, str): (Success/Fail, Message)
@@ -20,67 +35,115 @@ def create_sale(operator_id, customer_id, items):
     cursor = None
     try:
         cursor = conn.cursor()
+        if idempotency_key and not claim_key(cursor, idempotency_key):
+            conn.rollback()
+            metrics.inc('checkout_total', (('result', 'replay'),))
+            return True, get_result(idempotency_key)
+        hold_sale_watermark(cursor)
         
         # --- STEP 1: Create the Sale Record (Parent) ---
-        print(f"Creating Sale for Operator {operator_id}, Customer {customer_id}...")
+        log(f"Creating Sale for Operator {operator_id}, Customer {customer_id}...")
         
         query_sale = """
-            INSERT INTO Sale (operator_id, customer_id, total_amount)
-            VALUES (%s, %s, 0)
-            RETURNING sale_id
+            INSERT INTO Sale (operator_id, customer_id, location_id, total_amount)
+            VALUES (%s, %s, %s, 0)
+            RETURNING sale_id, sale_date
         """
-        cursor.execute(query_sale, (operator_id, customer_id))
+        cursor.execute(query_sale, (operator_id, customer_id, location_id))
         result = cursor.fetchone()
         if not result:
             raise Exception("Failed to create sale record")
-        sale_id = result[0]
+        sale_id, sale_date = result
         
-        total_sale_amount = 0.0
-        
-        # --- STEP 2: Process Each Item (Children) ---
+        total_cents = 0
+
+        # Same product on several rows counts as one line (so buy-X-get-Y sees the full quantity)
+        quantities = {}
         for item in items:
             p_id = int(item['product_id'])
-            qty = int(item['quantity'])
-            
-            # A. Check Stock & Price
-            cursor.execute("SELECT price, quantity_stock, product_name FROM Product WHERE product_id = %s", (p_id,))
-            product = cursor.fetchone()
-            
+            quantities[p_id] = quantities.get(p_id, 0) + int(item['quantity'])
+
+        # Units this cart already holds are the sale's own; holds of other carts stay off limits
+        held = convert_holds(cursor, hold_key, location_id, sale_id) if hold_key else {}
+
+        # A. Prices (promotions already compiled into EffectivePrice) and this store's stock for
+        #    every line in one lookup. Only the store's LocationStock rows are locked (in id order,
+        #    so concurrent sales can't deadlock); other stores selling the same product don't wait.
+        cursor.execute(f"""
+            SELECT p.product_id, {EFFECTIVE_PRICE_CENTS}, ls.quantity - ls.reserved + COALESCE(h.held, 0),
+                   p.product_name, e.buy_qty, e.free_qty
+            FROM Product p
+            JOIN LocationStock ls ON ls.location_id = %s AND ls.product_id = p.product_id
+            LEFT JOIN unnest(%s::int[], %s::int[]) AS h(product_id, held) ON h.product_id = p.product_id
+            {EFFECTIVE_PRICE_JOIN}
+            WHERE p.product_id = ANY(%s)
+            ORDER BY p.product_id
+            FOR UPDATE OF ls
+        """, (location_id, list(held), list(held.values()), sorted(set(quantities) | set(held))))
+        products = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        # --- STEP 2: Process Each Item (Children) ---
+        for p_id, qty in quantities.items():
+            product = products.get(p_id)
+
             if not product:
-                raise Exception(f"Product ID {p_id} not found.")
-            
-            price, current_stock, product_name = product
+                raise Exception(f"Product ID {p_id} is not stocked at this location.")
+
+            price_cents, current_stock, product_name, buy_qty, free_qty = product
             
             # B. Validate Inventory
             if current_stock < qty:
                 raise Exception(f"Not enough stock for '{product_name}'. (Available: {current_stock}, Requested: {qty})")
 
-            # C. Calculate Subtotal
-            subtotal = float(price) * qty
-            total_sale_amount += subtotal
+            # C. Calculate Subtotal (integer cents, exact; free units of a bundle deal cost nothing)
+            subtotal_cents = price_cents * (qty - free_units(qty, buy_qty, free_qty))
+            total_cents += subtotal_cents
             
             # D. Insert into SaleItem
             query_item = """
                 INSERT INTO SaleItem (sale_id, product_id, quantity, unit_price, subtotal)
                 VALUES (%s, %s, %s, %s, %s)
             """
-            cursor.execute(query_item, (sale_id, p_id, qty, price, subtotal))
+            cursor.execute(query_item, (sale_id, p_id, qty, from_cents(price_cents), from_cents(subtotal_cents)))
             
             # E. Decrease Stock
-            cursor.execute("UPDATE Product SET quantity_stock = quantity_stock - %s WHERE product_id = %s", (qty, p_id))
+            cursor.execute(
+                "UPDATE LocationStock SET quantity = quantity - %s, reserved = reserved - %s "
+                "WHERE location_id = %s AND product_id = %s",
+                (qty, held.pop(p_id, 0), location_id, p_id))
+            record_stock_movement(cursor, location_id, p_id, -qty, 'sale', sale_id)
+
+        # Held units the cart ended up not buying go back on sale
+        for p_id, qty in held.items():
+            cursor.execute("UPDATE LocationStock SET reserved = reserved - %s WHERE location_id = %s AND product_id = %s",
+                           (qty, location_id, p_id))
 
         # --- STEP 3: Finalize Total Amount ---
-        cursor.execute("UPDATE Sale SET total_amount = %s WHERE sale_id = %s", (total_sale_amount, sale_id))
+        cursor.execute("UPDATE Sale SET total_amount = %s WHERE sale_id = %s", (from_cents(total_cents), sale_id))
+
+        # --- STEP 4: Customer running totals (same transaction) ---
+        record_sale(cursor, customer_id, from_cents(total_cents), sale_date)
+
+        # --- STEP 5: Tell open dashboards (delivered on commit) ---
+        notify_sale_committed(cursor, sale_id)
         
+        message = f"Sale #{sale_id} completed! Total: {format_money(total_cents)}"
+        if idempotency_key:
+            store_result(cursor, idempotency_key, sale_id, message)
+
         # --- COMMIT TRANSACTION ---
         conn.commit()
-        print(f"Sale #{sale_id} committed successfully.")
-        return True, f"Sale #{sale_id} completed! Total: ${total_sale_amount:.2f}"
+        log(f"Sale #{sale_id} committed successfully.")
+        if idempotency_key:
+            checkout_results.put(idempotency_key, message)
+        metrics.inc('checkout_total', (('result', 'success'),))
+        return True, message
 
     except Exception as e:
         # --- ROLLBACK TRANSACTION ---
         conn.rollback()
-        print(f"Transaction Failed: {e}")
+        log(f"Transaction Failed: {e}")
+        metrics.inc('checkout_total', (('result', 'failure'),))
         return False, str(e)
         
     finally:
@@ -88,51 +151,87 @@ def create_sale(operator_id, customer_id, items):
             cursor.close()
         conn.close()
 
-def get_sale_history():
-    """Fetches list of recent sales for the history page."""
+# Join tables to show Names instead of IDs
+SALE_HISTORY_SQL = """
+    SELECT s.sale_id, s.sale_date, o.operator_name, c.customer_name, (s.total_amount * 100)::bigint
+    FROM Sale s
+    JOIN Operator o ON s.operator_id = o.operator_id
+    LEFT JOIN Customer c ON s.customer_id = c.customer_id
+    ORDER BY s.sale_date DESC
+    LIMIT %s
+"""
+
+@traced
+def get_sale_history(limit=50):
+    """Fetches the limit most recent sales for the history page."""
     conn = get_connection()
     if not conn: return []
     
     try:
         cursor = conn.cursor()
-        # Join tables to show Names instead of IDs
-        query = """
-            SELECT s.sale_id, s.sale_date, o.operator_name, c.customer_name, s.total_amount
-            FROM Sale s
-            JOIN Operator o ON s.operator_id = o.operator_id
-            LEFT JOIN Customer c ON s.customer_id = c.customer_id
-            ORDER BY s.sale_date DESC
-            LIMIT 50
-        """
-        cursor.execute(query)
+        cursor.execute(SALE_HISTORY_SQL, (limit,))
         return cursor.fetchall()
     except Exception as e:
-        print(f"Error fetching history: {e}")
+        log(f"Error fetching history: {e}")
         return []
     finally:
         conn.close()
 
-def get_sale_with_items(sale_id):
-    """Fetch sale details with all items"""
+def iter_sale_history(limit, batch_size=500):
+    """
+    Yields (sale, items) for the same rows as get_sale_history from a named
+    (server-side) cursor, fetching items a batch at a time, so a streamed
+    page only holds batch_size sales at once.
+    """
     conn = get_connection()
     if not conn:
-        return []
-    
+        return
+
     try:
-        cursor = conn.cursor()
-        query = """
-            SELECT 
-                si.sale_item_id,
-                p.product_name,
-                si.quantity,
-                si.unit_price,
-                si.subtotal
-            FROM SaleItem si
-            JOIN Product p ON si.product_id = p.product_id
-            WHERE si.sale_id = %s
-            ORDER BY si.sale_item_id
-        """
-        cursor.execute(query, (sale_id,))
-        return cursor.fetchall()
+        with conn.cursor(name='sale_history') as cursor:
+            cursor.execute(SALE_HISTORY_SQL, (limit,))
+            while True:
+                sales = cursor.fetchmany(batch_size)
+                if not sales:
+                    break
+                items = _fetch_items(conn.cursor(), [sale[0] for sale in sales])
+                for sale in sales:
+                    yield sale, items[sale[0]]
+    finally:
+        conn.rollback()
+        conn.close()
+
+def _fetch_items(cursor, sale_ids):
+    items = {sale_id: [] for sale_id in sale_ids}
+    cursor.execute("""
+        SELECT si.sale_id, si.sale_item_id, p.product_name, si.quantity,
+               (si.unit_price * 100)::bigint, (si.subtotal * 100)::bigint
+        FROM SaleItem si
+        JOIN Product p ON si.product_id = p.product_id
+        WHERE si.sale_id = ANY(%s)
+        ORDER BY si.sale_id, si.sale_item_id
+    """, (list(items),))
+    for row in cursor:
+        items[row[0]].append(row[1:])
+    return items
+
+@traced
+def get_items_for_sales(sale_ids):
+    """
+    Items of many sales in one query:
+    {sale_id: [(sale_item_id, product_name, quantity, unit_price_cents, subtotal_cents)]}
+    """
+    if not sale_ids:
+        return {}
+
+    conn = get_connection()
+    if not conn:
+        return {sale_id: [] for sale_id in sale_ids}
+
+    try:
+        return _fetch_items(conn.cursor(), sale_ids)
+    except Exception as e:
+        log(f"Error fetching sale items: {e}")
+        return {sale_id: [] for sale_id in sale_ids}
     finally:
         conn.close()
\ No newline at end of file
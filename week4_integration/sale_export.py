@@ -0,0 +1,134 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+from db_connect import get_connection
+
+EXPORT_COLUMNS = [
+    'sale_id', 'sale_date', 'operator_name', 'customer_id', 'customer_name',
+    'sale_item_id', 'sku', 'product_name', 'quantity', 'unit_price', 'subtotal', 'sale_total',
+]
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Rows fetched per round trip and bytes buffered per emitted chunk
+FETCH_SIZE = 5000
+CHUNK_BYTES = 64 * 1024
+
+
+def iter_sale_lines(start, end, fetch_size=FETCH_SIZE):
+    """
+    Yield one tuple per SaleItem (columns in EXPORT_COLUMNS order) for sales
+    with start <= sale_date < end, in date order. A named server-side cursor
+    keeps only fetch_size rows in memory however long the range is.
+    """
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+
+    try:
+        with conn.cursor(name='sale_export') as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute("""
+                SELECT s.sale_id, s.sale_date, o.operator_name, c.customer_id, c.customer_name,
+                       si.sale_item_id, p.sku, p.product_name, si.quantity, si.unit_price,
+                       si.subtotal, s.total_amount
+                FROM Sale s
+                JOIN SaleItem si ON si.sale_id = s.sale_id
+                JOIN Product p ON p.product_id = si.product_id
+                JOIN Operator o ON o.operator_id = s.operator_id
+                LEFT JOIN Customer c ON c.customer_id = s.customer_id
+                WHERE s.sale_date >= %s AND s.sale_date < %s
+                ORDER BY s.sale_date, s.sale_id, si.sale_item_id
+            """, (start, end))
+            for row in cursor:
+                yield row
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _encode_rows(rows, fmt):
+    """Text lines for each row; CSV gets a header first"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            yield json.dumps(record, default=str) + "\n"
+
+
+def export_sales(start, end, fmt='csv', compress=False):
+    """
+    Stream a sales export as byte chunks of roughly CHUNK_BYTES each.
+
+    Args:
+        start, end (datetime): Range of sale_date, end exclusive.
+        fmt (str): 'csv' or 'jsonl'.
+        compress (bool): gzip the stream.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip container
+    pending = []
+    size = 0
+
+    for text in _encode_rows(iter_sale_lines(start, end), fmt):
+        data = text.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def parse_date_range(start_text, end_text):
+    """'YYYY-MM-DD' strings (end inclusive) -> (start, end) datetimes with end exclusive"""
+    start = datetime.strptime(start_text, '%Y-%m-%d')
+    end = datetime.strptime(end_text, '%Y-%m-%d') + timedelta(days=1)
+    if end <= start:
+        raise ValueError("End date must not be before start date")
+    return start, end
+
+
+if __name__ == "__main__":
+    # python sale_export.py --start 2025-01-01 --end 2025-12-31 --format csv --gzip -o sales-2025.csv.gz
+    parser = argparse.ArgumentParser(description="Export sale lines for a date range.")
+    parser.add_argument("--start", default=date.today().replace(month=1, day=1).isoformat(), help="YYYY-MM-DD")
+    parser.add_argument("--end", default=date.today().isoformat(), help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    try:
+        start, end = parse_date_range(args.start, args.end)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_sales(start, end, args.format, args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
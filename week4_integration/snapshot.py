@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from db_connect import get_connection
+from locations import COMPANY_STOCK, COMPANY_STOCK_JOIN
+from rollup import read_sale_high_water
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+MANIFEST = "manifest.json"
+COMPRESSION = "zstd"
+BATCH_SIZE = 50000
+
+MONEY = pa.decimal128(12, 2)
+
+# Fact tables are partitioned by month=YYYY-MM. New sales are appended; a month
+# whose exported sales changed later (SnapshotDirtyMonth) is rewritten.
+SALE_SCHEMA = pa.schema([
+    ("sale_id", pa.int64()),
+    ("sale_date", pa.timestamp("us")),
+    ("customer_id", pa.int64()),
+    ("operator_id", pa.int64()),
+    ("total_amount", MONEY),
+])
+SALEITEM_SCHEMA = pa.schema([
+    ("sale_item_id", pa.int64()),
+    ("sale_id", pa.int64()),
+    ("sale_date", pa.timestamp("us")),
+    ("product_id", pa.int64()),
+    ("quantity", pa.int64()),
+    ("unit_price", MONEY),
+    ("subtotal", MONEY),
+])
+
+# table: (query with a {where} over Sale s, schema, date column, sale_id column)
+FACTS = {
+    "sale": ("""
+        SELECT s.sale_id, s.sale_date, s.customer_id, s.operator_id, s.total_amount
+        FROM Sale s
+        WHERE {where}
+        ORDER BY s.sale_id
+    """, SALE_SCHEMA, 1, 0),
+    "saleitem": ("""
+        SELECT si.sale_item_id, si.sale_id, s.sale_date, si.product_id,
+               si.quantity, si.unit_price, si.subtotal
+        FROM SaleItem si
+        JOIN Sale s ON s.sale_id = si.sale_id
+        WHERE {where}
+        ORDER BY si.sale_id, si.sale_item_id
+    """, SALEITEM_SCHEMA, 2, 1),
+}
+
+# Rewritten months are staged here; dataset reads skip '.'-prefixed paths
+REWRITE_DIR = ".rewrite"
+
+# Dimension tables are rewritten in full on every run
+DIMENSIONS = {
+    "product": (
+        "SELECT p.product_id, p.category_id, p.product_name, p.sku, p.price, "
+        f"{COMPANY_STOCK}, p.low_stock_threshold, p.is_active FROM Product p "
+        f"{COMPANY_STOCK_JOIN} ORDER BY p.product_id",
+        pa.schema([
+            ("product_id", pa.int64()),
+            ("category_id", pa.int64()),
+            ("product_name", pa.string()),
+            ("sku", pa.string()),
+            ("price", MONEY),
+            ("quantity_stock", pa.int64()),
+            ("low_stock_threshold", pa.int64()),
+            ("is_active", pa.bool_()),
+        ]),
+    ),
+    "category": (
+        "SELECT category_id, category_name, parent_id FROM Category ORDER BY category_id",
+        pa.schema([
+            ("category_id", pa.int64()),
+            ("category_name", pa.string()),
+            ("parent_id", pa.int64()),
+        ]),
+    ),
+    "customer": (
+        "SELECT customer_id, customer_name, phone, created_at FROM Customer ORDER BY customer_id",
+        pa.schema([
+            ("customer_id", pa.int64()),
+            ("customer_name", pa.string()),
+            ("phone", pa.string()),
+            ("created_at", pa.timestamp("us")),
+        ]),
+    ),
+}
+
+PART_NAME = re.compile(r"part-(\d+)-(\d+)-\d+\.parquet$")
+
+
+def _to_table(rows, schema):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.Table.from_arrays(
+        [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def _fetch_batches(conn, name, sql, params=None):
+    with conn.cursor(name=name) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+def _read_manifest():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_sale_id": 0}
+
+
+def _write_manifest(manifest):
+    tmp = os.path.join(SNAPSHOT_DIR, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(SNAPSHOT_DIR, MANIFEST))
+
+
+def _remove_orphan_parts(last_sale_id):
+    """Drop part files (and staged rewrites) left behind by a run that died before updating the manifest"""
+    for table in FACTS:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, table, REWRITE_DIR), ignore_errors=True)
+        for root, _dirs, files in os.walk(os.path.join(SNAPSHOT_DIR, table)):
+            for name in files:
+                match = PART_NAME.match(name)
+                if match and int(match.group(1)) > last_sale_id:
+                    os.remove(os.path.join(root, name))
+
+
+def _append_partitioned(conn, table, where, params, base=None):
+    """Write each fetched batch as one part file per month it touches, under base (default: the table's directory)"""
+    sql, schema, date_index, id_index = FACTS[table]
+    base = base or os.path.join(SNAPSHOT_DIR, table)
+    for batch_no, rows in enumerate(_fetch_batches(conn, f"snapshot_{table}", sql.format(where=where), params)):
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[row[date_index].strftime("%Y-%m")].append(row)
+
+        for month, month_rows in by_month.items():
+            directory = os.path.join(base, f"month={month}")
+            os.makedirs(directory, exist_ok=True)
+            # Named by sale_id range (+ batch number so a month split across batches can't collide)
+            first, last = month_rows[0][id_index], month_rows[-1][id_index]
+            path = os.path.join(directory, f"part-{first}-{last}-{batch_no}.parquet")
+            pq.write_table(_to_table(month_rows, schema), path, compression=COMPRESSION)
+
+
+def _read_dirty_months(conn):
+    """{month (date): version} of months whose exported sales changed since"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT month, version FROM SnapshotDirtyMonth")
+    return dict(cursor.fetchall())
+
+
+def _rewrite_month(conn, month, last_sale_id):
+    """
+    Re-export the already-exported sales (sale_id <= last_sale_id) of one
+    month. The new parts are staged under REWRITE_DIR and swapped in for the
+    old ones file by file; if the run dies midway the month stays marked and
+    is rewritten again next time.
+    """
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(date(month.year + month.month // 12, month.month % 12 + 1, 1), datetime.min.time())
+    label = f"month={month:%Y-%m}"
+    for table in FACTS:
+        staging = os.path.join(SNAPSHOT_DIR, table, REWRITE_DIR)
+        _append_partitioned(conn, table, "s.sale_date >= %s AND s.sale_date < %s AND s.sale_id <= %s",
+                            (start, end, last_sale_id), base=staging)
+
+        directory = os.path.join(SNAPSHOT_DIR, table, label)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+        staged = os.path.join(staging, label)
+        if os.path.isdir(staged):
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(staged):
+                os.replace(os.path.join(staged, name), os.path.join(directory, name))
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _clear_dirty_months(conn, dirty):
+    """Unmark the rewritten months, unless a change re-marked them meanwhile"""
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM SnapshotDirtyMonth WHERE month = %s AND version = %s", list(dirty.items()))
+    conn.commit()
+
+
+def _write_dimension(conn, table):
+    sql, schema = DIMENSIONS[table]
+    path = os.path.join(SNAPSHOT_DIR, f"{table}.parquet")
+    tmp = path + ".tmp"
+    with pq.ParquetWriter(tmp, schema, compression=COMPRESSION) as writer:
+        for rows in _fetch_batches(conn, f"snapshot_{table}", sql):
+            writer.write_table(_to_table(rows, schema))
+    os.replace(tmp, path)
+
+
+def take_snapshot(full=False):
+    """
+    Export Postgres to Parquet under SNAPSHOT_DIR.
+
+    Sale and SaleItem are appended incrementally: only sale_ids above the
+    manifest's watermark are read. Months whose exported sales were changed
+    since (customer merges, total repairs mark them in SnapshotDirtyMonth)
+    are re-exported. Product, Category and Customer are rewritten each run.
+    full=True starts over from an empty directory.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if full and os.path.isdir(SNAPSHOT_DIR):
+        shutil.rmtree(SNAPSHOT_DIR)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    manifest = _read_manifest()
+    low = manifest["last_sale_id"]
+    _remove_orphan_parts(low)
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        conn.autocommit = True
+        high = read_sale_high_water(conn.cursor())
+        conn.autocommit = False
+
+        # Read the marks before exporting, so a change made during the run stays marked.
+        # A full export already reads everything as it is now.
+        dirty = _read_dirty_months(conn)
+        if low > 0:
+            for month in sorted(dirty):
+                _rewrite_month(conn, month, low)
+
+        if high > low:
+            _append_partitioned(conn, "sale", "s.sale_id > %s AND s.sale_id <= %s", (low, high))
+            _append_partitioned(conn, "saleitem", "s.sale_id > %s AND s.sale_id <= %s", (low, high))
+
+        for table in DIMENSIONS:
+            _write_dimension(conn, table)
+
+        conn.rollback()
+        manifest.update(last_sale_id=max(high, low), updated_at=datetime.now().isoformat(timespec="seconds"))
+        _write_manifest(manifest)
+        _clear_dirty_months(conn, dirty)
+        return True, (f"Snapshot up to sale #{manifest['last_sale_id']} ({max(high - low, 0)} new sale(s), "
+                      f"{len(dirty) if low > 0 else 0} changed month(s) rewritten).")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Snapshot failed: {e}")
+        return False, str(e)
+
+    finally:
+        conn.close()
+
+
+# --- Local query API (reads the Parquet files only, never Postgres) ---
+
+def load(table, columns=None, months=None, filter=None):
+    """
+    Read a snapshot table into a pyarrow.Table.
+
+    Args:
+        table (str): 'sale', 'saleitem', 'product', 'category' or 'customer'.
+        columns (list or None): Columns to read.
+        months (list or None): ['YYYY-MM', ...] partitions to read (fact tables only).
+        filter (pyarrow.dataset.Expression or None): Extra row filter.
+    """
+    if table in DIMENSIONS:
+        dataset = ds.dataset(os.path.join(SNAPSHOT_DIR, f"{table}.parquet"), format="parquet")
+    else:
+        dataset = ds.dataset(os.path.join(SNAPSHOT_DIR, table), format="parquet", partitioning="hive")
+        if months:
+            month_filter = ds.field("month").isin(months)
+            filter = month_filter if filter is None else filter & month_filter
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def revenue_by_month(months=None):
+    """[(month, sales, revenue)] from the Sale partitions"""
+    table = load("sale", columns=["month", "sale_id", "total_amount"], months=months)
+    result = table.group_by("month").aggregate([("sale_id", "count"), ("total_amount", "sum")])
+    rows = sorted(zip(*(result.column(name).to_pylist()
+                        for name in ("month", "sale_id_count", "total_amount_sum"))))
+    return rows
+
+
+def top_products(months=None, limit=20):
+    """[(product_id, product_name, units, revenue)] ranked by revenue"""
+    items = load("saleitem", columns=["product_id", "quantity", "subtotal"], months=months)
+    totals = items.group_by("product_id").aggregate([("quantity", "sum"), ("subtotal", "sum")])
+    products = load("product", columns=["product_id", "product_name"])
+    joined = totals.join(products, "product_id").sort_by([("subtotal_sum", "descending")]).slice(0, limit)
+    return list(zip(*(joined.column(name).to_pylist()
+                      for name in ("product_id", "product_name", "quantity_sum", "subtotal_sum"))))
+
+
+if __name__ == "__main__":
+    # Nightly after close: python snapshot.py   (add --full to rebuild from scratch)
+    parser = argparse.ArgumentParser(description="Export a columnar snapshot for offline reporting.")
+    parser.add_argument("--full", action="store_true", help="discard the existing snapshot and re-export everything")
+    args = parser.parse_args()
+
+    ok, message = take_snapshot(full=args.full)
+    print(("✅ " if ok else "❌ ") + message)
+    sys.exit(0 if ok else 1)
@@ -1,11 +1,16 @@
 from db_connect import get_connection
+from tracing import traced, log
 
-def get_dashboard_stats():
+# Money values (revenue, sale totals) are integer cents; see money.py
+
+@traced
+def get_dashboard_stats(location_id):
+    """Dashboard numbers for one store: its sales and its stock"""
     conn = get_connection()
     if not conn: return {}
 
     stats = {
-        "revenue": 0.0,
+        "revenue": 0,
         "low_stock": 0,
         "total_items": 0,
         "recent_sales": [],
@@ -16,43 +21,52 @@ def get_dashboard_stats():
         cursor = conn.cursor()
 
         # 1. Total Revenue (The Money)
-        cursor.execute("SELECT SUM(total_amount) FROM Sale")
+        cursor.execute("SELECT (COALESCE(SUM(total_amount), 0) * 100)::bigint FROM Sale WHERE location_id = %s",
+                       (location_id,))
         res_rev = cursor.fetchone()
-        stats["revenue"] = float(res_rev[0]) if res_rev and res_rev[0] else 0.0
+        stats["revenue"] = res_rev[0] if res_rev else 0
 
         # 2. Low Stock Alerts (The Warning)
-        cursor.execute("SELECT COUNT(*) FROM Product WHERE quantity_stock <= low_stock_threshold")
+        cursor.execute("SELECT COUNT(*) FROM LocationStock WHERE location_id = %s AND is_low", (location_id,))
         res_low_stock = cursor.fetchone()
         stats["low_stock"] = res_low_stock[0] if res_low_stock else 0
 
-        # 3. Total Products (The Scope)
-        cursor.execute("SELECT COUNT(*) FROM Product")
+        # 3. Total Products (The Scope): active products in stock at this store
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM LocationStock ls
+            JOIN Product p ON p.product_id = ls.product_id
+            WHERE ls.location_id = %s AND ls.quantity > 0 AND p.is_active
+        """, (location_id,))
         res_total_items = cursor.fetchone()
         stats["total_items"] = res_total_items[0] if res_total_items else 0
 
         # 4. Recent 5 Sales (The Activity)
         query_recent = """
-            SELECT s.sale_id, s.sale_date, o.operator_name, s.total_amount 
+            SELECT s.sale_id, s.sale_date, o.operator_name, (s.total_amount * 100)::bigint
             FROM Sale s
             JOIN Operator o ON s.operator_id = o.operator_id
+            WHERE s.location_id = %s
             ORDER BY s.sale_date DESC LIMIT 5
         """
-        cursor.execute(query_recent)
+        cursor.execute(query_recent, (location_id,))
         stats["recent_sales"] = cursor.fetchall()
 
         # Low Stock Items (NEW)
         cursor.execute("""
-            SELECT product_name, quantity_stock, low_stock_threshold
-            FROM Product 
-            WHERE quantity_stock <= low_stock_threshold
-            ORDER BY quantity_stock ASC
+            SELECT p.product_name, ls.quantity, p.low_stock_threshold, f.order_qty
+            FROM LocationStock ls
+            JOIN Product p ON p.product_id = ls.product_id
+            LEFT JOIN ProductForecast f ON f.product_id = p.product_id
+            WHERE ls.location_id = %s AND ls.is_low
+            ORDER BY ls.quantity ASC
             LIMIT 10
-        """)
+        """, (location_id,))
 
         stats["low_stock_items"] = cursor.fetchall()
 
     except Exception as e:
-        print(f"Stats Error: {e}")
+        log(f"Stats Error: {e}")
     finally:
         conn.close()
     
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+# Finished spans are appended as Zipkin v2 JSON, one span per line. A file path,
+# or '-' for stdout; unset disables tracing and every hook below is a pass-through.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+ENABLED = bool(TRACE_FILE)
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "smallbiz-inventory")
+
+# Longest SQL text kept on a statement span
+MAX_QUERY_LENGTH = 500
+
+_current = ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+_export_file = None
+
+# W3C trace context: version-traceid-parentid-flags
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _new_id(bits=64):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """One timed operation. Entering makes it the current span for child spans and logs."""
+    def __init__(self, name, kind=None, tags=None, trace_id=None, parent_id=None, remote_service=None):
+        parent = _current.get()
+        self.trace_id = trace_id or (parent.trace_id if parent else _new_id(128))
+        self.parent_id = parent_id or (parent.span_id if parent else None)
+        self.span_id = _new_id()
+        self.name = name
+        self.kind = kind
+        self.tags = dict(tags or {})
+        self.remote_service = remote_service
+        self._token = None
+
+    def start(self):
+        self.timestamp = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def finish(self, error=None):
+        duration = time.perf_counter() - self._started
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Finished from another context (e.g. after a streamed response)
+                _current.set(None)
+            self._token = None
+        if error is not None:
+            self.tags["error"] = f"{type(error).__name__}: {error}"
+        _export(self._to_zipkin(duration))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+        return False
+
+    def _to_zipkin(self, duration):
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.timestamp * 1_000_000),
+            "duration": max(int(duration * 1_000_000), 1),
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": {k: str(v) for k, v in self.tags.items()},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        if self.kind:
+            span["kind"] = self.kind
+        if self.remote_service:
+            span["remoteEndpoint"] = {"serviceName": self.remote_service}
+        return span
+
+
+class _NoSpan:
+    """Stand-in when tracing is off"""
+    tags = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **kwargs):
+    """with span('name'): ... as a child of the current span (or a new trace)"""
+    return Span(name, **kwargs) if ENABLED else _NO_SPAN
+
+
+def current_span():
+    return _current.get()
+
+
+def traced(func):
+    """Run each call of func in a span named module.function"""
+    if not ENABLED:
+        return func
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with Span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def sql_span(query):
+    """Span for one SQL statement, named by its leading keyword"""
+    if not ENABLED:
+        return _NO_SPAN
+    text = query.decode(errors="replace") if isinstance(query, bytes) else str(query)
+    text = " ".join(text.split())
+    keyword = text.split(" ", 1)[0].upper() if text else "SQL"
+    return Span(f"sql {keyword}", kind="CLIENT", remote_service="postgres",
+                tags={"db.system": "postgresql", "db.statement": text[:MAX_QUERY_LENGTH]})
+
+
+def _export(span_json):
+    global _export_file
+    line = json.dumps(span_json, separators=(",", ":")) + "\n"
+    with _export_lock:
+        if TRACE_FILE == "-":
+            sys.stdout.write(line)
+            return
+        if _export_file is None:
+            _export_file = open(TRACE_FILE, "a", buffering=1)
+        _export_file.write(line)
+
+
+def log(message):
+    """print() for diagnostics on the request path, prefixed with the current trace and span ids"""
+    current = _current.get()
+    if current is not None:
+        message = f"[trace={current.trace_id} span={current.span_id}] {message}"
+    print(message)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds trace_id and span_id of the current span to every log record ('-' outside a trace)"""
+    def filter(self, record):
+        current = _current.get()
+        record.trace_id = current.trace_id if current else "-"
+        record.span_id = current.span_id if current else "-"
+        return True
+
+
+# Flask hooks. Flask is imported inside them because CLI jobs load this module
+# through db_connect without needing the web stack.
+
+def _start_request():
+    from flask import g, request
+    incoming = TRACEPARENT.match(request.headers.get("traceparent", ""))
+    request_span = Span(
+        f"{request.method} {request.endpoint or request.path}",
+        kind="SERVER",
+        tags={"http.method": request.method, "http.path": request.path},
+        trace_id=incoming.group(1) if incoming else None,
+        parent_id=incoming.group(2) if incoming else None,
+    ).start()
+    g.trace_spans = [request_span]
+
+
+def _tag_response(response):
+    from flask import g
+    spans = g.get("trace_spans")
+    if spans:
+        spans[0].tags["http.status_code"] = response.status_code
+        response.headers["X-Trace-Id"] = spans[0].trace_id
+    return response
+
+
+def _finish_request(exc=None):
+    # After a streamed response is fully sent; closes anything still open, innermost first
+    from flask import g
+    for open_span in reversed(g.pop("trace_spans", [])):
+        open_span.finish(exc)
+
+
+def _start_render(sender, template, context, **extra):
+    from flask import g
+    g.setdefault("trace_spans", []).append(Span(f"render {template.name}").start())
+
+
+def _finish_render(sender, template, context, **extra):
+    from flask import g
+    spans = g.get("trace_spans")
+    if spans and len(spans) > 1:
+        spans.pop().finish()
+
+
+def init_tracing(app):
+    """Trace every request of app (request span, template render spans) and tag logs with trace ids"""
+    if not ENABLED:
+        return False
+    from flask import before_render_template, template_rendered
+
+    app.before_request(_start_request)
+    app.after_request(_tag_response)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s [trace=%(trace_id)s span=%(span_id)s] %(name)s: %(message)s",
+    )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+    return True
@@ -0,0 +1,180 @@
+import json
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from psycopg2.extras import Json
+
+from db_connect import get_connection
+from tracing import log, traced
+
+
+def _new_bucket():
+    return {"sales": 0, "units": 0, "revenue": Decimal("0")}
+
+
+@traced
+def build_report(report_date):
+    """
+    Aggregate one day's sales in a single pass over that day's rows.
+
+    Lines are read from a server-side cursor ordered by sale_id, so each sale
+    is counted once when its id changes and nothing but the running totals is
+    kept in memory.
+
+    Returns:
+        dict: JSON-ready report, or None if the database is unreachable.
+    """
+    start = datetime.combine(report_date, datetime.min.time())
+    end = start + timedelta(days=1)
+
+    conn = get_connection()
+    if not conn:
+        return None
+
+    totals = _new_bucket()
+    by_operator = defaultdict(_new_bucket)
+    by_category = defaultdict(_new_bucket)
+    by_hour = defaultdict(_new_bucket)
+    category_last_sale = {}
+    walk_in_sales = 0
+    first_sale = last_sale = None
+
+    try:
+        with conn.cursor(name="z_report") as cursor:
+            cursor.itersize = 5000
+            cursor.execute("""
+                SELECT s.sale_id, s.sale_date, s.customer_id, o.operator_name,
+                       c.category_name, si.quantity, si.subtotal
+                FROM Sale s
+                JOIN Operator o ON o.operator_id = s.operator_id
+                JOIN SaleItem si ON si.sale_id = s.sale_id
+                JOIN Product p ON p.product_id = si.product_id
+                JOIN Category c ON c.category_id = p.category_id
+                WHERE s.sale_date >= %s AND s.sale_date < %s
+                ORDER BY s.sale_id, si.sale_item_id
+            """, (start, end))
+
+            current_sale = None
+            for sale_id, sale_date, customer_id, operator, category, quantity, subtotal in cursor:
+                hour = sale_date.hour
+                if sale_id != current_sale:
+                    current_sale = sale_id
+                    totals["sales"] += 1
+                    by_operator[operator]["sales"] += 1
+                    by_hour[hour]["sales"] += 1
+                    if customer_id is None:
+                        walk_in_sales += 1
+                    first_sale = first_sale or sale_date
+                    last_sale = sale_date
+
+                for bucket in (totals, by_operator[operator], by_hour[hour]):
+                    bucket["units"] += quantity
+                    bucket["revenue"] += subtotal
+                category_bucket = by_category[category]
+                category_bucket["units"] += quantity
+                category_bucket["revenue"] += subtotal
+                # A sale counts once per category however many lines it has there
+                if category_last_sale.get(category) != sale_id:
+                    category_last_sale[category] = sale_id
+                    category_bucket["sales"] += 1
+    finally:
+        conn.rollback()
+        conn.close()
+
+    def rows(groups, key=None):
+        items = sorted(groups.items(), key=key or (lambda kv: -kv[1]["revenue"]))
+        return [[name, g["sales"], g["units"], str(g["revenue"])] for name, g in items]
+
+    return {
+        "report_date": report_date.isoformat(),
+        "sale_count": totals["sales"],
+        "walk_in_sales": walk_in_sales,
+        "customer_sales": totals["sales"] - walk_in_sales,
+        "units": totals["units"],
+        "revenue": str(totals["revenue"]),
+        "average_sale": str((totals["revenue"] / totals["sales"]).quantize(Decimal("0.01"))) if totals["sales"] else "0.00",
+        "first_sale": first_sale.isoformat(timespec="minutes") if first_sale else None,
+        "last_sale": last_sale.isoformat(timespec="minutes") if last_sale else None,
+        "by_operator": rows(by_operator),
+        "by_category": rows(by_category),
+        "by_hour": rows(by_hour, key=lambda kv: kv[0]),
+    }
+
+
+@traced
+def get_report(report_date):
+    """The stored Z-report for a day (a single-row read), or None if the day isn't closed"""
+    conn = get_connection()
+    if not conn:
+        return None
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT payload, generated_at, o.operator_name
+            FROM DailyReport d
+            LEFT JOIN Operator o ON o.operator_id = d.generated_by
+            WHERE d.report_date = %s
+        """, (report_date,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        payload, generated_at, generated_by = row
+        return dict(payload, generated_at=generated_at.isoformat(timespec="minutes"), generated_by=generated_by)
+    except Exception as e:
+        log(f"Error fetching Z-report: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+@traced
+def close_day(report_date, operator_id=None):
+    """
+    Generate and store the Z-report for a finished day. Stored reports are
+    immutable: closing a day twice returns the original record.
+
+    Returns:
+        (bool, str): (Success/Fail, Message)
+    """
+    if report_date >= date.today():
+        return False, "Only past days can be closed."
+
+    report = build_report(report_date)
+    if report is None:
+        return False, "Database connection failed"
+
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO DailyReport (report_date, sale_count, revenue, payload, generated_by)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (report_date) DO NOTHING
+        """, (report_date, report["sale_count"], Decimal(report["revenue"]), Json(report), operator_id))
+        created = cursor.rowcount == 1
+        conn.commit()
+        if not created:
+            return True, f"{report_date} was already closed; showing the stored report."
+        return True, f"Closed {report_date}: {report['sale_count']} sale(s), ${report['revenue']}."
+    except Exception as e:
+        conn.rollback()
+        return False, f"Error closing day: {e}"
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Run shortly after midnight: python zreport.py [YYYY-MM-DD]  (defaults to yesterday)
+    day = (datetime.strptime(sys.argv[1], "%Y-%m-%d").date() if len(sys.argv) > 1
+           else date.today() - timedelta(days=1))
+    ok, message = close_day(day)
+    print(("✅ " if ok else "❌ ") + message)
+    if ok:
+        print(json.dumps(get_report(day), indent=2))
+    sys.exit(0 if ok else 1)